@@ -0,0 +1,267 @@
+'''Synthetic GPR Database
+	SQLite copy of the parts of the GPR schema the address update uses (address, suburb, property,
+	lot, property_lot, responsibility, agency, the responsibility change tables and the reference
+	type tables), filled with N incomplete candidate properties, plus matching GURAS layer 9/10
+	records for the MapServer stand-in. The candidate and backfill queries are the ones in
+	candidates.py with the Oracle syntax rewritten (sqliteDialect), so both branches are timed and explained.
+	SQLiteCursor adapts sqlite3 to the cx_Oracle cursor calls the update makes.
+'''
+
+import random
+import re
+import sqlite3
+from datetime import datetime, timedelta
+
+from gpr_address_update.candidates import CANDIDATE_SQL, BACKFILL_SQL
+
+SCHEMA = [
+	"create table suburb (suburb_id integer primary key, name text, postcode integer)",
+	"create table road_type (name text)",
+	"create table unit_type (name text)",
+	"create table level_type (name text)",
+	"create table agency (agency_id integer primary key, name text)",
+	"create table address (address_id integer primary key, house_no_1_prefix text, house_no_1 integer, house_no_1_suffix text,\
+		house_no_2_prefix text, house_no_2 integer, house_no_2_suffix text, road_1_name text, road_1_suffix text, road_1_type text,\
+		unit_type text, unit_no_prefix text, unit_no integer, unit_no_suffix text, level_type text, level_no_prefix text, level_no text,\
+		level_no_suffix text, building_name text, location_descriptor text, road_2_name text, road_2_type text, road_2_suffix text,\
+		lot_no text, suburb_id integer, address_type_id integer, version_no integer, update_user text, update_date text)",
+	"create table property (property_id integer primary key, property_no text, address_id integer, create_date text, create_user text, end_date text)",
+	"create table responsibility (responsibility_id integer primary key, property_id integer, agency_id integer, end_date text)",
+	"create table lot (lot_id integer primary key, plan_type text, lot_no text, section_no text, plan_no text, end_date text)",
+	"create table property_lot (property_id integer, lot_id integer, end_date text)",
+	"create table responsibility_change_type (responsibility_change_type_id integer primary key, name text)",
+	"create table responsibility_change_event (responsibility_change_event_id integer primary key, responsibility_change_type_id integer,\
+		create_date text, dealing_no text, settlement_date text)",
+	"create table responsibility_change (responsibility_change_id integer primary key, responsibility_change_event_id integer,\
+		from_responsibility_id integer, to_responsibility_id integer)",
+	"create index responsibility_change_event_create_date on responsibility_change_event (create_date)",
+	"create index responsibility_change_event_id on responsibility_change (responsibility_change_event_id)",
+	"create index property_create_date on property (create_date)",
+	"create index property_lot_property on property_lot (property_id)",
+	"create index responsibility_property on responsibility (property_id)"
+]
+
+#Oracle syntax in candidates.py and its SQLite equivalent
+SQLITE_SUBSTITUTIONS = [
+	(r"\bnvl\(", "coalesce("),
+	(r"\bdate '([0-9-]+)'", r"'\1'"),
+	(r"\bsysdate\b", "datetime('now')")
+]
+
+def sqliteDialect(sql: str) -> str:
+	#Production query text with the Oracle only syntax replaced, the columns, binds and {extra}/{create_users} are kept
+	for pattern, replacement in SQLITE_SUBSTITUTIONS:
+		sql = re.sub(pattern, replacement, sql, flags=re.IGNORECASE)
+	return sql
+
+SQLITE_CANDIDATE_SQL = sqliteDialect(CANDIDATE_SQL)
+SQLITE_BACKFILL_SQL = sqliteDialect(BACKFILL_SQL)
+
+#SQLite version of the display address query of the report rows
+SQLITE_DISPLAY_SQL = """\
+select  ad.address_id as ADDRESS_ID,
+		coalesce(ad.building_name, '') as ADDRESS,
+		trim(s.name) || ' ' || s.postcode as SUBURB_AND_POSTCODE
+from    address ad
+left join suburb s on ad.suburb_id = s.suburb_id
+where   ad.address_id in ({ids})"""
+
+#Tables of the candidate query by their alias, none may be read in full (responsibility_change_type is a small lookup table)
+SQLITE_CANDIDATE_TABLES = ("rce", "rc", "r", "r2", "p", "ad", "s", "pl", "l", "a")
+#Each branch of the candidate query finds new rows through a create_date index, (alias, index)
+SQLITE_DRIVING_INDEXES = (("rce", "responsibility_change_event_create_date"), ("p", "property_create_date"))
+
+ROAD_TYPES = ["Street", "Road", "Avenue", "Place", "Close", "Crescent", "Drive", "Lane", "Parade", "Way"]
+UNIT_TYPES = ["Unit", "Shop", "Flat", "Suite"]
+LEVEL_TYPES = ["Level", "Floor", "Basement"]
+ROAD_NAMES = ["George", "Pitt", "O'Connell", "Macquarie", "Church", "Victoria", "King", "Elizabeth", "Park", "High"]
+
+class SQLiteCursor:
+	#cx_Oracle style cursor over sqlite3
+
+	def __init__(self, connection: sqlite3.Connection):
+		self.connection = connection
+		self.cursor = connection.cursor()
+		self.arraysize = 100
+		self.rowCounts = list()
+		self.roundTrips = 0
+
+	@property
+	def description(self):
+		#Column names in upper case, as Oracle returns unquoted names
+		if self.cursor.description is None:
+			return None
+		return [(column[0].upper(),) + tuple(column[1:]) for column in self.cursor.description]
+
+	@property
+	def rowcount(self):
+		return self.cursor.rowcount
+
+	def execute(self, sql: str, binds=None, **kwargs):
+		self.roundTrips += 1
+		binds = _bindValues(binds if binds is not None else kwargs)
+		if sql.strip().lower() == "commit":
+			self.connection.commit()
+			return self
+		self.cursor.execute(sql, binds)
+		return self
+
+	def executemany(self, sql: str, rows: list, arraydmlrowcounts: bool = False):
+		#One call, like an Oracle array DML, with the row count of each row kept
+		self.roundTrips += 1
+		self.rowCounts = list()
+		for binds in rows:
+			self.cursor.execute(sql, _bindValues(binds))
+			self.rowCounts.append(self.cursor.rowcount)
+
+	def getarraydmlrowcounts(self) -> list:
+		return self.rowCounts
+
+	def fetchone(self):
+		return self.cursor.fetchone()
+
+	def fetchall(self):
+		return self.cursor.fetchall()
+
+	def fetchmany(self, size: int = None):
+		return self.cursor.fetchmany(size or self.arraysize)
+
+	def close(self):
+		self.cursor.close()
+
+def _bindValues(binds):
+	#sqlite3 has no date type, dates are stored as ISO text
+	if isinstance(binds, dict):
+		return {name: (value.strftime("%Y-%m-%d %H:%M:%S") if isinstance(value, datetime) else value) for name, value in binds.items()}
+	return binds
+
+def createDatabase(n: int, path: str = ":memory:", seed: int = 1) -> tuple:
+	#Synthetic GPR database with n candidate properties, returns (connection, GURAS lots, GURAS addresses)
+	rnd = random.Random(seed)
+	connection = sqlite3.connect(path, check_same_thread=False)
+	for statement in SCHEMA:
+		connection.execute(statement)
+
+	suburbs = [(i + 1, "SUBURB {}".format(i + 1), 2000 + i) for i in range(500)]
+	connection.executemany("insert into suburb values (?, ?, ?)", suburbs)
+	connection.executemany("insert into road_type values (?)", [(name,) for name in ROAD_TYPES])
+	connection.executemany("insert into unit_type values (?)", [(name,) for name in UNIT_TYPES])
+	connection.executemany("insert into level_type values (?)", [(name,) for name in LEVEL_TYPES])
+	connection.executemany("insert into agency values (?, ?)", [(i + 1, "Agency {}".format(i + 1)) for i in range(50)])
+
+	created = (datetime.now() - timedelta(days=10)).strftime("%Y-%m-%d %H:%M:%S")
+	#Every property also had a dealing before the candidate window (2011-06-01), so the transaction branch reads a full
+	#responsibility change history but finds nothing and the candidates are the created properties
+	transferred = "2010-03-01 00:00:00"
+	addresses, properties, responsibilities, lots, propertyLots, events, changes = [], [], [], [], [], [], []
+	gurasLots, gurasAddresses = dict(), dict()
+	lot_id = 0
+	objectid = 0
+
+	for i in range(1, n + 1):
+		suburb = suburbs[rnd.randrange(len(suburbs))]
+		addresses.append((i, suburb[0], 1))
+		properties.append((i, "P{:07d}".format(i), i, created, "ADAPTER"))
+		responsibilities.append((i, i, rnd.randint(1, 50)))
+		events.append((i, 1, transferred, "AB{:06d}".format(i)))
+		changes.append((i, i, i, i))
+
+		#Most properties have one lot, some have two
+		propid = 1000000 + i
+		for _ in range(1 if rnd.random() < 0.9 else 2):
+			lot_id += 1
+			plan_no = str(100000 + lot_id)
+			lots.append((lot_id, "DP", str(rnd.randint(1, 200)), "", plan_no))
+			propertyLots.append((i, lot_id))
+
+			#Some lots have no GURAS record
+			if rnd.random() < 0.1:
+				continue
+
+			ptlotsecpn = "DP/{}//{}".format(lots[-1][2], plan_no)
+			sppropid = propid + 5000000 if rnd.random() < 0.05 else None
+			gurasLots[ptlotsecpn] = [{"ptlotsecpn": ptlotsecpn, "propid": propid, "sppropid": sppropid}]
+
+		#GURAS address records, a few properties have more than one principal address
+		records = list()
+		for _ in range(1 if rnd.random() < 0.95 else 2):
+			objectid += 1
+			if records and rnd.random() < 0.6:
+				#Second record for the same address, either the next house number or a copy with a blank field
+				sibling = dict(records[0], objectid=objectid)
+				if rnd.random() < 0.65:
+					sibling["housenumberfirst"] += 2
+				else:
+					sibling["roadtype"] = None
+				records.append(sibling)
+				continue
+
+			hasUnit = rnd.random() < 0.15
+			records.append({
+				"objectid": objectid,
+				"propid": propid,
+				"sppropid": None,
+				"principaladdresstype": 1,
+				"housenumberfirst": rnd.randint(1, 400),
+				"housenumberfirstprefix": None,
+				"housenumberfirstsuffix": None,
+				"housenumbersecond": None,
+				"housenumbersecondprefix": None,
+				"housenumbersecondsuffix": None,
+				"roadname": rnd.choice(ROAD_NAMES).upper(),
+				"roadtype": rnd.choice(ROAD_TYPES).upper() if rnd.random() < 0.98 else "XYZ",
+				"roadsuffix": None,
+				"unittype": rnd.choice(["UNIT", "U", "SHOP"]) if hasUnit else None,
+				"unitnumber": rnd.randint(1, 40) if hasUnit else None,
+				"unitnumberprefix": None,
+				"unitnumbersuffix": None,
+				"leveltype": None,
+				"levelnumber": None,
+				"levelnumberprefix": None,
+				"levelnumbersuffix": None,
+				"buildingname": None,
+				"locationdescription": None,
+				"secondroadname": None,
+				"secondroadtype": None,
+				"secondroadsuffix": None,
+				"suburbname": suburb[1] if rnd.random() < 0.97 else "UNKNOWN",
+				"postcode": suburb[2],
+				"state": "NSW",
+				#Fields the update doesn't use, only requested for the exceptions report
+				"createdate": 1262304000000 + objectid * 1000,
+				"gurasid": 2000000 + objectid,
+				"addresstype": 1,
+				"ruraladdress": 0,
+				"addressstringtype": 1,
+				"principaladdresssiteoid": 3000000 + objectid,
+				"officialaddressstringoid": 4000000 + objectid,
+				"roadside": "L" if objectid % 2 else "R",
+				"addresssitename": None,
+				"privatestreetname": None,
+				"privatestreettype": None,
+				"privatestreetsuffix": None,
+				"council": "COUNCIL {}".format(suburb[0] % 128 + 1),
+				"deliverypointid": 50000000 + objectid,
+				"deliverypointbarcode": "1301{:08d}".format(objectid),
+				"addressconfidence": 1,
+				"contributororigin": 2,
+				"contributorid": "NSW LRS",
+				"contributoralignment": 1,
+				"routeoid": 6000000 + propid % 100000,
+				"gnafprimarysiteid": "GANSW{:09d}".format(objectid),
+				"containment": 1
+			})
+		gurasAddresses[propid] = records
+
+	connection.executemany("insert into address (address_id, suburb_id, version_no) values (?, ?, ?)", addresses)
+	connection.executemany("insert into property (property_id, property_no, address_id, create_date, create_user) values (?, ?, ?, ?, ?)", properties)
+	connection.executemany("insert into responsibility (responsibility_id, property_id, agency_id) values (?, ?, ?)", responsibilities)
+	connection.execute("insert into responsibility_change_type values (1, 'Transfer')")
+	connection.executemany("insert into responsibility_change_event (responsibility_change_event_id, responsibility_change_type_id, create_date, dealing_no) values (?, ?, ?, ?)", events)
+	connection.executemany("insert into responsibility_change (responsibility_change_id, responsibility_change_event_id, from_responsibility_id, to_responsibility_id) values (?, ?, ?, ?)", changes)
+	connection.executemany("insert into lot (lot_id, plan_type, lot_no, section_no, plan_no) values (?, ?, ?, ?, ?)", lots)
+	connection.executemany("insert into property_lot (property_id, lot_id) values (?, ?)", propertyLots)
+	connection.commit()
+	connection.execute("analyze") #Table statistics, as GPR gathers them, so SQLite plans the candidate query the way Oracle does
+
+	return connection, gurasLots, gurasAddresses
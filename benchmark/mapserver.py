@@ -0,0 +1,140 @@
+'''Local GURAS MapServer Stand-in
+	Serves layers 10 (Lot -> PropID) and 9 (PropID -> Address) from synthetic data over HTTP, with
+	the parts of the ArcGIS REST API the GURAS client uses: layer info (maxRecordCount, pagination),
+	POST/GET queries with "field in (...)" where clauses, resultOffset/resultRecordCount paging and
+	exceededTransferLimit. Latency and error rate are configurable. Layer 9 can be queried by propid or
+	objectid, and only the requested OutFields are returned.
+	Connections are kept alive (HTTP/1.1) and responses are gzipped when the client asks, so the
+	benchmark counts connections opened and bytes sent the way the real server would see them.
+'''
+
+import gzip
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WHERE_IN = re.compile(r"(\w+) in \(([^)]*)\)")
+
+class MapServerStandIn:
+
+	def __init__(self, lots: dict, addresses: dict, latency: float = 0.0, errorRate: float = 0.0, transferLimit: int = 1000, pagination: bool = True, compress: bool = True):
+		self.lots = lots #ptlotsecpn -> list of {ptlotsecpn, propid, sppropid}
+		self.addresses = addresses #propid -> list of GURAS address attributes
+		self.latency = latency #Seconds added to every query
+		self.errorRate = errorRate #Share of queries answered with 503
+		self.transferLimit = transferLimit #maxRecordCount
+		self.pagination = pagination
+		self.compress = compress #gzip responses if the client accepts it
+		self.requests = 0
+		self.connections = 0
+		self.bytesSent = 0
+		self.lock = threading.Lock()
+		self.server = None
+		self.objects = {record["objectid"]: record for records in addresses.values() for record in records} #Layer 9 by objectid
+
+	def start(self) -> str:
+		#Start serving on a free local port, returns the MapServer base URL
+		standIn = self
+
+		class Handler(BaseHTTPRequestHandler):
+			protocol_version = "HTTP/1.1" #Keep-alive
+
+			def setup(self):
+				with standIn.lock:
+					standIn.connections += 1
+				super().setup()
+
+			def log_message(self, *args):
+				pass
+
+			def do_GET(self):
+				url = urllib.parse.urlparse(self.path)
+				standIn.handle(self, url.path, urllib.parse.parse_qs(url.query))
+
+			def do_POST(self):
+				body = self.rfile.read(int(self.headers.get("Content-Length") or 0)).decode()
+				standIn.handle(self, urllib.parse.urlparse(self.path).path, urllib.parse.parse_qs(body))
+
+		self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+		self.server.daemon_threads = True
+		threading.Thread(target=self.server.serve_forever, daemon=True).start()
+		return "http://127.0.0.1:{}".format(self.server.server_port)
+
+	def stop(self):
+		if self.server:
+			self.server.shutdown()
+			self.server.server_close()
+
+	def handle(self, handler, path: str, params: dict):
+		with self.lock:
+			self.requests += 1
+
+		if self.latency:
+			time.sleep(self.latency)
+
+		if self.errorRate and random.random() < self.errorRate:
+			self._send(handler, 503, {"error": {"code": 503, "message": "Service unavailable"}})
+			return
+
+		parts = path.strip("/").split("/")
+		layer = int(parts[0])
+
+		if len(parts) == 1:
+			#Layer info
+			self._send(handler, 200, {
+				"id": layer,
+				"maxRecordCount": self.transferLimit,
+				"advancedQueryCapabilities": {"supportsPagination": self.pagination},
+				"fields": [{"name": "objectid", "type": "esriFieldTypeOID"}]})
+			return
+
+		where = params.get("where", [""])[0]
+		match = WHERE_IN.search(where)
+		keys = [key.strip().strip("'") for key in match.group(2).split(",")] if match else []
+
+		records = list()
+		if layer == 10:
+			for key in keys:
+				records.extend(self.lots.get(key, []))
+		elif match and match.group(1) == "objectid":
+			for key in keys:
+				if int(float(key)) in self.objects:
+					records.append(self.objects[int(float(key))])
+		else:
+			for key in keys:
+				records.extend(self.addresses.get(int(float(key)), []))
+
+		outFields = params.get("OutFields", ["*"])[0]
+		if outFields != "*":
+			fields = outFields.split(",")
+			records = [{name: record.get(name) for name in fields} for record in records]
+
+		offset = int(params.get("resultOffset", ["0"])[0])
+		count = min(int(params.get("resultRecordCount", [str(self.transferLimit)])[0]), self.transferLimit)
+		page = records[offset:offset + count]
+
+		result = {"features": [{"attributes": record} for record in page]}
+		if offset + count < len(records):
+			result["exceededTransferLimit"] = True
+
+		self._send(handler, 200, result)
+
+	def _send(self, handler, status: int, result: dict):
+		body = json.dumps(result).encode()
+		compressed = self.compress and "gzip" in handler.headers.get("Accept-Encoding", "")
+		if compressed:
+			body = gzip.compress(body, compresslevel=5)
+		with self.lock:
+			self.bytesSent += len(body)
+
+		handler.send_response(status)
+		handler.send_header("Content-Type", "application/json")
+		if compressed:
+			handler.send_header("Content-Encoding", "gzip")
+		handler.send_header("Content-Length", str(len(body)))
+		handler.end_headers()
+		handler.wfile.write(body)
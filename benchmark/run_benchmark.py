@@ -0,0 +1,224 @@
+'''GPR Address Update Benchmark
+	Runs the address update stages end-to-end against a synthetic GPR database (SQLite) and a local
+	GURAS MapServer stand-in, at one or more candidate counts, and prints the time of each stage.
+	Nothing talks to production Oracle or maps.six.nsw.gov.au. Stages are measured with the same
+	RunMetrics as production runs, so the JSON output has the same shape as a run's metrics file.
+
+	python benchmark/run_benchmark.py --sizes 1000 10000 100000 --latency 0.05 --error-rate 0.01
+	python benchmark/run_benchmark.py --sizes 100000 --shards 8 --workers 4 --rate 50
+	python benchmark/run_benchmark.py --explain [--oracle]
+'''
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gpr_address_update.address_writer import AddressWriter
+from gpr_address_update.backfill import processShard, shardResult, runShards, mergeShards
+from gpr_address_update.candidates import fetchCandidates, streamCandidates, explainCandidates, CANDIDATE_SQL, BACKFILL_SQL, ORDERED_SQL
+from gpr_address_update.guras import GurasClient, RetryPolicy, SharedRateLimiter
+from gpr_address_update.metrics import RunMetrics, CountingCursor
+from gpr_address_update.pipeline import timedBatches, batchStages, runBatches, processBatch
+from gpr_address_update.reference import ReferenceData
+from gpr_address_update.report import ExceptionReport, REPORT_FORMATS
+
+from gpr_db import createDatabase, SQLiteCursor, SQLITE_CANDIDATE_SQL, SQLITE_BACKFILL_SQL, SQLITE_DISPLAY_SQL, SQLITE_CANDIDATE_TABLES, SQLITE_DRIVING_INDEXES
+from mapserver import MapServerStandIn
+
+def runStages(n: int, args) -> dict:
+	#Run every stage for n candidate properties, returns the RunMetrics report
+	connection, gurasLots, gurasAddresses = createDatabase(n)
+	metrics = RunMetrics(args.trace_memory)
+	c = CountingCursor(SQLiteCursor(connection), metrics)
+
+	standIn = MapServerStandIn(gurasLots, gurasAddresses, args.latency, args.error_rate, args.transfer_limit, compress=not args.no_gzip)
+	baseURL = standIn.start()
+
+	retryPolicy = RetryPolicy(maxAttempts=5, backoffBase=0.05, backoffMax=1, timeout=30, interactive=False)
+	gurasClient = GurasClient(args.concurrency, args.rate, args.mode, retryPolicy, baseURL=baseURL, metrics=metrics)
+	stages = batchStages(gurasClient, metrics, not args.all_fields)
+
+	try:
+		with metrics.stage("Reference data"):
+			refData = ReferenceData().load(c)
+
+		addrWriter = AddressWriter(CountingCursor(SQLiteCursor(connection), metrics) if args.stream else c, args.batch_size)
+
+		if args.stream:
+			batches = timedBatches(streamCandidates(c, "2000-01-01 00:00:00", None, args.stream_batch_size, args.arraysize, SQLITE_CANDIDATE_SQL), metrics, "Candidate extraction")
+			results = runBatches(batches, stages, args.queue_size)
+		else:
+			with metrics.stage("Candidate extraction") as stage:
+				df_candidates = fetchCandidates(c, "2000-01-01 00:00:00", arraysize=args.arraysize, sql=SQLITE_CANDIDATE_SQL)
+				stage.rowsOut = len(df_candidates)
+			results = runBatches([df_candidates], stages)
+
+		exceptionReport = ExceptionReport(args.report_directory, "benchmark_{}".format(n), args.report_format)
+		for result in results:
+			processBatch(result, addrWriter, refData, gurasClient, exceptionReport, addrWriter.c, metrics, not args.all_fields, displaySQL=SQLITE_DISPLAY_SQL)
+
+		with metrics.stage("Exception report"):
+			exceptionReport.close()
+	finally:
+		standIn.stop()
+
+	connection.close()
+	report = metrics.report()
+	gurasClient.close()
+	report["info"].update({"standInRequests": standIn.requests, "standInConnections": standIn.connections, "standInBytesSent": standIn.bytesSent, "updated": addrWriter.updated, "exceptionRows": exceptionReport.rows["exceptions"]})
+	return report
+
+_limiter = None
+
+def initShardWorker(limiter: SharedRateLimiter):
+	global _limiter
+	_limiter = limiter
+
+def runShard(shard: int, shards: int, path: str, baseURL: str, args, reportDirectory: str) -> dict:
+	#Worker process: one shard of the file database, same steps as a backfill.py shard
+	started = time.perf_counter()
+	metrics = RunMetrics(args.trace_memory)
+	connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+	c = CountingCursor(SQLiteCursor(connection), metrics)
+
+	retryPolicy = RetryPolicy(maxAttempts=5, backoffBase=0.05, backoffMax=1, timeout=30, interactive=False)
+	gurasClient = GurasClient(args.concurrency, args.rate, args.mode, retryPolicy, baseURL=baseURL, metrics=metrics, limiter=_limiter)
+
+	with metrics.stage("Reference data"):
+		refData = ReferenceData().load(c)
+
+	exceptionReport = ExceptionReport(reportDirectory, "benchmark_shard{}".format(shard), "csv")
+	try:
+		addresses, addrWriter = processShard(c, CountingCursor(SQLiteCursor(connection), metrics), gurasClient, refData, "2000-01-01 00:00:00",
+											(shard, shards), exceptionReport, metrics, SQLITE_BACKFILL_SQL, SQLITE_DISPLAY_SQL)
+	finally:
+		gurasClient.close()
+		exceptionReport.close()
+		connection.close()
+	return shardResult(shard, addresses, addrWriter, exceptionReport, metrics, started)
+
+def runSharded(n: int, args) -> dict:
+	#Run n candidate properties as args.shards shards in args.workers processes, returns the merged RunMetrics report
+	directory = tempfile.mkdtemp()
+	path = os.path.join(directory, "gpr.db")
+	connection, gurasLots, gurasAddresses = createDatabase(n, path)
+	connection.execute("pragma journal_mode=wal") #Shards read while others write
+	connection.commit()
+	connection.close()
+
+	standIn = MapServerStandIn(gurasLots, gurasAddresses, args.latency, args.error_rate, args.transfer_limit, compress=not args.no_gzip)
+	baseURL = standIn.start()
+
+	metrics = RunMetrics(traceMemory=False)
+	limiter = SharedRateLimiter(args.rate, burst=args.concurrency)
+	shardDirectory = os.path.join(directory, "shards")
+	try:
+		results = runShards(runShard, args.shards, args.workers, (limiter,), (path, baseURL, args, shardDirectory), initializer=initShardWorker)
+	finally:
+		standIn.stop()
+
+	exceptionReport = ExceptionReport(args.report_directory, "benchmark_{}".format(n), args.report_format)
+	mergeShards(results, metrics, exceptionReport, shardDirectory)
+	with metrics.stage("Exception report"):
+		exceptionReport.close()
+
+	report = metrics.report()
+	report["info"].update({"standInRequests": standIn.requests, "standInConnections": standIn.connections, "standInBytesSent": standIn.bytesSent,
+							"updated": sum(result["updated"] for result in results), "exceptionRows": exceptionReport.rows["exceptions"],
+							"shards": args.shards, "workers": args.workers})
+	return report
+
+def explainSQLite(n: int) -> list:
+	#Plan of the candidate query (candidates.CANDIDATE_SQL in SQLite syntax) on the synthetic database, returns the regressions:
+	#full scans and a branch not driven by its create_date index
+	connection, _, _ = createDatabase(n)
+	sql = ORDERED_SQL.format(SQLITE_CANDIDATE_SQL.format(extra="", create_users=":create_user0"))
+	plan = [row[3] for row in connection.execute("explain query plan " + sql, {"since": "2000-01-01 00:00:00", "create_user0": "ADAPTER"})]
+	connection.close()
+
+	print("\nSQLite candidate query plan ({} x Candidate properties)".format(n))
+	for step in plan:
+		print("  " + step)
+	#SCAN <alias> reads the whole table (or all of an index), SEARCH only the rows the bound columns select
+	regressions = [step for step in plan if step.split()[:2] in [["SCAN", alias] for alias in SQLITE_CANDIDATE_TABLES]]
+	for alias, index in SQLITE_DRIVING_INDEXES:
+		if not any(step.startswith("SEARCH {} USING INDEX {} ".format(alias, index)) for step in plan):
+			regressions.append("{} not searched using index {}".format(alias, index))
+	return regressions
+
+def explainOracle() -> list:
+	#EXPLAIN PLAN of the production queries on GPR (connection settings from config.py), returns the full scans
+	from gpr_address_update.database import connectDB
+
+	connection = connectDB()
+	c = connection.cursor()
+	fullScans = list()
+	for name, sql in (("Candidate", CANDIDATE_SQL), ("Backfill", BACKFILL_SQL)):
+		plan, scans = explainCandidates(c, sql)
+		print("\n{} query plan".format(name))
+		for line in plan:
+			print("  " + line)
+		fullScans.extend(scans)
+	connection.close()
+	return fullScans
+
+def main():
+	parser = argparse.ArgumentParser(description="Benchmark the GPR address update stages offline")
+	parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="Candidate property counts to run")
+	parser.add_argument("--latency", type=float, default=0.05, help="Seconds added to every stand-in request")
+	parser.add_argument("--error-rate", type=float, default=0.0, help="Share of stand-in requests answered with 503")
+	parser.add_argument("--transfer-limit", type=int, default=1000, help="Stand-in maxRecordCount")
+	parser.add_argument("--no-gzip", action="store_true", help="Stand-in sends uncompressed responses")
+	parser.add_argument("--all-fields", action="store_true", help="Request every GURAS field (OutFields=*) instead of the projected ones")
+	parser.add_argument("--concurrency", type=int, default=4)
+	parser.add_argument("--rate", type=float, default=0, help="GURAS requests per second, 0 for no limit")
+	parser.add_argument("--mode", default="threads", choices=["threads", "asyncio"])
+	parser.add_argument("--arraysize", type=int, default=1000)
+	parser.add_argument("--batch-size", type=int, default=500)
+	parser.add_argument("--stream", action="store_true", help="Run the streaming pipeline instead of one batch")
+	parser.add_argument("--stream-batch-size", type=int, default=5000, help="Addresses per streamed batch")
+	parser.add_argument("--queue-size", type=int, default=2, help="Batches each streamed stage may hold")
+	parser.add_argument("--shards", type=int, default=0, help="Run as a sharded backfill with this many shards (uses a database file)")
+	parser.add_argument("--workers", type=int, default=2, help="Worker processes for --shards")
+	parser.add_argument("--report-format", default="csv", choices=REPORT_FORMATS)
+	parser.add_argument("--report-directory", default=os.path.join(tempfile.gettempdir(), "gpr_benchmark_reports"), help="Where the exceptions reports are written")
+	parser.add_argument("--trace-memory", action="store_true", help="Record peak traced memory per stage (slower)")
+	parser.add_argument("--output", help="Also write results to this JSON file")
+	parser.add_argument("--explain", action="store_true", help="Check the plan of the production candidate query (SQLite syntax) instead of timing the stages, exits 1 on a full scan or a branch not driven by its create_date index")
+	parser.add_argument("--oracle", action="store_true", help="With --explain, also EXPLAIN PLAN the production queries on GPR")
+	args = parser.parse_args()
+
+	if args.explain:
+		regressions = explainSQLite(max(args.sizes))
+		if args.oracle:
+			regressions += explainOracle()
+		for step in regressions:
+			print("Plan regression: " + step.strip())
+		sys.exit(1 if regressions else 0)
+
+	report = dict()
+	for n in args.sizes:
+		report[n] = runSharded(n, args) if args.shards else runStages(n, args)
+
+		print("\n{} x Candidate properties".format(n))
+		print("  {:<24} {:>9} {:>9} {:>9} {:>9} {:>9} {:>9}".format("Stage", "Seconds", "Rows in", "Rows out", "DB trips", "Requests", "p90 ms"))
+		for stage in report[n]["stages"]:
+			print("  {:<24} {:>9.3f} {:>9} {:>9} {:>9} {:>9} {:>9}".format(stage["stage"], stage["seconds"],
+				"" if stage["rowsIn"] is None else stage["rowsIn"], "" if stage["rowsOut"] is None else stage["rowsOut"],
+				stage["dbRoundTrips"], stage["restCalls"], "" if stage["restLatencyMs"]["p90"] is None else stage["restLatencyMs"]["p90"]))
+		print("  {:<24} {:>9.3f}".format("Total", report[n]["seconds"]))
+		print("  {} x GURAS requests over {} x Connections, {:.1f} MB received".format(report[n]["restCalls"], report[n]["info"]["standInConnections"], report[n]["bytesReceived"] / 1048576))
+		print("  {} x Updated, {} x Exception rows".format(report[n]["info"]["updated"], report[n]["info"]["exceptionRows"]))
+
+	if args.output:
+		with open(args.output, "w") as f:
+			json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+	main()
@@ -1,10 +0,0 @@
-#config file for GPR Electorate Update
-
-# Settings for GPR Oracle Database connection PROD
-username = ''
-password = ''
-dsnDCS = '' #DCS
-dsnDPE = '' #DPE
-port = 1521
-encoding = 'UTF-8'
-
@@ -0,0 +1,42 @@
+'''GPR Address Update
+	Completes incomplete GPR addresses from GURAS. The stages can be imported on their own by other
+	GPR jobs, e.g. from gpr_address_update import GurasClient, matchBatch. Names are loaded on first
+	use so importing the package (and the command line's --help) doesn't load pandas or cx_Oracle.
+'''
+
+import importlib
+
+#Public name -> module it lives in
+_EXPORTS = {
+	"connectDB": "database",
+	"ReferenceData": "reference",
+	"AddressWriter": "address_writer",
+	"GurasClient": "guras",
+	"GurasTransport": "guras",
+	"RetryPolicy": "guras",
+	"gurasClientFromConfig": "guras",
+	"SharedRateLimiter": "guras",
+	"GurasCache": "guras_cache",
+	"RunState": "run_state",
+	"fetchCandidates": "candidates",
+	"streamCandidates": "candidates",
+	"matchBatch": "transform",
+	"stream": "pipeline",
+	"lookupBatch": "pipeline",
+	"writeBatch": "pipeline",
+	"ServerMatcher": "server_match",
+	"ChangeSet": "change_set",
+	"ExceptionReport": "report",
+	"RunMetrics": "metrics",
+	"CountingCursor": "metrics",
+	"run": "update",
+}
+
+__all__ = list(_EXPORTS)
+
+def __getattr__(name: str):
+	if name not in _EXPORTS:
+		raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+	value = getattr(importlib.import_module("." + _EXPORTS[name], __name__), name)
+	globals()[name] = value
+	return value
@@ -0,0 +1,88 @@
+'''GPR Address Writer
+	Collects validated address updates and writes them to GPR in batches with a single
+	parameterised executemany per batch. VERSION_NO is bumped in SQL and guarded against
+	the version read at extraction, rows that lost a concurrent edit are returned as conflicts.
+'''
+
+import logging
+import time
+
+#Address columns updated from GURAS, in bind order
+ADDRESS_FIELDS = ["HOUSE_NO_1_PREFIX", "HOUSE_NO_1", "HOUSE_NO_1_SUFFIX", "HOUSE_NO_2_PREFIX", "HOUSE_NO_2", "HOUSE_NO_2_SUFFIX",
+				"ROAD_1_NAME", "ROAD_1_SUFFIX", "ROAD_1_TYPE", "UNIT_TYPE", "UNIT_NO_PREFIX", "UNIT_NO", "UNIT_NO_SUFFIX",
+				"LEVEL_TYPE", "LEVEL_NO_PREFIX", "LEVEL_NO", "LEVEL_NO_SUFFIX", "BUILDING_NAME", "LOCATION_DESCRIPTOR",
+				"ROAD_2_NAME", "ROAD_2_TYPE", "ROAD_2_SUFFIX", "SUBURB_ID", "ADDRESS_TYPE_ID"]
+
+#Numeric binds, declared up front so a NULL in the first row of a batch doesn't fix the bind type
+NUMBER_FIELDS = ["HOUSE_NO_1", "HOUSE_NO_2", "UNIT_NO", "SUBURB_ID", "ADDRESS_TYPE_ID", "ADDRESS_ID", "EXPECTED_VERSION_NO"]
+
+UPDATE_SQL = "update address set {}, VERSION_NO = VERSION_NO + 1, UPDATE_USER = 'PYTHON', UPDATE_DATE = CURRENT_TIMESTAMP \
+where ADDRESS_ID = :ADDRESS_ID and VERSION_NO = :EXPECTED_VERSION_NO".format(
+	", ".join("{0} = :{0}".format(field) for field in ADDRESS_FIELDS))
+
+CONFLICT_REASON = "Address changed in GPR since extraction (version conflict)"
+
+class AddressWriter:
+
+	def __init__(self, c, batchSize: int = 500):
+		self.c = c
+		self.batchSize = batchSize
+		self.pending = [] #bind rows waiting to be written
+		self.pendingRows = [] #source rows, returned if the update is rejected
+		self.updated = 0
+		self.updatedIDs = list()
+		self.conflicts = []
+		self.batches = 0
+		self.writeTime = 0.0
+
+	def add(self, address_id, expectedVersion, fields: dict, row=None):
+		#Queue an update, empty strings are bound as NULL (same as '' in Oracle)
+		binds = {field: (None if fields.get(field) is None or fields[field] == '' else fields[field]) for field in ADDRESS_FIELDS}
+		binds["ADDRESS_ID"] = int(address_id)
+		binds["EXPECTED_VERSION_NO"] = int(expectedVersion)
+
+		self.pending.append(binds)
+		self.pendingRows.append(row)
+
+		if len(self.pending) >= self.batchSize:
+			self.flush()
+
+	def addFrame(self, updates):
+		#Queue every row of an update frame (see transform.buildUpdates), conflicts are returned as index labels
+		updates = updates[["ADDRESS_ID", "VERSION_NO"] + ADDRESS_FIELDS]
+		updates = updates.astype(object).where(updates.notna(), None) #Python values for the driver
+
+		for label, row in zip(updates.index, updates.itertuples(index=False)):
+			self.add(row[0], row[1], dict(zip(ADDRESS_FIELDS, row[2:])), label)
+
+	def flush(self):
+		#Write all queued updates in one round trip
+		if not self.pending:
+			return
+
+		start = time.perf_counter()
+
+		if hasattr(self.c, "setinputsizes"):
+			self.c.setinputsizes(**{field: int for field in NUMBER_FIELDS})
+
+		self.c.executemany(UPDATE_SQL, self.pending, arraydmlrowcounts=True)
+		rowCounts = self.c.getarraydmlrowcounts()
+
+		for count, binds, row in zip(rowCounts, self.pending, self.pendingRows):
+			if count == 1:
+				self.updated += 1
+				self.updatedIDs.append(binds["ADDRESS_ID"])
+			else:
+				#Version no longer matches, address was edited after it was extracted
+				self.conflicts.append(row)
+
+		self.batches += 1
+		self.writeTime += time.perf_counter() - start
+		logging.debug("Address batch {} written: {} rows".format(self.batches, len(self.pending)))
+
+		self.pending = []
+		self.pendingRows = []
+
+	def summary(self) -> str:
+		return "Address writes: {} x Updated, {} x Version conflicts in {} x Batches ({:.2f}s)".format(
+			self.updated, len(self.conflicts), self.batches, self.writeTime)
@@ -0,0 +1,183 @@
+'''GPR Sharded Address Backfill
+	Full historical clean-up of incomplete GPR addresses (candidates.BACKFILL_SQL), split into
+	shards by address_id and run in a pool of worker processes. Every shard has its own Oracle
+	connections (one reading, one writing), GURAS client and streaming pipeline, all workers share one GURAS rate limit
+	(SharedRateLimiter), so throughput grows with workers until the service's limit is reached.
+	Shards write their exceptions as csv, which are merged into one report when every shard has
+	finished, and the stage metrics of every shard are merged into one metrics file.
+
+	gpr-address-backfill <username> --shards 16 --workers 4
+'''
+
+import argparse
+import logging
+import os
+import shutil
+
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+from . import config
+from .address_writer import AddressWriter
+from .candidates import streamCandidates, BACKFILL_SQL, DISPLAY_SQL
+from .guras import gurasClientFromConfig, SharedRateLimiter
+from .guras_cache import GurasCache
+from .metrics import RunMetrics, CountingCursor
+from .pipeline import timedBatches, batchStages, runBatches, processBatch
+from .reference import ReferenceData
+from .report import ExceptionReport, REPORT_FORMATS
+
+_limiter = None #This worker's handle on the shared rate limit
+
+def initWorker(username: str, limiter: SharedRateLimiter, traceMemory: bool = False):
+	#Runs once in every worker process, settings changed on the command line are passed in as spawned workers re-read config
+	global _limiter
+	_limiter = limiter
+	config.metricsTraceMemory = traceMemory
+	logging.basicConfig(filename="log.txt",
+						level=logging.INFO,
+						format="%(asctime)s - {} - shard worker {} - %(message)s".format(username, os.getpid()),
+						datefmt='%d/%m/%Y %H:%M:%S')
+
+def processShard(c, writeCursor, gurasClient, refData, since, shard: tuple, exceptionReport: ExceptionReport, metrics: RunMetrics, sql: str = BACKFILL_SQL, displaySQL: str = DISPLAY_SQL) -> tuple:
+	#Stream one shard through lookup, match and write, returns (addresses processed, AddressWriter)
+	addrWriter = AddressWriter(writeCursor, config.writeBatchSize)
+	stages = batchStages(gurasClient, metrics, config.gurasProjectFields, config.consolidateMultiMatches, config.houseRangeMaxGap)
+
+	batches = timedBatches(streamCandidates(c, since, None, config.streamBatchSize, config.candidateArraySize, sql, shard), metrics, "Candidate extraction")
+	addresses = 0
+	for result in runBatches(batches, stages, config.streamQueueSize):
+		df_batch = processBatch(result, addrWriter, refData, gurasClient, exceptionReport, writeCursor, metrics, config.gurasProjectFields, displaySQL=displaySQL)
+		addresses += df_batch["ADDRESS_ID"].nunique()
+
+	return addresses, addrWriter
+
+def runShard(shard: int, shards: int, since: datetime, reportDirectory: str, runName: str) -> dict:
+	#Worker process: one shard with its own connections and GURAS client, returns counts and stage metrics
+	from .database import ConnectionPool
+
+	started = time.perf_counter()
+	metrics = RunMetrics(config.metricsTraceMemory)
+	metrics.begin("Connect")
+	pool = ConnectionPool(size=2)
+	connection = pool.acquire()
+	writeConnection = pool.acquire() #Streamed reads keep the first connection busy, calls on one connection run one at a time
+	c = CountingCursor(connection.cursor(), metrics)
+	writeCursor = CountingCursor(writeConnection.cursor(), metrics)
+
+	metrics.begin("Reference data")
+	refData = ReferenceData().load(c)
+	metrics.end()
+
+	gurasCache = GurasCache(config.gurasCachePath, config.gurasCacheTtl, config.gurasCacheNegativeTtl) if config.gurasCachePath else None
+	gurasClient = gurasClientFromConfig(interactive=False, cache=gurasCache, metrics=metrics, limiter=_limiter)
+
+	exceptionReport = ExceptionReport(reportDirectory, "{}_shard{}".format(runName, shard), "csv")
+	try:
+		addresses, addrWriter = processShard(c, writeCursor, gurasClient, refData, since, (shard, shards), exceptionReport, metrics)
+	finally:
+		gurasClient.close()
+		if gurasCache:
+			gurasCache.close()
+		exceptionReport.close()
+		pool.release(writeConnection)
+		pool.release(connection)
+		pool.close()
+
+	logging.info("[INFO] Shard {}/{}: {} x Addresses, {}".format(shard + 1, shards, addresses, addrWriter.summary()))
+	return shardResult(shard, addresses, addrWriter, exceptionReport, metrics, started)
+
+def shardResult(shard: int, addresses: int, addrWriter: AddressWriter, exceptionReport: ExceptionReport, metrics: RunMetrics, started: float) -> dict:
+	#What a worker sends back, StageMetrics are plain objects so they pickle
+	metrics.end()
+	return {
+		"shard": shard,
+		"seconds": time.perf_counter() - started,
+		"addresses": addresses,
+		"updated": addrWriter.updated,
+		"conflicts": len(addrWriter.conflicts),
+		"exceptionAddresses": len(exceptionReport.addresses),
+		"reportName": exceptionReport.name,
+		"stages": metrics.stages + [metrics.other]
+	}
+
+def runShards(worker, shards: int, workers: int, initargs: tuple, args: tuple, initializer=initWorker) -> list:
+	#Run worker(shard, shards, *args) for every shard in a process pool, returns the results as shards finish
+	results = list()
+	with ProcessPoolExecutor(max_workers=max(1, workers), initializer=initializer, initargs=initargs) as pool:
+		futures = [pool.submit(worker, shard, shards, *args) for shard in range(shards)]
+		for future in as_completed(futures):
+			result = future.result()
+			results.append(result)
+			print("Shard {} finished - {}/{} shards done, {} x Updated so far              ".format(
+				result["shard"] + 1, len(results), shards, sum(r["updated"] for r in results)), end="\r")
+	return sorted(results, key=lambda result: result["shard"])
+
+def mergeShards(results: list, metrics: RunMetrics, exceptionReport: ExceptionReport, shardDirectory: str):
+	#One metrics record and one exceptions report for the whole backfill
+	for result in results:
+		metrics.merge(result["stages"])
+
+	metrics.begin("Merge exception reports")
+	for result in results:
+		exceptionReport.merge(shardDirectory, result["reportName"])
+	metrics.end()
+	shutil.rmtree(shardDirectory, ignore_errors=True)
+
+def main(argv: list = None):
+	parser = argparse.ArgumentParser(prog="gpr-address-backfill", description="Backfill every incomplete GPR address in parallel shards")
+	parser.add_argument("username", help="Recorded in the log")
+	parser.add_argument("--shards", type=int, default=config.backfillShards, help="Parts the addresses are split into by address_id")
+	parser.add_argument("--workers", type=int, default=config.backfillWorkers, help="Shards processed at once")
+	parser.add_argument("--since", default=config.backfillFrom, help="Earliest property creation date, YYYY-MM-DD")
+	parser.add_argument("--report-format", default=config.reportFormat, choices=REPORT_FORMATS)
+	parser.add_argument("--trace-memory", action="store_true", default=config.metricsTraceMemory, help="Record the peak memory of each stage (several times slower)")
+	args = parser.parse_args(argv)
+
+	logging.basicConfig(filename="log.txt",
+						level=logging.INFO,
+						format="%(asctime)s - {} - %(message)s".format(args.username),
+						datefmt='%d/%m/%Y %H:%M:%S')
+	logging.info("[START] GPR Address Backfill started: {} x Shards, {} x Workers, since {}".format(args.shards, args.workers, args.since))
+
+	today = datetime.now()
+	runName = today.strftime("%Y%m%d_%H%M%S")
+	since = datetime.strptime(args.since, "%Y-%m-%d")
+	shardDirectory = os.path.join(config.reportDirectory, "Backfill_{}_shards".format(runName))
+	metrics = RunMetrics(traceMemory=False) #Workers trace their own memory
+
+	#One rate limit for every worker, each worker may still have gurasConcurrency requests in flight
+	limiter = SharedRateLimiter(config.gurasRateLimit, burst=config.gurasConcurrency)
+	results = runShards(runShard, args.shards, args.workers, (args.username, limiter, args.trace_memory), (since, shardDirectory, runName))
+
+	exceptionReport = ExceptionReport(config.reportDirectory, "Backfill_{}".format(runName), args.report_format)
+	mergeShards(results, metrics, exceptionReport, shardDirectory)
+	report_paths = exceptionReport.close()
+
+	addr_total = sum(result["addresses"] for result in results)
+	addr_update = sum(result["updated"] for result in results)
+	addr_excp = len(exceptionReport.addresses)
+	metrics.info.update({"candidates": addr_total, "updated": addr_update, "exceptions": addr_excp, "shards": args.shards, "workers": args.workers,
+						"since": args.since, "gurasRateLimit": config.gurasRateLimit, "gurasConcurrency": config.gurasConcurrency,
+						"shardSeconds": {result["shard"]: round(result["seconds"], 2) for result in results}})
+	if config.metricsDirectory:
+		metrics.write(os.path.join(config.metricsDirectory, "AddressBackfillMetrics_{}.json".format(runName)))
+
+	logging.info("[INFO] {} x Updated, {} x Exceptions, {} x No GURAS record found".format(addr_update, addr_excp, addr_total - addr_update - addr_excp))
+	logging.info("[PROCESS] Exception report generated: {}".format(", ".join(report_paths)))
+
+	print("                                                       ")
+	print("-----------------------------------------")
+	print(" Address backfill complete!")
+	print("-----------------------------------------")
+	print("   {} x Addresses in {} x Shards".format(addr_total, args.shards))
+	print("   {} x Addresses updated".format(addr_update))
+	print("   {} x Addresses unable to be updated".format(addr_excp))
+	print("   {} x No GURAS records matched".format(addr_total - addr_update - addr_excp))
+	print("        - Exception report generated: {}".format(", ".join(report_paths)))
+
+	logging.info("[FINISH] GPR Address Backfill finished")
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,269 @@
+'''GPR Candidate Extraction
+	Selects the incomplete GPR addresses to update (missing house number, lot, road name and
+	location descriptor) and the current lots of their properties, in one parameterised query
+	fetched once into a DataFrame that every later step derives from. No staging table is
+	created, so several users can run the update at the same time.
+	Optionally the rows can be staged in a global temporary table (TEMPORARY_TABLE_DDL), which is
+	private to each session and keeps the candidates available to set-based SQL.
+	streamCandidates reads the same query ordered by address_id and yields it in batches of whole
+	addresses, so a backfill over every incomplete address never holds all candidates at once.
+	Backfills use BACKFILL_SQL, every incomplete address of a current property, and can be split
+	into shards by address_id so each worker of a sharded backfill reads a disjoint part.
+	The window start and create users are bound, the display address is only built (fetchDisplay)
+	for the rows that go to the exceptions report, and explainCandidates checks the query plan.
+	withRetries applies the RunState of incremental runs and the service to the candidate batches.
+'''
+
+import logging
+import time
+
+import pandas as pd
+
+from . import config
+
+ID_CHUNK = 1000 #Oracle limit on expressions in an in list
+
+#Columns of both branches, the display address is only built for the rows going to the report (DISPLAY_SQL)
+CANDIDATE_COLUMNS = """p.property_id, p.property_no,
+			{party} as current_responsible_party,
+			case when p.end_date is null then 'CURRENT' else 'EXPIRED' end as gpr_property_status,
+			ad.address_id, ad.version_no,
+			l.plan_type || '/' || l.lot_no || '/' || l.section_no || '/' || l.plan_no ptlotsecpn"""
+
+#Incomplete addresses of properties in a dealing registered after :since, driven by the create_date index
+TRANSACTION_SQL = """\
+select  distinct """ + CANDIDATE_COLUMNS.format(party="nvl(a.name, 'Private Party')") + """
+		from    responsibility_change_event rce
+		join    responsibility_change rc on rc.responsibility_change_event_id = rce.responsibility_change_event_id
+		join    responsibility_change_type rct on rct.responsibility_change_type_id = rce.responsibility_change_type_id
+		join    responsibility r on r.responsibility_id = rc.to_responsibility_id
+		join    responsibility r2 on r2.responsibility_id = rc.from_responsibility_id
+		join    property p on p.property_id = r.property_id
+		join    address ad on ad.address_id = p.address_id
+		join    suburb s on s.suburb_id = ad.suburb_id
+		join    property_lot pl on pl.property_id = p.property_id
+		join    lot l on l.lot_id = pl.lot_id
+		left join agency a on a.agency_id = r.agency_id
+		where   rce.create_date > :since
+		and     rce.create_date > date '2011-06-01'
+		and     rce.dealing_no is not null
+		and     (rce.settlement_date is null or (rce.settlement_date > date '2011-06-01' and rce.settlement_date < sysdate))
+		and     ad.house_no_1 is null and ad.lot_no is null and ad.road_1_name is null and ad.location_descriptor is null
+		and     pl.end_date is null
+		and     l.end_date is null
+		{extra}"""
+
+#Incomplete addresses of current properties created after :since by the config.candidateCreateUsers, bound as :create_user0..n
+CREATED_SQL = """\
+select  """ + CANDIDATE_COLUMNS.format(party="a.name") + """
+		from    property p
+		join    address ad on ad.address_id = p.address_id
+		join    suburb s on s.suburb_id = ad.suburb_id
+		join    responsibility r on r.property_id = p.property_id
+		join    property_lot pl on pl.property_id = p.property_id
+		join    lot l on l.lot_id = pl.lot_id
+		left join agency a on a.agency_id = r.agency_id
+		where   p.create_date > :since
+		and     p.create_user in ({create_users})
+		and     p.end_date is null
+		and     ad.house_no_1 is null and ad.lot_no is null and ad.road_1_name is null and ad.location_descriptor is null
+		and     pl.end_date is null
+		and     l.end_date is null
+		and     r.end_date is null
+		{extra}"""
+
+#Candidates created after :since, {extra} adds predicates to both branches
+CANDIDATE_SQL = TRANSACTION_SQL + "\n\t\tUNION ALL\n" + CREATED_SQL
+
+#Every incomplete address of a current property created after :since, whether or not it had a
+#transaction or was created by one of the candidateCreateUsers
+BACKFILL_SQL = CREATED_SQL.replace("and     p.create_user in ({create_users})\n\t\t", "")
+
+#Display address and suburb of the addresses going to the exceptions report, {ids} is an in list of binds
+DISPLAY_SQL = """\
+select  ad.address_id,
+			nvl2(ad.building_name,ad.building_name || ',','') ||
+			nvl2(ad.level_type,ad.level_type || ad.level_no_prefix || ' ' || ad.level_no || ' ' || ad.level_no_suffix || ',','') ||
+			nvl2(ad.unit_type ,ad.unit_type || ad.unit_no_prefix || ' ' || ad.unit_no  || nvl2(ad.unit_no_suffix, ' ' || ad.unit_no_suffix,'') || '/','') ||
+			nvl2(ad.lot_no,'Lot ' || ad.lot_no || ', ','') ||
+			nvl2(ad.house_no_1_prefix,ad.house_no_1_prefix || ' ','') ||
+			nvl2(ad.house_no_1 ,ad.house_no_1,'') ||
+			nvl2(ad.house_no_1_suffix,ad.house_no_1_suffix,'') ||
+			nvl2(ad.house_no_2,'-','')||
+			nvl2(ad.house_no_2_prefix,ad.house_no_2_prefix || ' ','') ||
+			nvl2(ad.house_no_2 ,ad.house_no_2,'') ||
+			nvl2(ad.house_no_2_suffix,ad.house_no_2_suffix || ' ','') ||
+			nvl2(ad.house_no_1, ' ','') ||
+			nvl2(ad.road_1_name ,ad.road_1_name || ' ','') ||
+			nvl2(ad.road_1_type ,ad.road_1_type || nvl2(ad.road_1_suffix ,' ' || ad.road_1_suffix ,'') ,'') ||
+			nvl2(ad.road_2_name, ' / ' || ad.road_2_name || ' ' || ad.road_2_type || nvl2(ad.road_2_suffix ,' ' || ad.road_2_suffix, ''),'') ||
+			nvl2(ad.road_1_name,nvl2(ad.location_descriptor ,', ',''),'') ||
+			nvl2(ad.location_descriptor ,ad.location_descriptor,'') as address,
+			nvl2(s.name, trim(trailing ' ' from s.name) || ' ' || s.postcode,'') as suburb_and_postcode
+		from    address ad
+		left join suburb s on s.suburb_id = ad.suburb_id
+		where   ad.address_id in ({ids})"""
+
+#Columns of a candidate row, a temporary table created by an older version may have more
+CANDIDATE_FIELDS = ["PROPERTY_ID", "PROPERTY_NO", "CURRENT_RESPONSIBLE_PARTY", "GPR_PROPERTY_STATUS", "ADDRESS_ID", "VERSION_NO", "PTLOTSECPN"]
+
+#Tables a candidate query must reach through an index, a full scan of one of them is a plan regression
+INDEXED_TABLES = ("RESPONSIBILITY_CHANGE_EVENT", "PROPERTY", "ADDRESS")
+
+#Rows of one shard, every row of an address is in the same shard
+SHARD_PREDICATE = "and mod(ad.address_id, :shard_count) = :shard"
+
+#Session private staging table, rows are kept until the session deletes them
+TEMPORARY_TABLE_DDL = """create global temporary table {} on commit preserve rows as
+	select * from ({}) where 1 = 0"""
+
+#Rows of one address come out next to each other
+ORDERED_SQL = "select * from ({}) order by address_id"
+
+def createTemporaryTable(c, table: str):
+	#Create the global temporary table once, it is never dropped
+	c.execute("select 1 from all_tables where table_name = upper(:name)", name=table)
+	if c.fetchone() is None:
+		#Bind variables aren't allowed in DDL, the where 1 = 0 means the window doesn't matter
+		c.execute(TEMPORARY_TABLE_DDL.format(table, CANDIDATE_SQL.format(extra="", create_users="null").replace(":since", "SYSDATE")))
+		logging.info("[INFO] Global temporary table {} created".format(table))
+
+def fetchCandidates(c, since, addressIDs=None, arraysize: int = 1000, temporaryTable: str = "", sql: str = CANDIDATE_SQL, shard: tuple = None) -> pd.DataFrame:
+	#Run the candidate query once and fetch every row in arraysize round trips
+	start = time.perf_counter()
+	c.arraysize = arraysize
+	if hasattr(c, "prefetchrows"):
+		c.prefetchrows = arraysize + 1
+
+	frames = [_fetch(c, sql, extra, binds, temporaryTable) for extra, binds in _queries(since, addressIDs, shard)]
+
+	if frames:
+		df = pd.concat(frames, ignore_index=True)
+	else:
+		df = pd.DataFrame(columns=[d[0] for d in (c.description or [])])
+
+	logging.info("[INFO] {} x Candidate rows fetched in {:.2f}s".format(len(df), time.perf_counter() - start))
+	return df
+
+def streamCandidates(c, since, addressIDs=None, batchSize: int = 5000, arraysize: int = 1000, sql: str = CANDIDATE_SQL, shard: tuple = None):
+	#Yield candidate DataFrames of batchSize addresses, every row of an address is in the same batch, shard is (shard, shard count)
+	c.arraysize = arraysize
+	if hasattr(c, "prefetchrows"):
+		c.prefetchrows = arraysize + 1
+
+	rows = list()
+	addresses = 0
+	columns = None
+	for extra, binds in _queries(since, addressIDs, shard):
+		statement, binds = _statement(sql, extra, binds)
+		c.execute(ORDERED_SQL.format(statement), binds)
+		columns = [d[0] for d in c.description]
+		position = columns.index("ADDRESS_ID")
+		last = None
+
+		while True:
+			fetched = c.fetchmany()
+			if not fetched:
+				break
+
+			for row in fetched:
+				if row[position] != last:
+					if addresses >= batchSize:
+						yield pd.DataFrame(rows, columns=columns)
+						rows = list()
+						addresses = 0
+					addresses += 1
+					last = row[position]
+				rows.append(row)
+
+	if rows:
+		yield pd.DataFrame(rows, columns=columns)
+
+def withRetries(batches, runState, fetchDue):
+	#Candidate batches without the unresolved addresses tried too recently, then fetchDue(address_ids) for the unresolved
+	#addresses due for another try that weren't in the batches. The RunState is read here, the batches can be read in another thread
+	if runState is None:
+		return batches
+	notDue = set(runState.notDue())
+	dueRetries = runState.dueRetries()
+
+	def filtered():
+		staged = set()
+		for batch in batches:
+			staged.update(batch["ADDRESS_ID"])
+			batch = batch.loc[~batch["ADDRESS_ID"].isin(notDue)]
+			if len(batch) > 0:
+				yield batch
+
+		due = [address_id for address_id in dueRetries if address_id not in staged]
+		skipped = len(staged & notDue)
+		if skipped or due:
+			logging.info("[INFO] {} x Unresolved addresses skipped until due, {} x Unresolved addresses retried".format(skipped, len(due)))
+		if due:
+			yield from fetchDue(due)
+
+	return filtered()
+
+def _queries(since, addressIDs, shard: tuple = None) -> list:
+	#(extra predicates, binds) of each query to run, specific addresses are queried in chunks that fit an in list
+	if addressIDs is None:
+		queries = [("", {"since": since})]
+	else:
+		queries = list()
+		addressIDs = list(addressIDs)
+		for i in range(0, len(addressIDs), ID_CHUNK):
+			binds = {"id{}".format(j): int(address_id) for j, address_id in enumerate(addressIDs[i:i + ID_CHUNK])}
+			extra = "and ad.address_id in ({})".format(",".join(":" + name for name in binds))
+			binds["since"] = since
+			queries.append((extra, binds))
+
+	if shard is not None:
+		for extra, binds in queries:
+			binds.update({"shard": shard[0], "shard_count": shard[1]})
+		queries = [(extra + "\n\t\t" + SHARD_PREDICATE, binds) for extra, binds in queries]
+	return queries
+
+def _statement(sql: str, extra: str, binds: dict) -> tuple:
+	#Query text with the extra predicates and create user binds filled in, and the binds it uses
+	users = {"create_user{}".format(i): user for i, user in enumerate(config.candidateCreateUsers)}
+	statement = sql.format(extra=extra, create_users=",".join(":" + name for name in users) or "null")
+	if ":create_user0" in statement:
+		binds = dict(binds, **users)
+	return statement, binds
+
+def _fetch(c, sql: str, extra: str, binds: dict, temporaryTable: str) -> pd.DataFrame:
+	statement, binds = _statement(sql, extra, binds)
+	if temporaryTable:
+		#Stage in the session's temporary table, then read it back once
+		c.execute("delete from {}".format(temporaryTable))
+		c.execute("insert into {} ({}) ".format(temporaryTable, ", ".join(CANDIDATE_FIELDS)) + statement, binds)
+		c.execute("select {} from {}".format(", ".join(CANDIDATE_FIELDS), temporaryTable))
+	else:
+		c.execute(statement, binds)
+
+	columns = [d[0] for d in c.description]
+	return pd.DataFrame(c.fetchall(), columns=columns)
+
+def fetchDisplay(c, addressIDs, sql: str = DISPLAY_SQL) -> pd.DataFrame:
+	#ADDRESS and SUBURB_AND_POSTCODE of each address_id, queried in chunks that fit an in list
+	addressIDs = list(addressIDs)
+	frames = list()
+	for i in range(0, len(addressIDs), ID_CHUNK):
+		binds = {"id{}".format(j): int(address_id) for j, address_id in enumerate(addressIDs[i:i + ID_CHUNK])}
+		c.execute(sql.format(ids=",".join(":" + name for name in binds)), binds)
+		frames.append(pd.DataFrame(c.fetchall(), columns=[d[0].upper() for d in c.description]))
+	if not frames:
+		return pd.DataFrame(columns=["ADDRESS_ID", "ADDRESS", "SUBURB_AND_POSTCODE"])
+	return pd.concat(frames, ignore_index=True)
+
+def explainCandidates(c, sql: str = CANDIDATE_SQL) -> tuple:
+	#EXPLAIN PLAN of a candidate query, returns (plan lines, lines that full scan one of the INDEXED_TABLES)
+	statementID = "gpr_candidates_{}".format(int(time.time()))
+	statement, _ = _statement(sql, "", {})
+	c.execute("explain plan set statement_id = '{}' for {}".format(statementID, ORDERED_SQL.format(statement)))
+	c.execute("select plan_table_output from table(dbms_xplan.display(null, :id, 'BASIC +PREDICATE'))", id=statementID)
+	plan = [row[0] for row in c.fetchall()]
+	c.execute("delete from plan_table where statement_id = :id", id=statementID)
+
+	fullScans = [line for line in plan if "TABLE ACCESS FULL" in line and any(" {} ".format(table) in line.upper() for table in INDEXED_TABLES)]
+	return plan, fullScans
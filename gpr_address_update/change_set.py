@@ -0,0 +1,130 @@
+'''GPR Address Change-Set
+	Local SQLite file of planned address updates, so the slow part of a run (candidate extraction,
+	GURAS lookups, matching and validation) is separate from the GPR write window.
+	A --plan run records every valid update with the VERSION_NO it was read at, instead of writing
+	it. An --apply run writes the planned updates in one short transaction with the same version
+	guard as AddressWriter, and records the outcome of each address in the file, so the change-set
+	can be applied again after a failure without querying GURAS again.
+'''
+
+import logging
+import sqlite3
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from .address_writer import ADDRESS_FIELDS, NUMBER_FIELDS, AddressWriter, CONFLICT_REASON
+from .run_state import WATERMARK_FORMAT
+
+PLANNED = "planned"
+APPLIED = "applied"
+CONFLICT = "conflict"
+
+class ChangeSet:
+
+	def __init__(self, path: str, create: bool = False):
+		self.path = path
+		self.updated = 0 #Planned updates, same counters as AddressWriter
+		self.updatedIDs = list()
+		self.conflicts = []
+		self.batches = 0
+		self.writeTime = 0.0
+
+		self.connection = sqlite3.connect(path if create else "file:{}?mode=rw".format(path), uri=not create)
+		if create:
+			self.connection.execute("create table if not exists meta (\
+				name text primary key,\
+				value text)")
+			self.connection.execute("create table if not exists updates (\
+				address_id integer primary key,\
+				expected_version_no integer not null,\
+				{},\
+				status text not null default '{}',\
+				applied real)".format(",".join("{} {}".format(field.lower(), "integer" if field in NUMBER_FIELDS else "text")
+												for field in ADDRESS_FIELDS), PLANNED))
+			self.connection.execute("create table if not exists candidates (\
+				address_id integer primary key)")
+			self.connection.commit()
+
+	def setMeta(self, **values):
+		self.connection.executemany("insert or replace into meta (name, value) values (?, ?)", [(name, str(value)) for name, value in values.items()])
+		self.connection.commit()
+
+	def meta(self) -> dict:
+		return dict(self.connection.execute("select name, value from meta"))
+
+	def runStarted(self):
+		#Database time the planning run started, the watermark an incremental apply moves to
+		value = self.meta().get("runStarted")
+		return datetime.strptime(value, WATERMARK_FORMAT) if value else None
+
+	def addCandidates(self, addressIDs):
+		#Addresses the plan looked at, for the run state of incremental runs
+		self.connection.executemany("insert or ignore into candidates (address_id) values (?)", [(int(address_id),) for address_id in addressIDs])
+		self.connection.commit()
+
+	def candidates(self) -> list:
+		return [row[0] for row in self.connection.execute("select address_id from candidates")]
+
+	def addFrame(self, updates: pd.DataFrame):
+		#Record every row of an update frame (see transform.buildUpdates), empty strings are stored as NULL
+		start = time.perf_counter()
+		updates = updates[["ADDRESS_ID", "VERSION_NO"] + ADDRESS_FIELDS].astype(object)
+		updates = updates.where(updates.notna() & (updates != ''), None)
+		rows = [(int(row[0]), int(row[1])) + tuple(row[2:]) for row in updates.itertuples(index=False)]
+
+		self.connection.executemany("insert or replace into updates (address_id, expected_version_no, {}) values ({})".format(
+			", ".join(field.lower() for field in ADDRESS_FIELDS), ", ".join("?" * (len(ADDRESS_FIELDS) + 2))), rows)
+
+		self.updated += len(rows)
+		self.updatedIDs.extend(row[0] for row in rows)
+		self.writeTime += time.perf_counter() - start
+
+	def flush(self):
+		#Planned updates are durable as each batch is finished
+		self.connection.commit()
+		self.batches += 1
+
+	def pending(self) -> list:
+		#Planned updates not applied yet, as (address_id, expected version, fields)
+		rows = self.connection.execute("select address_id, expected_version_no, {} from updates where status = ? order by address_id".format(
+			", ".join(field.lower() for field in ADDRESS_FIELDS)), (PLANNED,))
+		return [(row[0], row[1], dict(zip(ADDRESS_FIELDS, row[2:]))) for row in rows]
+
+	def apply(self, c, batchSize: int = 500) -> AddressWriter:
+		#Write the pending updates with one executemany per batch and a single commit, returns the writer with the outcome
+		addrWriter = AddressWriter(c, batchSize)
+		pending = self.pending()
+		for address_id, expectedVersion, fields in pending:
+			addrWriter.add(address_id, expectedVersion, fields, address_id)
+		addrWriter.flush()
+		c.execute("commit")
+
+		#Only recorded once GPR has committed, a failed apply leaves every update planned
+		now = time.time()
+		self.connection.executemany("update updates set status = ?, applied = ? where address_id = ?",
+									[(APPLIED, now, address_id) for address_id in addrWriter.updatedIDs] +
+									[(CONFLICT, now, address_id) for address_id in addrWriter.conflicts])
+		self.connection.commit()
+
+		logging.info("[INFO] Change-set {} applied: {} x Updated, {} x Version conflicts".format(self.path, addrWriter.updated, len(addrWriter.conflicts)))
+		return addrWriter
+
+	def conflictFrame(self) -> pd.DataFrame:
+		#Addresses edited in GPR between plan and apply, for the exceptions report
+		df = pd.read_sql_query("select address_id ADDRESS_ID, expected_version_no VERSION_NO from updates where status = ?", self.connection, params=(CONFLICT,))
+		df["Exception_Reason"] = CONFLICT_REASON
+		return df
+
+	def appliedIDs(self) -> list:
+		return [row[0] for row in self.connection.execute("select address_id from updates where status = ?", (APPLIED,))]
+
+	def counts(self) -> dict:
+		return dict(self.connection.execute("select status, count(*) from updates group by status"))
+
+	def summary(self) -> str:
+		return "Change-set: {} x Planned updates in {} x Batches ({:.2f}s)".format(self.updated, self.batches, self.writeTime)
+
+	def close(self):
+		self.connection.close()
@@ -0,0 +1,112 @@
+'''GPR Address Update command line
+	Parses the options of a run and applies the overrides to config before anything heavy is
+	imported, so --help and --dry-run return straight away. pandas, requests and cx_Oracle are
+	only loaded by update.run once a real run starts.
+
+	gpr-address-update <username> [--incremental | --stream | --backfill] [--server-side] [--plan | --apply <file>]
+	gpr-address-update <username> --service
+'''
+
+import argparse
+import logging
+import sys
+
+from . import config
+
+REPORT_FORMATS = ("xlsx", "csv", "parquet") #report.REPORT_FORMATS, listed here so --help doesn't import pandas
+
+#Option -> config setting it overrides
+OVERRIDES = {
+	"window_days": "windowDays",
+	"backfill_from": "backfillFrom",
+	"stream_batch_size": "streamBatchSize",
+	"write_batch_size": "writeBatchSize",
+	"array_size": "candidateArraySize",
+	"queue_size": "streamQueueSize",
+	"report_format": "reportFormat",
+	"poll_minutes": "servicePollMinutes",
+	"trace_memory": "metricsTraceMemory",
+}
+
+def parseArgs(argv: list = None) -> argparse.Namespace:
+	parser = argparse.ArgumentParser(prog="gpr-address-update", description="Complete incomplete GPR addresses from GURAS")
+	parser.add_argument("user", help="Recorded in the log and the change-set")
+
+	mode = parser.add_argument_group("mode")
+	mode.add_argument("--incremental", action="store_true", help="Only candidates created since the last successful run, plus unresolved addresses due for a retry")
+	mode.add_argument("--stream", action="store_true", help="Process candidates in batches through overlapping stages")
+	mode.add_argument("--backfill", action="store_true", help="Every incomplete address since --backfill-from, always streamed")
+	mode.add_argument("--server-side", action="store_true", help="Match, validate and update in Oracle instead of pandas")
+	mode.add_argument("--plan", action="store_true", help="Save validated updates to a change-set instead of writing them to GPR")
+	mode.add_argument("--apply", metavar="PATH", help="Write a change-set saved by --plan to GPR, without GURAS")
+	mode.add_argument("--service", action="store_true", help="Keep running, process new candidates every --poll-minutes with a /health endpoint")
+
+	tuning = parser.add_argument_group("settings (default from config.py)")
+	tuning.add_argument("--window-days", type=int, help="Days back to look for incomplete addresses")
+	tuning.add_argument("--backfill-from", metavar="YYYY-MM-DD", help="Earliest property creation date a --backfill run looks at")
+	tuning.add_argument("--stream-batch-size", type=int, help="Addresses per streamed batch")
+	tuning.add_argument("--write-batch-size", type=int, help="Address updates sent per executemany")
+	tuning.add_argument("--array-size", type=int, help="Rows fetched per round trip by the candidate query")
+	tuning.add_argument("--queue-size", type=int, help="Batches each streamed stage may hold")
+	tuning.add_argument("--report-format", choices=REPORT_FORMATS, help="Exception report format")
+	tuning.add_argument("--poll-minutes", type=float, help="Minutes between the candidate polls of --service")
+
+	parser.add_argument("--refresh", action="store_true", help="Ignore cached GURAS lookups")
+	parser.add_argument("--non-interactive", action="store_true", help="Never wait for user input, e.g. scheduled runs")
+	parser.add_argument("--profile", action="store_true", help="Write a cProfile dump of the run, every thread included, next to the metrics file")
+	parser.add_argument("--trace-memory", action="store_true", default=None, help="Record the peak memory of each stage in the metrics (several times slower)")
+	parser.add_argument("--dry-run", action="store_true", help="Print the resolved settings and exit without connecting")
+
+	options = parser.parse_args(argv)
+	if options.plan and options.apply:
+		parser.error("--plan and --apply can't be used together")
+	if options.plan and options.server_side:
+		parser.error("--plan can't be used with --server-side, server-side runs write to GPR directly")
+	#The service is always incremental, streamed and unattended, and matches client-side with the GURAS cache
+	serviceConflicts = [option for option in ("plan", "apply", "backfill", "stream", "incremental", "server_side", "refresh", "non_interactive") if getattr(options, option)]
+	if options.service and serviceConflicts:
+		parser.error("--service can't be used with {}".format(", ".join("--" + option.replace("_", "-") for option in serviceConflicts)))
+	return options
+
+def applyOverrides(options: argparse.Namespace) -> dict:
+	#Copies the settings given on the command line onto config, returns the resolved settings
+	for option, setting in OVERRIDES.items():
+		value = getattr(options, option)
+		if value is not None:
+			setattr(config, setting, value)
+	return {setting: getattr(config, setting) for setting in OVERRIDES.values()}
+
+def main(argv: list = None):
+	options = parseArgs(argv)
+	settings = applyOverrides(options)
+
+	if options.dry_run:
+		modes = [name for name in ("incremental", "stream", "backfill", "server_side", "plan", "service") if getattr(options, name)]
+		if options.apply:
+			modes.append("apply {}".format(options.apply))
+		print("user: {}".format(options.user))
+		print("config: {}".format(config.userConfig or "package defaults"))
+		print("mode: {}".format(", ".join(modes) or "full"))
+		for setting, value in settings.items():
+			print("{}: {}".format(setting, value))
+		return
+
+	logging.basicConfig(filename="log.txt",
+						level=logging.INFO,
+						format="%(asctime)s - {} - %(message)s".format(options.user),
+						datefmt='%d/%m/%Y %H:%M:%S')
+	logging.info("[START] GPR Address Update process started")
+
+	if options.service:
+		from .service import serve
+		serve(options)
+		return
+
+	from .update import run #pandas, requests and cx_Oracle load here
+	from .guras import RunAborted
+	try:
+		run(options)
+	except RunAborted:
+		print("GPR Address update process Aborted!!")
+		logging.info("GPR Address update aborted by User")
+		sys.exit(1)
@@ -0,0 +1,76 @@
+#config file for GPR Electorate Update
+
+# Settings for GPR Oracle Database connection PROD
+username = ''
+password = ''
+dsnDCS = '' #DCS
+dsnDPE = '' #DPE
+port = 1521
+encoding = 'UTF-8'
+dbConnectTimeout = 5 # Seconds to wait for a data centre, DPE and DCS are tried at the same time
+dbDSNConnectTimeout = False # Also add dbConnectTimeout to descriptor and easy connect DSNs so a hung attempt stops, easy connect needs Oracle Client 19c or later
+dbPoolSize = 4 # Connections in the session pool, stages running side by side each hold one
+
+# Address update settings
+windowDays = 90 # Days back to look for incomplete addresses
+runStatePath = 'run_state.db' # Watermark and unresolved addresses for --incremental runs
+retryIntervalHours = 24 # Hours before an unresolved address is tried again by --incremental runs
+candidateArraySize = 1000 # Rows fetched per round trip by the candidate query
+candidateCreateUsers = ['ADAPTER'] # Users whose new properties are candidates without a transaction
+candidateTemporaryTable = '' # Optional global temporary table to stage candidates in, e.g. 'au_address_gpr_candidates'
+writeBatchSize = 500 # Number of address updates sent per executemany
+consolidateMultiMatches = True # Update properties matched to several GURAS records that agree or form one house number range
+houseRangeMaxGap = 2 # Largest step between house numbers merged into a range (2 = same side of the road)
+serverMatchTablePrefix = 'au_address_gpr' # Prefix of the global temporary tables used by --server-side runs
+changeSetDirectory = 'Change Sets' # Folder for the change-sets saved by --plan runs
+streamBatchSize = 5000 # Addresses per batch in --stream and --backfill runs
+streamQueueSize = 2 # Batches each streamed stage may hold waiting for the next stage
+backfillFrom = '2011-06-01' # Earliest property creation date a --backfill run looks at
+backfillShards = 16 # Parts backfill.py splits the incomplete addresses into (by address_id)
+backfillWorkers = 4 # Shards processed at once by backfill.py, each with its own connection and GURAS client
+reportDirectory = 'Exception Reports' # Folder for the exceptions report of each run
+reportFormat = 'xlsx' # 'xlsx', 'csv' or 'parquet', --report-format overrides it
+metricsDirectory = 'Run Metrics' # Folder for the JSON metrics (and --profile dump) of each run, '' to disable
+metricsTraceMemory = False # Record peak memory per stage with tracemalloc, --trace-memory turns it on for one run. Makes pandas heavy stages several times slower
+servicePollMinutes = 5 # Minutes between the candidate polls of --service
+serviceBatchSize = 500 # Addresses per micro-batch in --service
+serviceRefreshHours = 24 # Hours before --service reloads reference data, purges the GURAS cache and writes its metrics
+serviceHost = '127.0.0.1' # Address of the --service health endpoint
+servicePort = 8765 # Port of the --service health endpoint (/health, /metrics), 0 to disable
+
+# GURAS REST service settings
+gurasConcurrency = 4 # Parallel requests to the GURAS MapServer
+gurasRateLimit = 5 # Max requests per second across all workers, 0 to disable
+gurasMode = 'threads' # 'threads' or 'asyncio'
+gurasTimeout = 60 # Seconds to wait for a response
+gurasProjectFields = True # Only request the GURAS fields the update uses, exception rows are fetched in full for the report
+gurasConnectTimeout = 10 # Seconds to wait for a connection to the GURAS server
+gurasCABundle = '' # Optional CA bundle (.pem/.cer) for the corporate proxy, e.g. 'C:\TMP\Python\swg.dec.int.cer'
+gurasMaxAttempts = 10 # Attempts per request before giving up (or asking the user)
+gurasBackoffBase = 1 # Seconds before the first retry, doubles every attempt
+gurasBackoffMax = 60 # Longest wait between retries in seconds
+gurasDeadline = 1800 # Seconds allowed for the GURAS requests of each batch (the whole run unless streamed), 0 for no limit
+gurasCachePath = 'guras_cache.db' # Local cache of GURAS lookups, '' to disable
+gurasCacheTtl = 7 # Days before a cached GURAS record is queried again
+gurasCacheNegativeTtl = 1 # Days to remember lots/propids with no GURAS record, 0 to disable
+
+# A config.py in the working directory (the folder 'GPR Address Update.py' is run from), or the file named by
+# the GPR_ADDRESS_UPDATE_CONFIG environment variable, overrides the settings above. Settings it leaves out keep these defaults
+def _loadUserConfig():
+	import os
+	import runpy
+
+	path = os.environ.get("GPR_ADDRESS_UPDATE_CONFIG")
+	if not path:
+		path = os.path.join(os.getcwd(), "config.py")
+		if not os.path.isfile(path) or os.path.samefile(path, __file__):
+			return None
+	elif not os.path.isfile(path):
+		raise FileNotFoundError("GPR_ADDRESS_UPDATE_CONFIG not found: {}".format(path))
+	defaults = globals()
+	for name, value in runpy.run_path(path).items():
+		if name in defaults and not name.startswith("_"):
+			defaults[name] = value
+	return os.path.abspath(path)
+
+userConfig = _loadUserConfig() # Path of the config.py that overrides the defaults, None if there isn't one
@@ -0,0 +1,146 @@
+'''GPR Database Connection
+	Connects to GPR through whichever of the DPE and DCS addresses answers first. Both are tried
+	at the same time and a dead data centre is given up on after config.dbConnectTimeout seconds.
+	The attempt itself carries on in its daemon thread unless config.dbDSNConnectTimeout also
+	writes the timeout into the address (easy connect needs Oracle Client 19c or later).
+	ConnectionPool keeps the first connection and a session pool on the chosen address so stages
+	running side by side (reference data, candidate extraction, streamed writes) each hold their own.
+	connectDB returns one connection when nothing runs side by side.
+'''
+
+import logging
+import queue
+import threading
+import time
+
+from . import config
+
+def _dsns() -> dict:
+	#Name -> address of every configured data centre, DPE first
+	return {name: dsn for name, dsn in (("DPE", config.dsnDPE), ("DCS", config.dsnDCS)) if dsn}
+
+def _timedDSN(dsn: str, timeout: float) -> str:
+	#Adds a connect timeout to a connect descriptor or easy connect address if dbDSNConnectTimeout is on, TNS aliases are left as they are
+	seconds = max(1, int(round(timeout)))
+	if not config.dbDSNConnectTimeout or "CONNECT_TIMEOUT" in dsn.upper():
+		return dsn
+	if dsn.lstrip().startswith("("):
+		start = dsn.upper().find("(DESCRIPTION=")
+		if start < 0:
+			return dsn
+		start += len("(DESCRIPTION=")
+		return "{}(CONNECT_TIMEOUT={})(TRANSPORT_CONNECT_TIMEOUT={}){}".format(dsn[:start], seconds, seconds, dsn[start:])
+	if "/" in dsn or ":" in dsn:
+		return "{}{}connect_timeout={}".format(dsn, "&" if "?" in dsn else "?", seconds) #Easy Connect Plus, Oracle Client 19c or later
+	return dsn
+
+def _connect(dsn: str):
+	import cx_Oracle #Only loaded by runs that connect, --help and --dry-run don't need the Oracle client
+
+	start = time.perf_counter()
+	connection = cx_Oracle.connect(
+		config.username,
+		config.password,
+		_timedDSN(dsn, config.dbConnectTimeout),
+		encoding=config.encoding,
+		threaded=True) #Streamed runs read and write from different threads
+	connection.callTimeout = int(config.dbConnectTimeout * 1000)
+	connection.ping()
+	connection.callTimeout = 0
+	return connection, time.perf_counter() - start
+
+def _attempt(name: str, dsn: str, results: queue.Queue):
+	try:
+		results.put((name, _connect(dsn), None))
+	except Exception as error:
+		results.put((name, None, error))
+
+def _closeLate(results: queue.Queue, count: int):
+	#Closes the connections of data centres that answer after the run has moved on
+	for i in range(count):
+		name, answer, error = results.get()
+		if answer is not None:
+			answer[0].close()
+
+def probe(timeout: float = None) -> tuple:
+	#Connects to every data centre at once, returns (name, dsn, connection, latency) of the first healthy one
+	#latency: name -> seconds to connect, or the error, for every data centre tried
+	timeout = config.dbConnectTimeout if timeout is None else timeout
+	dsns = _dsns()
+	latency = dict()
+	results = queue.Queue()
+	for name, dsn in dsns.items():
+		#Daemon threads, a data centre that never answers doesn't hold up the end of the run
+		threading.Thread(target=_attempt, args=(name, dsn, results), name="probe-" + name, daemon=True).start()
+
+	deadline = time.perf_counter() + timeout
+	chosen = None
+	waiting = len(dsns)
+	while waiting and chosen is None:
+		try:
+			name, answer, error = results.get(timeout=max(deadline - time.perf_counter(), 0))
+		except queue.Empty:
+			break
+		waiting -= 1
+		if error is not None:
+			latency[name] = str(error).strip()
+			logging.info("[WARN] GPR {} ({}) unavailable: {}".format(name, dsns[name], latency[name]))
+			continue
+		connection, seconds = answer
+		latency[name] = round(seconds, 3)
+		chosen = (name, dsns[name], connection, latency)
+
+	for name in dsns:
+		latency.setdefault(name, "no answer in {}s".format(timeout) if chosen is None else "slower")
+	if waiting:
+		threading.Thread(target=_closeLate, args=(results, waiting), daemon=True).start()
+
+	if chosen is None:
+		raise ConnectionError("GPR database unavailable: " + ", ".join("{} {}".format(name, latency.get(name, "not tried")) for name in dsns))
+	logging.info("[INFO] Connected to GPR {} in {:.2f}s".format(chosen[0], latency[chosen[0]]))
+	return chosen
+
+def connectDB():
+	#Connects to GPR Database, raises ConnectionError if no data centre answers
+	name, dsn, connection, latency = probe()
+	return connection
+
+class ConnectionPool:
+	#Connections on the fastest data centre, acquire() a connection per concurrent stage and release() it when done
+
+	def __init__(self, size: int = None, timeout: float = None):
+		import cx_Oracle
+
+		#The probe's connection is handed out first, the session pool only connects once a second stage needs one
+		self.name, self.dsn, self.connection, self.latency = probe(timeout)
+		self.connectionFree = True
+		self.lock = threading.Lock()
+		self.size = size or config.dbPoolSize
+		self.pool = cx_Oracle.SessionPool(
+			user=config.username,
+			password=config.password,
+			dsn=_timedDSN(self.dsn, config.dbConnectTimeout),
+			min=0,
+			max=max(1, self.size - 1),
+			increment=1,
+			encoding=config.encoding,
+			threaded=True,
+			getmode=cx_Oracle.SPOOL_ATTRVAL_WAIT) #Stages wait for a free connection rather than fail
+
+	def acquire(self):
+		with self.lock:
+			if self.connectionFree:
+				self.connectionFree = False
+				return self.connection
+		return self.pool.acquire()
+
+	def release(self, connection):
+		if connection is self.connection:
+			with self.lock:
+				self.connectionFree = True
+		else:
+			self.pool.release(connection)
+
+	def close(self):
+		self.connection.close()
+		self.pool.close(force=True)
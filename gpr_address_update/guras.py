@@ -0,0 +1,431 @@
+'''GURAS REST Client
+	Queries the SIX Maps GURAS MapServer layers (10 - Lot -> PropID, 9 - PropID -> Address).
+	Key chunks are sent in parallel (thread pool or asyncio) under a concurrency limit and a
+	token bucket rate limit. Throttling (429), server errors (5xx) and timeouts back off
+	adaptively instead of sleeping a fixed time after every call. Results are returned in chunk order.
+	In non-interactive mode a chunk that exhausts its RetryPolicy is returned as unavailable
+	and the remaining chunks carry on, instead of waiting for the user.
+	Queries are sent as POST requests so long key lists don't hit URL length limits. Chunk size
+	comes from the layer's advertised maxRecordCount and results over the transfer limit are
+	paged with resultOffset/resultRecordCount (or split if the layer can't page).
+	All requests go through one GurasTransport: a pooled keep-alive requests.Session sized to the
+	concurrency, asking for gzip responses, so chunks reuse connections instead of a new TCP and
+	TLS handshake each. Responses are parsed straight from the response bytes.
+	Keys are deduplicated before they are chunked, so a key shared by many rows is sent once.
+'''
+
+import asyncio
+import json
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import config
+from .guras_cache import cacheKey
+
+GURAS_URL = "https://maps.six.nsw.gov.au/arcgis/rest/services/sixmaps/Guras/MapServer"
+PROPID_LAYER = 10
+ADDRESS_LAYER = 9
+
+CHUNK_SIZE = 200 #Keys per where clause if the layer's limits are unknown
+MAX_CHUNK_SIZE = 1000 #Upper bound on keys per where clause
+
+#Responses worth retrying after a back off
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+def whereIn(field: str, keys, quote: bool = False) -> str:
+	#Build "field in (...)" clause for a chunk of keys
+	if quote:
+		return "{} in ({})".format(field, ",".join("'{}'".format(key) for key in keys))
+	return "{} in ({})".format(field, ",".join(str(key) for key in keys))
+
+class ServiceUnavailable(Exception):
+	#Raised when a request gives up under a non-interactive RetryPolicy
+	pass
+
+class RunAborted(Exception):
+	#Raised when the user answers n to a retry prompt, reaches the caller from whichever worker thread asked
+	pass
+
+class RetryPolicy:
+
+	def __init__(self, maxAttempts: int = 10, backoffBase: float = 1.0, backoffMax: float = 60.0, timeout: float = 60, deadline: float = 0, interactive: bool = True):
+		self.maxAttempts = maxAttempts
+		self.backoffBase = backoffBase #Seconds before the first retry, doubles every attempt
+		self.backoffMax = backoffMax
+		self.timeout = timeout #Seconds per request
+		self.deadline = deadline #Seconds for all requests of a run, 0 for no limit
+		self.interactive = interactive #Ask the user before giving up
+		self.start()
+
+	def start(self):
+		self.started = time.monotonic()
+
+	def expired(self) -> bool:
+		return self.deadline > 0 and time.monotonic() - self.started > self.deadline
+
+	def backoff(self, attempts: int, response=None) -> float:
+		#Honour Retry-After if the server sent one, otherwise exponential back off with jitter
+		if response is not None and response.headers.get("Retry-After", "").isdigit():
+			delay = float(response.headers["Retry-After"])
+		else:
+			delay = min(self.backoffMax, self.backoffBase * 2 ** (attempts - 1)) * random.uniform(0.5, 1.5)
+
+		#Don't sleep past the deadline
+		if self.deadline > 0:
+			delay = max(0.0, min(delay, self.deadline - (time.monotonic() - self.started)))
+		return delay
+
+class RateLimiter:
+	#Token bucket shared by all workers, rate halves when the service pushes back and recovers on success
+
+	def __init__(self, rate: float, burst: int = 1, minRate: float = 0.2):
+		self.maxRate = rate
+		self.rate = rate
+		self.minRate = min(minRate, rate) if rate > 0 else 0
+		self.burst = max(1, burst)
+		self.tokens = self.burst
+		self.updated = time.monotonic()
+		self.lock = threading.Lock()
+
+	def acquire(self):
+		if self.maxRate <= 0:
+			return #Rate limit disabled
+
+		while True:
+			with self.lock:
+				now = time.monotonic()
+				self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+				self.updated = now
+
+				if self.tokens >= 1:
+					self.tokens -= 1
+					return
+
+				wait = (1 - self.tokens) / self.rate
+			time.sleep(wait)
+
+	def slowDown(self):
+		with self.lock:
+			self.rate = max(self.minRate, self.rate / 2)
+
+	def speedUp(self):
+		with self.lock:
+			self.rate = min(self.maxRate, self.rate + self.maxRate * 0.1)
+
+def _shared(index: int):
+	#RateLimiter attribute kept in the shared array of a SharedRateLimiter
+	return property(lambda self: self.shared[index], lambda self, value: self.shared.__setitem__(index, value))
+
+class SharedRateLimiter(RateLimiter):
+	#Token bucket shared by the worker processes of a sharded backfill, one rate limit for all of them.
+	#Pass it to the workers when they start (e.g. Pool initargs), the state lives in shared memory
+
+	rate = _shared(0)
+	tokens = _shared(1)
+	updated = _shared(2)
+
+	def __init__(self, rate: float, burst: int = 1, minRate: float = 0.2):
+		import multiprocessing
+
+		self.shared = multiprocessing.Array("d", 3)
+		super().__init__(rate, burst, minRate)
+		self.lock = self.shared.get_lock() #time.monotonic is system wide, so tokens refill the same in every process
+
+class GurasTransport:
+	#Keep-alive HTTP session shared by all GURAS workers
+
+	def __init__(self, poolSize: int = 4, connectTimeout: float = 10, readTimeout: float = 60, caBundle: str = ""):
+		self.timeout = (connectTimeout, readTimeout)
+		self.session = requests.Session()
+		self.session.headers.update({"Accept-Encoding": "gzip, deflate", "Connection": "keep-alive"})
+		if caBundle:
+			self.session.verify = caBundle #Corporate CA bundle for the proxy's certificate
+
+		#One pooled connection per worker, retries are handled by RetryPolicy
+		adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, poolSize), max_retries=0)
+		self.session.mount("https://", adapter)
+		self.session.mount("http://", adapter)
+
+	def request(self, method: str, url: str, params: dict) -> requests.Response:
+		if method == "get":
+			return self.session.get(url, params=params, timeout=self.timeout)
+		#Where clause goes in the body, not the URL
+		return self.session.post(url, data=params, timeout=self.timeout)
+
+	def close(self):
+		self.session.close()
+
+class GurasClient:
+
+	def __init__(self, concurrency: int = 4, rate: float = 5.0, mode: str = "threads", retry: RetryPolicy = None, cache=None, baseURL: str = GURAS_URL, metrics=None, transport: GurasTransport = None, limiter: RateLimiter = None):
+		if mode not in ("threads", "asyncio"):
+			raise ValueError("Unknown GURAS client mode: {}".format(mode))
+
+		self.baseURL = baseURL
+		self.concurrency = max(1, concurrency)
+		self.limiter = limiter if limiter is not None else RateLimiter(rate, burst=self.concurrency) #Shared across processes by sharded backfills
+		self.mode = mode
+		self.retry = retry if retry is not None else RetryPolicy()
+		self.transport = transport if transport is not None else GurasTransport(self.concurrency, readTimeout=self.retry.timeout)
+		self.promptLock = threading.Lock() #Only one worker asks the user at a time
+		self.aborted = False #The user chose to stop, workers still running don't ask again
+		self.cache = cache #Optional GurasCache, only cache misses are sent to the service
+		self.layers = dict() #layer -> advertised limits
+		self.layersLock = threading.Lock()
+		self.metrics = metrics #Optional RunMetrics, every request is recorded
+
+	def layerURL(self, layer: int) -> str:
+		return "{}/{}/query".format(self.baseURL, layer)
+
+	def layerInfo(self, layer: int, serviceName: str) -> dict:
+		#Read the layer's transfer limits once
+		with self.layersLock:
+			if layer in self.layers:
+				return self.layers[layer]
+
+			info = {"maxRecordCount": 0, "supportsPagination": False, "objectIdField": "objectid"}
+			jsonResult = self._getOrNone("{}/{}".format(self.baseURL, layer), {'f':'json'}, serviceName, method="get")
+
+			if jsonResult:
+				info["maxRecordCount"] = int(jsonResult.get("maxRecordCount") or 0)
+				info["supportsPagination"] = bool((jsonResult.get("advancedQueryCapabilities") or {}).get("supportsPagination"))
+				for field in jsonResult.get("fields") or []:
+					if field.get("type") == "esriFieldTypeOID":
+						info["objectIdField"] = field["name"]
+
+			if info["maxRecordCount"] > 0:
+				info["chunkSize"] = min(MAX_CHUNK_SIZE, info["maxRecordCount"])
+			else:
+				info["chunkSize"] = CHUNK_SIZE
+
+			logging.debug("GURAS layer {}: {}".format(layer, info))
+			self.layers[layer] = info
+			return info
+
+	def queryIn(self, layer: int, field: str, keys, outFields: str, serviceName: str, quote: bool = False, extraWhere: str = "", useCache: bool = True) -> tuple:
+		#Query layer for all distinct keys, returns (features in key order, keys of chunks that gave up)
+		keys = list(dict.fromkeys(cacheKey(key) for key in keys))
+		if self.cache is None or not useCache:
+			return self._fetchIn(layer, field, keys, outFields, serviceName, quote, extraWhere)
+
+		cached, misses = self.cache.get(layer, keys, outFields)
+		fetched, failed = self._fetchIn(layer, field, misses, outFields, serviceName, quote, extraWhere)
+
+		#Group fetched features by key, keys without features are stored as 'no GURAS record'
+		failedKeys = set(failed)
+		byKey = {key: list() for key in misses if key not in failedKeys}
+		unmatched = list()
+		for feature in fetched:
+			key = cacheKey(feature['attributes'].get(field))
+			if key in byKey:
+				byKey[key].append(feature)
+			else:
+				unmatched.append(feature)
+
+		self.cache.put(layer, byKey, outFields)
+
+		features = list()
+		for key in keys:
+			features.extend(cached[key] if key in cached else byKey.get(key, []))
+
+		return features + unmatched, failed
+
+	def _fetchIn(self, layer: int, field: str, keys: list, outFields: str, serviceName: str, quote: bool, extraWhere: str) -> tuple:
+		#Query layer for keys in chunks, returns (features of all chunks in key order, keys of chunks that gave up)
+		if not keys:
+			return list(), list()
+
+		info = self.layerInfo(layer, serviceName)
+		chunkSize = info["chunkSize"]
+		chunks = [keys[i:i + chunkSize] for i in range(0, len(keys), chunkSize)]
+
+		features = list()
+		failed = list()
+		results = self.queryAll(lambda chunk: self._queryChunk(layer, field, chunk, outFields, serviceName, quote, extraWhere), chunks)
+		for chunk, chunkFeatures in zip(chunks, results):
+			if chunkFeatures is None:
+				failed.extend(chunk)
+			else:
+				features.extend(chunkFeatures)
+
+		if failed:
+			logging.info("[WARNING] {} unavailable for {} x keys".format(serviceName, len(failed)))
+
+		return features, failed
+
+	def _queryChunk(self, layer: int, field: str, keys: list, outFields: str, serviceName: str, quote: bool, extraWhere: str):
+		#Query one chunk of keys, following the transfer limit until all features are returned. None if the service gave up
+		info = self.layers[layer]
+
+		where = whereIn(field, keys, quote)
+		if extraWhere:
+			where += " and {}".format(extraWhere)
+
+		params = {
+			'f':'json',
+			'returnGeometry':'false',
+			'OutFields':outFields,
+			'where':where
+		}
+		if info["supportsPagination"]:
+			params['orderByFields'] = info["objectIdField"]
+			params['resultRecordCount'] = info["maxRecordCount"]
+
+		features = list()
+		while True:
+			if info["supportsPagination"]:
+				params['resultOffset'] = len(features)
+
+			jsonResult = self._getOrNone(self.layerURL(layer), params, serviceName)
+			if jsonResult is None:
+				return None
+
+			page = jsonResult.get('features') or []
+			features.extend(page)
+
+			if not jsonResult.get('exceededTransferLimit') or not page:
+				return features
+
+			if not info["supportsPagination"]:
+				#Layer can't page, split the chunk until each half fits under the limit
+				if len(keys) == 1:
+					logging.info("[WARNING] {} result for {} truncated at {} records".format(serviceName, keys[0], len(features)))
+					return features
+
+				half = len(keys) // 2
+				first = self._queryChunk(layer, field, keys[:half], outFields, serviceName, quote, extraWhere)
+				second = self._queryChunk(layer, field, keys[half:], outFields, serviceName, quote, extraWhere)
+				if first is None or second is None:
+					return None
+				return first + second
+
+	def queryAll(self, fetch, items: list) -> list:
+		#Run fetch over all items concurrently, results are returned in the same order as items
+		if not items:
+			return list()
+
+		if self.metrics is not None:
+			fetch = self.metrics.bind(fetch)
+
+		if self.mode == "asyncio":
+			return asyncio.run(self._queryAllAsync(fetch, items))
+
+		with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+			return list(pool.map(fetch, items))
+
+	async def _queryAllAsync(self, fetch, items: list) -> list:
+		semaphore = asyncio.Semaphore(self.concurrency)
+
+		async def run(item):
+			async with semaphore:
+				return await asyncio.to_thread(fetch, item)
+
+		return await asyncio.gather(*(run(item) for item in items))
+
+	def _getOrNone(self, baseURL: str, params: dict, serviceName: str, method: str = "post"):
+		try:
+			return self.getRESTData(baseURL, params, serviceName, method)
+		except ServiceUnavailable as e:
+			logging.info("[WARNING] {}".format(e))
+			return None
+
+	def getRESTData(self, baseURL: str, params: dict, serviceName: str, method: str = "post") -> dict:
+		attempts = 0
+
+		while True:
+			if self.retry.expired():
+				self._giveUp("\n{} deadline reached, Do you want to try again? y/n\n".format(serviceName),
+							"{} request abandoned, run deadline of {}s reached".format(serviceName, self.retry.deadline))
+				self.retry.start()
+				attempts = 0
+
+			self.limiter.acquire()
+
+			response = None
+			status = 0
+			requested = time.perf_counter()
+			try:
+				response = self.transport.request(method, baseURL, params)
+				status = response.status_code
+			except requests.exceptions.RequestException as e:
+				logging.debug("{} request failed: {}".format(serviceName, e))
+
+			if self.metrics is not None:
+				self.metrics.request(time.perf_counter() - requested, self._received(response), status)
+
+			if status == 200:
+				try:
+					jsonResult = json.loads(response.content)
+				except ValueError as e:
+					jsonResult = e
+				if not isinstance(jsonResult, dict):
+					#A proxy or gateway page or a truncated body, retried like a gateway error
+					jsonResult = {'error': {'code': 502, 'message': "Response isn't JSON: {}".format(jsonResult)}}
+
+				#ArcGIS reports query errors in the body of a 200 response
+				if not jsonResult.get('error'):
+					self.limiter.speedUp()
+					return jsonResult
+
+				status = int(jsonResult['error'].get('code') or 500)
+				logging.debug("{} error: {}".format(serviceName, jsonResult['error']))
+
+			if status and status not in RETRY_STATUS:
+				#Not a transient error, retrying without the user won't help
+				self._giveUp("\nInvalid response received from {} (Response code: {}), run query again? y/n\n".format(serviceName, status),
+							"{} returned response code {}".format(serviceName, status))
+				attempts = 0
+				continue
+
+			#Throttled, server error or timeout. Back off and slow all workers down
+			attempts += 1
+			self.limiter.slowDown()
+
+			if attempts >= self.retry.maxAttempts:
+				self._giveUp("\nRequest to {} service failed {} times, Do you want to try again? y/n\n".format(serviceName, attempts),
+							"{} request failed {} times".format(serviceName, attempts))
+				attempts = 0
+				continue
+
+			time.sleep(self.retry.backoff(attempts, response))
+
+	def _received(self, response) -> int:
+		#Bytes on the wire, compressed responses report their Content-Length
+		if response is None:
+			return 0
+		length = response.headers.get("Content-Length", "")
+		return int(length) if length.isdigit() else len(response.content)
+
+	def close(self):
+		self.transport.close()
+
+	def _giveUp(self, prompt: str, reason: str):
+		#Interactive runs ask the user, unattended runs abandon the chunk
+		if not self.retry.interactive:
+			raise ServiceUnavailable(reason)
+		self._askRetry(prompt)
+
+	def _askRetry(self, msg: str):
+		#Runs on a worker thread, so n raises RunAborted for queryAll to pass on to the caller
+		with self.promptLock:
+			while not self.aborted:
+				select = input(msg)
+				if select == "y":
+					return
+				elif select == "n":
+					self.aborted = True
+				else:
+					print("Invalid selection. Please enter y or n")
+			raise RunAborted("GURAS request abandoned by the user")
+
+def gurasClientFromConfig(interactive: bool = True, cache=None, metrics=None, limiter: RateLimiter = None) -> GurasClient:
+	#GurasClient with the retry policy, transport and limits set in config
+	retryPolicy = RetryPolicy(config.gurasMaxAttempts, config.gurasBackoffBase, config.gurasBackoffMax, config.gurasTimeout, config.gurasDeadline, interactive=interactive)
+	gurasTransport = GurasTransport(config.gurasConcurrency, config.gurasConnectTimeout, config.gurasTimeout, config.gurasCABundle)
+	return GurasClient(config.gurasConcurrency, config.gurasRateLimit, config.gurasMode, retryPolicy, cache=cache, metrics=metrics, transport=gurasTransport, limiter=limiter)
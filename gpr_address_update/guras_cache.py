@@ -0,0 +1,99 @@
+'''GURAS Lookup Cache
+	Local SQLite cache of GURAS query results so consecutive runs only send new keys to the
+	REST service. Layer 10 results are keyed by ptlotsecpn and layer 9 results by propid (each
+	entry holds every propid/sppropid record returned for it). Keys with no GURAS record can be
+	cached as negative entries with their own, shorter, TTL.
+	Entries remember the OutFields they were fetched with, an entry is only used for a query whose
+	fields it holds ('*' holds every field).
+'''
+
+import json
+import sqlite3
+import time
+
+LOOKUP_CHUNK = 500 #Keys per select, below SQLite's bind variable limit
+
+def cacheKey(key) -> str:
+	#Normalise keys so 123, 123.0 and '123' share an entry
+	if isinstance(key, float) and key.is_integer():
+		key = int(key)
+	return str(key)
+
+def covers(cachedFields: str, outFields: str) -> bool:
+	#Whether an entry fetched with cachedFields has every field of outFields
+	if cachedFields == "*":
+		return True
+	if outFields == "*":
+		return False
+	return set(outFields.split(",")) <= set(cachedFields.split(","))
+
+class GurasCache:
+
+	def __init__(self, path: str = "guras_cache.db", ttlDays: float = 7, negativeTtlDays: float = 1, refresh: bool = False):
+		self.path = path
+		self.ttl = ttlDays * 86400
+		self.negativeTtl = negativeTtlDays * 86400
+		self.refresh = refresh #Ignore cached entries, results are still stored
+		self.hits = 0
+		self.misses = 0
+
+		#Streamed runs look up from a worker thread, the workers of a sharded backfill share the file
+		self.connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+		self.connection.execute("create table if not exists guras_cache (\
+			layer integer not null,\
+			key text not null,\
+			features text not null,\
+			fetched real not null,\
+			out_fields text not null default '*',\
+			primary key (layer, key))")
+
+		#Caches made before projected queries hold every field
+		if "out_fields" not in [row[1] for row in self.connection.execute("pragma table_info(guras_cache)")]:
+			self.connection.execute("alter table guras_cache add column out_fields text not null default '*'")
+		self.connection.commit()
+
+	def get(self, layer: int, keys, outFields: str = "*") -> tuple:
+		#Returns (cached features by key, keys to fetch)
+		keys = list(dict.fromkeys(cacheKey(key) for key in keys))
+		cached = dict()
+
+		if not self.refresh:
+			now = time.time()
+			for i in range(0, len(keys), LOOKUP_CHUNK):
+				chunk = keys[i:i + LOOKUP_CHUNK]
+				rows = self.connection.execute("select key, features, fetched, out_fields from guras_cache where layer = ? and key in ({})".format(
+					",".join("?" * len(chunk))), [layer] + chunk)
+
+				for key, features, fetched, fields in rows:
+					if not covers(fields, outFields):
+						continue
+					features = json.loads(features)
+					ttl = self.ttl if features else self.negativeTtl
+					if now - fetched < ttl:
+						cached[key] = features
+
+		misses = [key for key in keys if key not in cached]
+		self.hits += len(cached)
+		self.misses += len(misses)
+
+		return cached, misses
+
+	def put(self, layer: int, featuresByKey: dict, outFields: str = "*"):
+		#Store fetched results, keys with no features are only stored if negative caching is on
+		now = time.time()
+		rows = [(layer, cacheKey(key), json.dumps(features), now, outFields) for key, features in featuresByKey.items()
+				if features or self.negativeTtl > 0]
+
+		self.connection.executemany("insert or replace into guras_cache (layer, key, features, fetched, out_fields) values (?, ?, ?, ?, ?)", rows)
+		self.connection.commit()
+
+	def purge(self):
+		#Remove entries older than the longest TTL
+		self.connection.execute("delete from guras_cache where fetched < ?", (time.time() - max(self.ttl, self.negativeTtl),))
+		self.connection.commit()
+
+	def close(self):
+		self.connection.close()
+
+	def summary(self) -> str:
+		return "GURAS cache: {} x hits, {} x misses{}".format(self.hits, self.misses, " (refresh)" if self.refresh else "")
@@ -0,0 +1,307 @@
+'''GPR Address Update Run Metrics
+	Per-stage instrumentation for a run: wall time, database round trips, GURAS REST calls with
+	latency percentiles and bytes received, rows in/out and peak traced memory. The report is
+	written as one JSON file per run so runs can be compared over time.
+	Database round trips are counted by CountingCursor, fetches are counted per arraysize batch.
+	Each thread has its own current stage, so streamed stages running side by side are measured
+	separately. A stage that is entered once per batch adds up over all of its batches. REST latency
+	percentiles come from a uniform sample of at most LATENCY_SAMPLES calls per stage, so a
+	long-running service holds a fixed amount of them, the max is exact.
+	RunProfiler is the --profile cProfile dump, with the threads the run starts merged in.
+'''
+
+import cProfile
+import json
+import logging
+import math
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+LATENCY_SAMPLES = 10000 #REST latencies kept per stage for the percentiles
+
+def percentile(values: list, p: float):
+	#Nearest rank percentile, None if there are no values
+	if not values:
+		return None
+	values = sorted(values)
+	return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+class StageMetrics:
+
+	def __init__(self, name: str, rowsIn=None):
+		self.name = name
+		self.rowsIn = rowsIn
+		self.rowsOut = None
+		self.seconds = 0.0
+		self.dbRoundTrips = 0
+		self.restCalls = 0
+		self.restErrors = 0
+		self.restLatencies = list() #Reservoir sample of the calls' latencies
+		self.restLatencyMax = None
+		self.bytesReceived = 0
+		self.peakMemory = None
+		self.batches = 0
+
+	def report(self) -> dict:
+		return {
+			"stage": self.name,
+			"seconds": round(self.seconds, 4),
+			"rowsIn": self.rowsIn,
+			"rowsOut": self.rowsOut,
+			"batches": self.batches,
+			"dbRoundTrips": self.dbRoundTrips,
+			"restCalls": self.restCalls,
+			"restErrors": self.restErrors,
+			"restLatencyMs": {name: (round(value * 1000, 1) if value is not None else None)
+							for name, value in (("p50", percentile(self.restLatencies, 50)),
+												("p90", percentile(self.restLatencies, 90)),
+												("p99", percentile(self.restLatencies, 99)),
+												("max", self.restLatencyMax))},
+			"bytesReceived": self.bytesReceived,
+			"peakMemoryMB": round(self.peakMemory / 1048576, 1) if self.peakMemory is not None else None
+		}
+
+	def addLatency(self, seconds: float):
+		#Latency of the restCalls-th call, every call so far has the same chance of being in the sample
+		self.restLatencyMax = max(self.restLatencyMax or 0, seconds)
+		if len(self.restLatencies) < LATENCY_SAMPLES:
+			self.restLatencies.append(seconds)
+		else:
+			i = random.randrange(self.restCalls)
+			if i < LATENCY_SAMPLES:
+				self.restLatencies[i] = seconds
+
+	def mergeLatencies(self, other):
+		#Combine two samples, before restCalls is summed. Each side keeps a share of a full sample in proportion to its calls
+		if other.restLatencyMax is not None:
+			self.restLatencyMax = max(self.restLatencyMax or 0, other.restLatencyMax)
+		if len(self.restLatencies) + len(other.restLatencies) <= LATENCY_SAMPLES:
+			self.restLatencies.extend(other.restLatencies)
+			return
+		keep = round(LATENCY_SAMPLES * self.restCalls / (self.restCalls + other.restCalls))
+		self.restLatencies = (random.sample(self.restLatencies, min(keep, len(self.restLatencies)))
+							+ random.sample(other.restLatencies, min(LATENCY_SAMPLES - keep, len(other.restLatencies))))
+
+class RunMetrics:
+
+	def __init__(self, traceMemory: bool = True):
+		self.traceMemory = traceMemory #tracemalloc slows allocation heavy stages down
+		self.started = datetime.now()
+		self.clock = time.perf_counter()
+		self.stages = list()
+		self.records = dict() #name -> StageMetrics
+		self.local = threading.local() #Current stage of each thread
+		self.other = StageMetrics("Outside stages") #Calls made between stages
+		self.lock = threading.Lock()
+		self.info = dict() #Run level values, e.g. counts and settings
+
+		if self.traceMemory and not tracemalloc.is_tracing():
+			tracemalloc.start()
+
+	def begin(self, name: str, rowsIn=None) -> StageMetrics:
+		#Start timing a pipeline stage in this thread, the thread's previous stage is ended if it is still open
+		self.end()
+
+		with self.lock:
+			record = self.records.get(name)
+			if record is None:
+				record = self.records[name] = StageMetrics(name)
+				self.stages.append(record)
+			if rowsIn is not None:
+				record.rowsIn = (record.rowsIn or 0) + rowsIn
+
+		if self.traceMemory:
+			tracemalloc.reset_peak()
+		self.local.current = record
+		self.local.started = time.perf_counter()
+		return record
+
+	def end(self, rowsOut=None):
+		record = getattr(self.local, "current", None)
+		if record is None:
+			return
+
+		seconds = time.perf_counter() - self.local.started
+		with self.lock:
+			record.seconds += seconds
+			record.batches += 1
+			if rowsOut is not None:
+				record.rowsOut = (record.rowsOut or 0) + rowsOut
+			if self.traceMemory:
+				record.peakMemory = max(record.peakMemory or 0, tracemalloc.get_traced_memory()[1])
+		self.local.current = None
+		logging.debug("Stage {} took {:.2f}s".format(record.name, seconds))
+
+	@contextmanager
+	def stage(self, name: str, rowsIn=None):
+		#Time a block as one stage, rowsOut can be set on the yielded StageMetrics
+		record = self.begin(name, rowsIn)
+		try:
+			yield record
+		finally:
+			self.end()
+
+	def bind(self, fn):
+		#Calls made by fn in worker threads count towards the stage of the thread that bound it
+		record = getattr(self.local, "current", None)
+
+		def run(*args, **kwargs):
+			previous = getattr(self.local, "current", None)
+			self.local.current = record
+			try:
+				return fn(*args, **kwargs)
+			finally:
+				self.local.current = previous
+		return run
+
+	def _record(self) -> StageMetrics:
+		record = getattr(self.local, "current", None)
+		return record if record is not None else self.other
+
+	def roundTrips(self, count: int = 1):
+		with self.lock:
+			self._record().dbRoundTrips += count
+
+	def request(self, seconds: float, received: int, status: int):
+		#One REST call, called from the GURAS worker threads
+		with self.lock:
+			record = self._record()
+			record.restCalls += 1
+			record.addLatency(seconds)
+			record.bytesReceived += received
+			if status != 200:
+				record.restErrors += 1
+
+	def report(self) -> dict:
+		self.end()
+		stages = [record.report() for record in self.stages]
+		if self.other.dbRoundTrips or self.other.restCalls:
+			stages.append(self.other.report())
+
+		return {
+			"started": self.started.strftime("%Y-%m-%d %H:%M:%S"),
+			"seconds": round(time.perf_counter() - self.clock, 4), #Wall time, streamed stages overlap
+			"dbRoundTrips": sum(stage["dbRoundTrips"] for stage in stages),
+			"restCalls": sum(stage["restCalls"] for stage in stages),
+			"bytesReceived": sum(stage["bytesReceived"] for stage in stages),
+			"info": self.info,
+			"stages": stages
+		}
+
+	def write(self, path: str):
+		directory = os.path.dirname(path)
+		if directory:
+			os.makedirs(directory, exist_ok=True)
+		with open(path, "w") as f:
+			json.dump(self.report(), f, indent=2, default=str)
+		logging.info("[PROCESS] Run metrics written: {}".format(path))
+
+	def merge(self, records: list):
+		#Add stages measured in another process, e.g. the shards of a backfill
+		with self.lock:
+			for other in records:
+				record = self.records.get(other.name)
+				if record is None:
+					record = self.records[other.name] = StageMetrics(other.name)
+					self.stages.append(record)
+				for name in ("rowsIn", "rowsOut"):
+					if getattr(other, name) is not None:
+						setattr(record, name, (getattr(record, name) or 0) + getattr(other, name))
+				record.seconds += other.seconds #Summed over the workers, not wall time
+				record.batches += other.batches
+				record.dbRoundTrips += other.dbRoundTrips
+				record.mergeLatencies(other)
+				record.restCalls += other.restCalls
+				record.restErrors += other.restErrors
+				record.bytesReceived += other.bytesReceived
+				if other.peakMemory is not None:
+					record.peakMemory = max(record.peakMemory or 0, other.peakMemory)
+
+	def summary(self) -> str:
+		return "Stages: " + ", ".join("{} {:.2f}s".format(record.name, record.seconds) for record in self.stages)
+
+class CountingCursor:
+	#Wraps a database cursor and counts its round trips into RunMetrics
+
+	def __init__(self, cursor, metrics: RunMetrics):
+		object.__setattr__(self, "cursor", cursor)
+		object.__setattr__(self, "metrics", metrics)
+
+	def __getattr__(self, name):
+		return getattr(self.cursor, name)
+
+	def __setattr__(self, name, value):
+		setattr(self.cursor, name, value)
+
+	def execute(self, *args, **kwargs):
+		self.metrics.roundTrips()
+		return self.cursor.execute(*args, **kwargs)
+
+	def executemany(self, *args, **kwargs):
+		self.metrics.roundTrips()
+		return self.cursor.executemany(*args, **kwargs)
+
+	def fetchall(self):
+		rows = self.cursor.fetchall()
+		self._fetched(len(rows))
+		return rows
+
+	def fetchmany(self, *args, **kwargs):
+		rows = self.cursor.fetchmany(*args, **kwargs)
+		if rows:
+			self.metrics.roundTrips()
+		return rows
+
+	def _fetched(self, rows: int):
+		#The first batch comes back with execute, each further arraysize batch is one more round trip
+		arraysize = max(1, getattr(self.cursor, "arraysize", 100) or 100)
+		if rows > arraysize:
+			self.metrics.roundTrips(math.ceil(rows / arraysize) - 1)
+
+class RunProfiler:
+	#cProfile only sees the thread it is enabled in. Threads started while profiling (streamed stages, GURAS
+	#requests, reference data) each get their own profiler and every profile is merged into one dump
+
+	def __init__(self):
+		self.profilers = list()
+		self.lock = threading.Lock()
+
+	def enable(self):
+		threading.setprofile(self._startThread)
+		self._profiler().enable()
+
+	def _profiler(self) -> cProfile.Profile:
+		profiler = cProfile.Profile()
+		with self.lock:
+			self.profilers.append(profiler)
+		return profiler
+
+	def _startThread(self, frame, event, arg):
+		#Runs once at the start of each new thread, the thread's profiler replaces this hook
+		sys.setprofile(None)
+		try:
+			self._profiler().enable()
+		except ValueError:
+			pass #Python 3.12+ allows one active profiler, it already sees every thread
+
+	def disable(self):
+		threading.setprofile(None)
+		with self.lock:
+			self.profilers[0].disable()
+
+	def dump_stats(self, path: str):
+		with self.lock:
+			profilers = list(self.profilers)
+		stats = pstats.Stats(profilers[0])
+		for profiler in profilers[1:]:
+			profiler.create_stats()
+			if profiler.stats:
+				stats.add(profiler)
+		stats.dump_stats(path)
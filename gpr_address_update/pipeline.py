@@ -0,0 +1,267 @@
+'''GPR Address Update Pipeline
+	The per-batch steps of the update (GURAS lookup, match, validate and write) and a streaming
+	runner that moves candidate batches through them. In streaming mode every stage runs in its
+	own thread and passes batches on through bounded queues, so Oracle fetches, GURAS requests and
+	address writes overlap and only a few batches are held in memory at once. batchStages,
+	runBatches and processBatch are the loop every run mode, the backfill and the service share.
+'''
+
+import functools
+import logging
+import queue
+import threading
+
+import pandas as pd
+
+from .address_writer import CONFLICT_REASON
+from .candidates import fetchDisplay, DISPLAY_SQL
+from .guras import PROPID_LAYER, ADDRESS_LAYER
+from .guras_cache import cacheKey
+from .transform import buildUpdates, column, featureFrame, matchBatch, PROPID_COLUMNS, GURAS_COLUMNS, PROPID_OUT_FIELDS, GURAS_OUT_FIELDS
+
+_DONE = object() #End of stream marker
+
+class _Failed:
+	#Exception raised by a stage, passed downstream so the consumer raises it
+	def __init__(self, error: BaseException):
+		self.error = error
+
+def stream(source, stages: list, queueSize: int = 2):
+	#Run source and every stage in its own thread, connected by queues of queueSize batches.
+	#Each stage maps one item to the next, the output of the last stage is yielded in order
+	queues = [queue.Queue(maxsize=max(1, queueSize)) for _ in range(len(stages) + 1)]
+	stopped = threading.Event()
+
+	def put(q, item):
+		#Give up if the consumer has stopped, a full queue would block forever
+		while not stopped.is_set():
+			try:
+				q.put(item, timeout=0.5)
+				return True
+			except queue.Full:
+				pass
+		return False
+
+	def produce():
+		try:
+			for item in source:
+				if not put(queues[0], item):
+					return
+		except BaseException as e:
+			put(queues[0], _Failed(e))
+			return
+		put(queues[0], _DONE)
+
+	def work(fn, inbox, outbox):
+		while True:
+			item = inbox.get()
+			if item is _DONE or isinstance(item, _Failed):
+				put(outbox, item)
+				return
+			try:
+				item = fn(item)
+			except BaseException as e:
+				put(outbox, _Failed(e))
+				return
+			if not put(outbox, item):
+				return
+
+	threads = [threading.Thread(target=produce, name="stream-source", daemon=True)]
+	for i, fn in enumerate(stages):
+		threads.append(threading.Thread(target=work, args=(fn, queues[i], queues[i + 1]), name="stream-stage-{}".format(i + 1), daemon=True))
+	for thread in threads:
+		thread.start()
+
+	try:
+		while True:
+			item = queues[-1].get()
+			if item is _DONE:
+				return
+			if isinstance(item, _Failed):
+				raise item.error
+			yield item
+	finally:
+		stopped.set()
+
+def timedBatches(batches, metrics, name: str):
+	#Time how long each batch of a generator takes to produce
+	batches = iter(batches)
+	while True:
+		if metrics:
+			metrics.begin(name)
+		try:
+			batch = next(batches)
+		except StopIteration:
+			if metrics:
+				metrics.end()
+			return
+		if metrics:
+			metrics.end(len(batch))
+		yield batch
+
+def resolveKeys(df_propID: pd.DataFrame) -> tuple:
+	#Distinct lot -> propid/sppropid rows (the index matchGURAS fans GURAS records back out with) and the distinct propids to query
+	df_propID = df_propID.drop_duplicates(subset=PROPID_COLUMNS)
+	propIDs = list(dict.fromkeys(df_propID["attributes.propid"].map(cacheKey)))
+	return df_propID, propIDs
+
+def lookupBatch(gurasClient, df_candidates: pd.DataFrame, metrics=None, projectFields: bool = True) -> tuple:
+	#Query GURAS for the lots of a batch, returns (PropID frame, GURAS frame, lots that couldn't be queried)
+	lots = df_candidates["PTLOTSECPN"].drop_duplicates()
+	if metrics:
+		metrics.begin("PropID service", len(lots))
+
+	#Query all lots, only keep features with a PropID
+	propIDResults, failedLots = gurasClient.queryIn(PROPID_LAYER, "ptlotsecpn", lots, PROPID_OUT_FIELDS, "PropID GURAS Service", quote=True)
+	propIDResults = [feature for feature in propIDResults if feature['attributes']['propid']]
+	df_propID, propIDs = resolveKeys(featureFrame(propIDResults, PROPID_COLUMNS))
+
+	if metrics:
+		metrics.end(len(df_propID))
+		metrics.begin("GURAS service", len(propIDs))
+
+	#v7 - Each propid is sent once however many lots share it, only the fields the update needs
+	gurasResults, failedPropIDs = gurasClient.queryIn(ADDRESS_LAYER, "propid", propIDs, GURAS_OUT_FIELDS if projectFields else '*', "GURAS Address Service", extraWhere="principaladdresstype = 1")
+	df_GURAS = featureFrame(gurasResults, GURAS_COLUMNS)
+
+	if metrics:
+		metrics.end(len(df_GURAS))
+
+	#Keys of this batch's chunks that gave up
+	unavailableLots = set(failedLots)
+	unavailablePropIDs = set(failedPropIDs)
+	if unavailablePropIDs:
+		unavailableLots.update(df_propID.loc[df_propID["attributes.propid"].map(cacheKey).isin(unavailablePropIDs), "attributes.ptlotsecpn"])
+
+	return df_propID, df_GURAS, unavailableLots
+
+def exceptionDetails(gurasClient, df_exceptions: pd.DataFrame, metrics=None) -> pd.DataFrame:
+	#Exception rows only have the projected GURAS fields, fetch every field of their records by objectid for the report
+	objectIDs = pd.to_numeric(column(df_exceptions, "attributes.objectid"), errors="coerce").dropna().astype("int64")
+	if objectIDs.empty:
+		return df_exceptions
+
+	if metrics:
+		metrics.begin("GURAS exception details", objectIDs.nunique())
+
+	#Looked up by objectid, not cached alongside the propid entries
+	df_full = featureFrame(gurasClient.queryIn(ADDRESS_LAYER, "objectid", objectIDs, '*', "GURAS Address Service", useCache=False)[0], GURAS_COLUMNS)
+	if metrics:
+		metrics.end(len(df_full))
+	if df_full.empty or "attributes.objectid" not in df_full:
+		return df_exceptions
+
+	#Only add fields the rows don't have, propid/sppropid are already there as _x/_y after the match
+	extra = [name for name in df_full.columns if name not in df_exceptions.columns and name + "_y" not in df_exceptions.columns and name != "uniqueID"]
+	df_full = df_full[["attributes.objectid"] + extra].drop_duplicates(subset="attributes.objectid")
+	df_full["attributes.objectid"] = pd.to_numeric(df_full["attributes.objectid"], errors="coerce")
+
+	df_exceptions = df_exceptions.assign(**{"attributes.objectid": pd.to_numeric(column(df_exceptions, "attributes.objectid"), errors="coerce")})
+	return df_exceptions.merge(df_full, on="attributes.objectid", how="left")
+
+def describeAddresses(c, df_exceptions: pd.DataFrame, df_no_guras: pd.DataFrame, sql: str = DISPLAY_SQL) -> tuple:
+	#Display address and suburb of the report rows, the candidate query doesn't build them for every candidate
+	addressIDs = pd.concat([column(df_exceptions, "ADDRESS_ID"), column(df_no_guras, "ADDRESS_ID")])
+	addressIDs = pd.to_numeric(addressIDs, errors="coerce").dropna().astype("int64").unique()
+	df_display = fetchDisplay(c, addressIDs, sql)
+	df_display["ADDRESS_ID"] = pd.to_numeric(df_display["ADDRESS_ID"]).astype("float64")
+
+	def describe(df, suffix):
+		if "ADDRESS_ID" not in df:
+			return df
+		display = df_display.rename(columns={"ADDRESS": "ADDRESS" + suffix, "SUBURB_AND_POSTCODE": "SUBURB_AND_POSTCODE" + suffix})
+		key = pd.to_numeric(df["ADDRESS_ID"], errors="coerce").astype("float64")
+		return df.assign(_key=key).merge(display.rename(columns={"ADDRESS_ID": "_key"}), on="_key", how="left").drop(columns="_key")
+
+	return describe(df_exceptions, ""), describe(df_no_guras, "_x")
+
+def writeBatch(addrWriter, refData, df_m_dd_1: pd.DataFrame, metrics=None) -> pd.DataFrame:
+	#Validate and write the 1 to 1 matches of a batch, returns the rows that weren't updated with their Exception_Reason
+	if metrics:
+		metrics.begin("Transform and validate", len(df_m_dd_1))
+
+	#Map and validate all 1 to 1 matches at once
+	df_updates = buildUpdates(df_m_dd_1, refData)
+	valid = df_updates["Exception_Reason"].isna()
+
+	if metrics:
+		metrics.end(int(valid.sum()))
+		metrics.begin("Address writes", int(valid.sum()))
+
+	#VALID ADDRESSES, UPDATE GPR
+	updated = addrWriter.updated
+	conflicts = len(addrWriter.conflicts)
+	addrWriter.addFrame(df_updates.loc[valid])
+	addrWriter.flush()
+
+	#Handle INVALID Addresses
+	df_invalid = df_m_dd_1.loc[~valid]
+	df_invalid["Exception_Reason"] = df_updates.loc[~valid, "Exception_Reason"]
+
+	#v7 - Addresses edited in GPR since extraction are not overwritten
+	df_conflicts = df_m_dd_1.loc[addrWriter.conflicts[conflicts:]]
+	df_conflicts["Exception_Reason"] = CONFLICT_REASON
+
+	if metrics:
+		metrics.end(addrWriter.updated - updated)
+
+	logging.debug("Batch written: {} x Updated, {} x Invalid, {} x Version conflicts".format(addrWriter.updated - updated, len(df_invalid), len(df_conflicts)))
+	return pd.concat([df_invalid, df_conflicts])
+
+def batchStages(gurasClient, metrics=None, projectFields: bool = True, consolidate: bool = True, maxGap: int = 2, match: bool = True) -> list:
+	#GURAS lookup and match of a batch as stages for runBatches, match=False for server-side runs that match in Oracle
+	def lookupStage(df_batch):
+		#gurasDeadline applies to each batch, long streamed runs, shards and service cycles don't outlive it
+		gurasClient.retry.start()
+		return (df_batch,) + lookupBatch(gurasClient, df_batch, metrics, projectFields)
+
+	def matchStage(looked_up):
+		df_batch, df_propID, df_GURAS, unavailableLots = looked_up
+		if metrics:
+			metrics.begin("Match", len(df_GURAS))
+		df_m_dd_1, df_exceptions, df_no_guras = matchBatch(df_batch, df_propID, df_GURAS, unavailableLots, consolidate, maxGap)
+		if metrics:
+			metrics.end(len(df_m_dd_1))
+		return df_batch, df_m_dd_1, df_exceptions, df_no_guras
+
+	return [lookupStage, matchStage] if match else [lookupStage]
+
+def runBatches(batches, stages: list, queueSize: int = None):
+	#Every batch through the stages, streamed through overlapping threads if queueSize is given, else one batch at a time
+	if queueSize is None:
+		return (functools.reduce(lambda item, stage: stage(item), stages, batch) for batch in batches)
+	return stream(batches, stages, queueSize)
+
+def processBatch(result: tuple, addrWriter, refData, gurasClient, exceptionReport, c, metrics=None, projectFields: bool = True,
+				serverSide: bool = False, commit: bool = True, displaySQL: str = DISPLAY_SQL) -> pd.DataFrame:
+	#Write, commit and report one batch from runBatches, c reads the display addresses. Returns the batch's candidates
+	df_batch = result[0]
+	if serverSide:
+		#Exceptions include invalid rows and version conflicts
+		if metrics:
+			metrics.begin("Server-side match and write", df_batch["ADDRESS_ID"].nunique())
+		df_exceptions, df_no_guras = addrWriter.run(*result)
+		df_invalid = df_exceptions.iloc[:0]
+	else:
+		#Write this batch, rows that couldn't be updated are added to the exceptions
+		df_m_dd_1, df_exceptions, df_no_guras = result[1:]
+		df_invalid = writeBatch(addrWriter, refData, df_m_dd_1, metrics)
+
+	#Commit updates, change-sets are committed as they are written
+	if commit:
+		addrWriter.c.execute("commit")
+
+	#v7 - Exception rows get every GURAS field for the report
+	df_exceptions = pd.concat([df_exceptions, df_invalid])
+	if projectFields:
+		df_exceptions = exceptionDetails(gurasClient, df_exceptions, metrics)
+
+	if metrics:
+		metrics.begin("Exception report", len(df_exceptions) + len(df_no_guras))
+	df_exceptions, df_no_guras = describeAddresses(c, df_exceptions, df_no_guras, displaySQL)
+	exceptionReport.add(df_exceptions)
+	exceptionReport.addNoGuras(df_no_guras)
+	if metrics:
+		metrics.end()
+
+	return df_batch
@@ -0,0 +1,108 @@
+'''GPR Reference Data
+	Loads the GPR reference tables (road, unit and level types and suburbs) once per run
+	into case-insensitive lookup indexes, so every GURAS address can be validated without
+	further database round trips. Whole columns can be matched at once with matchNames/suburbIDs.
+'''
+
+import logging
+import time
+
+import pandas as pd
+
+class ReferenceData:
+
+	def __init__(self):
+		self.roadTypes = {} #UPPER(name) -> name as stored in GPR
+		self.unitTypes = {}
+		self.levelTypes = {}
+		self.suburbs = {} #(UPPER(name), postcode) -> suburb_id
+		self.loadTime = 0.0
+		self.hits = 0
+		self.misses = 0
+
+	def load(self, c):
+		#Read every reference table once
+		start = time.perf_counter()
+
+		self.roadTypes = self._loadNames(c, "road_type")
+		self.unitTypes = self._loadNames(c, "unit_type")
+		self.levelTypes = self._loadNames(c, "level_type")
+
+		self.suburbs = {}
+		c.execute("select suburb_id, name, postcode from suburb")
+		for suburb_id, name, postcode in c.fetchall():
+			if name is None:
+				continue
+			try:
+				postcode = int(postcode)
+			except (TypeError, ValueError):
+				postcode = 0
+			#Keep first suburb found, same as fetchone() on the old per-row query
+			self.suburbs.setdefault((name.upper(), postcode), int(suburb_id))
+
+		self.loadTime = time.perf_counter() - start
+		logging.info("[INFO] Reference data loaded in {:.2f}s: {} x Road types, {} x Unit types, {} x Level types, {} x Suburbs".format(
+			self.loadTime, len(self.roadTypes), len(self.unitTypes), len(self.levelTypes), len(self.suburbs)))
+
+		return self
+
+	def _loadNames(self, c, table):
+		c.execute("select name from {}".format(table))
+		return {row[0].upper(): row[0] for row in c.fetchall() if row[0] is not None}
+
+	def _lookup(self, index, key):
+		value = index.get(key)
+		if value is None:
+			self.misses += 1
+		else:
+			self.hits += 1
+		return value
+
+	def roadType(self, name: str):
+		#Returns road type as stored in GPR or None if not a valid road type
+		return self._lookup(self.roadTypes, name.upper())
+
+	def unitType(self, name: str):
+		return self._lookup(self.unitTypes, name.upper())
+
+	def levelType(self, name: str):
+		return self._lookup(self.levelTypes, name.upper())
+
+	def suburbID(self, suburbname, postcode) -> int:
+		#Returns GPR suburb_id, 0 if no GPR suburb matched
+		try:
+			postcode = int(postcode)
+		except (TypeError, ValueError):
+			postcode = 0
+		if not isinstance(suburbname, str):
+			suburbname = "" #None or NaN
+		suburb_id = self._lookup(self.suburbs, (suburbname.upper(), postcode))
+		return suburb_id if suburb_id is not None else 0
+
+	def matchNames(self, names: pd.Series, index: dict) -> pd.Series:
+		#Column version of roadType/unitType/levelType, NaN where not matched. Empty names aren't looked up
+		matched = names.str.upper().map(index)
+		looked = names != ''
+		self.hits += int((looked & matched.notna()).sum())
+		self.misses += int((looked & matched.isna()).sum())
+		return matched.where(looked)
+
+	def suburbIDs(self, suburbnames: pd.Series, postcodes: pd.Series) -> pd.Series:
+		#Column version of suburbID, 0 where no GPR suburb matched
+		keys = pd.MultiIndex.from_arrays([
+			suburbnames.fillna('').astype(str).str.upper(),
+			pd.to_numeric(postcodes, errors="coerce").fillna(0).astype("int64")])
+
+		suburbs = pd.Series(self.suburbs, dtype="float64")
+		if len(suburbs) > 0:
+			ids = suburbs.reindex(keys)
+		else:
+			ids = pd.Series(float("nan"), index=keys)
+
+		ids = pd.Series(ids.to_numpy(), index=suburbnames.index)
+		self.hits += int(ids.notna().sum())
+		self.misses += int(ids.isna().sum())
+		return ids.fillna(0).astype("int64")
+
+	def summary(self) -> str:
+		return "Reference lookups: {} x hits, {} x misses (loaded in {:.2f}s)".format(self.hits, self.misses, self.loadTime)
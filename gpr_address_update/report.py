@@ -0,0 +1,186 @@
+'''GPR Address Update Exceptions Report
+	Collects the GURAS records that couldn't be used to update GPR, and the candidates with no
+	GURAS record, as each batch is finished instead of appending to one growing DataFrame.
+	Excel reports are written with xlsxwriter in constant memory mode, row by row as batches
+	arrive. CSV files are appended per batch. Parquet is columnar, so batches are buffered and
+	written once when the report is closed.
+'''
+
+import logging
+import os
+import time
+
+import pandas as pd
+
+REPORT_FORMATS = ("xlsx", "csv", "parquet")
+
+#Exceptions sheet, 'Exception Reason' first
+EXCEPTION_COLUMNS = [
+	'Exception_Reason', 'PROPERTY_ID', 'PROPERTY_NO', 'CURRENT_RESPONSIBLE_PARTY', 'GPR_PROPERTY_STATUS', 'ADDRESS_ID',
+	'ADDRESS', 'SUBURB_AND_POSTCODE', 'attributes.propid_x', 'attributes.sppropid_x', 'uniqueID', 'attributes.objectid',
+	'attributes.createdate', 'attributes.gurasid', 'attributes.addresstype', 'attributes.ruraladdress', 'attributes.principaladdresstype',
+	'attributes.addressstringtype', 'attributes.principaladdresssiteoid', 'attributes.officialaddressstringoid',
+	'attributes.roadside', 'attributes.housenumberfirstprefix', 'attributes.housenumberfirst', 'attributes.housenumberfirstsuffix',
+	'attributes.housenumbersecondprefix', 'attributes.housenumbersecond', 'attributes.housenumbersecondsuffix',
+	'attributes.roadname', 'attributes.roadtype', 'attributes.roadsuffix', 'attributes.unittype', 'attributes.unitnumberprefix',
+	'attributes.unitnumber', 'attributes.unitnumbersuffix', 'attributes.leveltype', 'attributes.levelnumberprefix',
+	'attributes.levelnumber', 'attributes.levelnumbersuffix', 'attributes.addresssitename', 'attributes.buildingname',
+	'attributes.locationdescription', 'attributes.privatestreetname', 'attributes.privatestreettype', 'attributes.privatestreetsuffix',
+	'attributes.secondroadname', 'attributes.secondroadtype', 'attributes.secondroadsuffix', 'attributes.suburbname',
+	'attributes.state', 'attributes.postcode', 'attributes.council', 'attributes.deliverypointid', 'attributes.deliverypointbarcode',
+	'attributes.addressconfidence', 'attributes.contributororigin', 'attributes.contributorid', 'attributes.contributoralignment',
+	'attributes.routeoid', 'attributes.gnafprimarysiteid', 'attributes.containment', 'attributes.propid_y',
+	'attributes.sppropid_y', 'property_id_count', 'guras_prop_id_count'
+]
+
+#No GURAS sheet, candidate columns after the merge with the matches
+NO_GURAS_COLUMNS = ["PROPERTY_ID_x", "PROPERTY_NO_x", "CURRENT_RESPONSIBLE_PARTY_x", "GPR_PROPERTY_STATUS_x", "ADDRESS_ID", "ADDRESS_x", "SUBURB_AND_POSTCODE_x", "PTLOTSECPN"]
+
+#Sheet names and file suffixes of each part of the report
+PARTS = {
+	"exceptions": ("GURAS-GPR Exceptions", "", EXCEPTION_COLUMNS),
+	"noGuras": ("No GURAS", "_NoGURAS", NO_GURAS_COLUMNS)
+}
+
+EXCEL_MAX_ROWS = 1048575 #Data rows per sheet under the header
+
+class ExceptionReport:
+
+	def __init__(self, directory: str, name: str, reportFormat: str = "xlsx"):
+		if reportFormat not in REPORT_FORMATS:
+			raise ValueError("Unknown report format: {} (expected one of {})".format(reportFormat, ", ".join(REPORT_FORMATS)))
+
+		self.directory = directory
+		self.name = name
+		self.reportFormat = reportFormat
+		self.addresses = set() #ADDRESS_IDs with at least one exception
+		self.rows = {part: 0 for part in PARTS}
+		self.paths = list()
+		self.writeTime = 0.0
+
+		self.workbook = None
+		self.sheets = dict() #part -> [worksheet, next row, sheet count]
+		self.buffers = {part: list() for part in PARTS} #Parquet only
+
+	def add(self, df: pd.DataFrame):
+		#GURAS records that weren't used, with their Exception_Reason
+		self.addresses.update(int(address_id) for address_id in df["ADDRESS_ID"].dropna().unique())
+		self._write("exceptions", df)
+
+	def addNoGuras(self, df: pd.DataFrame):
+		#Candidates with no GURAS record
+		self._write("noGuras", df)
+
+	def merge(self, directory: str, name: str, chunkSize: int = 50000):
+		#Add the rows of a closed csv report, e.g. one shard of a backfill, chunkSize rows at a time
+		source = ExceptionReport(directory, name, "csv")
+		for part, (_, suffix, _) in PARTS.items():
+			path = source._path(suffix)
+			if not os.path.exists(path):
+				continue
+			for df in pd.read_csv(path, chunksize=chunkSize):
+				if part == "exceptions":
+					self.add(df)
+				else:
+					self.addNoGuras(df)
+			os.remove(path)
+
+	def _write(self, part: str, df: pd.DataFrame):
+		#Files are only opened by the first batch with rows, a report that is never closed leaves nothing open
+		if len(df) == 0:
+			return
+		start = time.perf_counter()
+		df = df.reindex(columns=PARTS[part][2]) #Only the report columns, missing GURAS attributes are blank
+
+		if self.reportFormat == "xlsx":
+			self._writeExcel(part, df)
+		elif self.reportFormat == "csv":
+			self._writeCSV(part, df)
+		else:
+			self.buffers[part].append(df)
+
+		self.rows[part] += len(df)
+		self.writeTime += time.perf_counter() - start
+
+	def _path(self, suffix: str) -> str:
+		os.makedirs(self.directory, exist_ok=True)
+		return os.path.join(self.directory, "AddressUpdateExceptions_{}{}.{}".format(self.name, suffix, self.reportFormat))
+
+	def _openExcel(self):
+		import xlsxwriter
+
+		path = self._path("")
+		self.paths.append(path)
+		self.workbook = xlsxwriter.Workbook(path, {"constant_memory": True, "strings_to_formulas": False, "strings_to_urls": False, "nan_inf_to_errors": True})
+		self.header = self.workbook.add_format({"bold": True, "border": 1, "align": "center"})
+
+		#Both sheets exist even if one has no rows
+		for part in PARTS:
+			self._addSheet(part)
+
+	def _addSheet(self, part: str):
+		sheetName, _, columns = PARTS[part]
+		count = self.sheets[part][2] + 1 if part in self.sheets else 1
+		worksheet = self.workbook.add_worksheet(sheetName if count == 1 else "{} {}".format(sheetName, count))
+
+		#First column is the row number, like the index column of DataFrame.to_excel
+		worksheet.write_row(0, 1, columns, self.header)
+		self.sheets[part] = [worksheet, 1, count]
+
+	def _writeExcel(self, part: str, df: pd.DataFrame):
+		if self.workbook is None:
+			self._openExcel()
+
+		df = df.astype(object).where(df.notna(), None) #Python values, blanks for nulls
+		for number, row in enumerate(df.itertuples(index=False), self.rows[part]):
+			sheet = self.sheets[part]
+			if sheet[1] > EXCEL_MAX_ROWS:
+				#Continue on a new sheet, a backfill can have more exceptions than one sheet holds
+				self._addSheet(part)
+				sheet = self.sheets[part]
+
+			sheet[0].write_number(sheet[1], 0, number)
+			sheet[0].write_row(sheet[1], 1, row)
+			sheet[1] += 1
+
+	def _writeCSV(self, part: str, df: pd.DataFrame):
+		path = self._path(PARTS[part][1])
+		first = path not in self.paths
+		if first:
+			self.paths.append(path)
+		df.to_csv(path, mode="w" if first else "a", header=first, index=False)
+
+	def _writeParquet(self):
+		for part, frames in self.buffers.items():
+			df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=PARTS[part][2])
+
+			#Mixed object columns can't be typed by pyarrow, keep them as text
+			for name in df.columns[df.dtypes == object]:
+				df[name] = df[name].astype("string")
+
+			path = self._path(PARTS[part][1])
+			self.paths.append(path)
+			df.to_parquet(path, index=False)
+			self.buffers[part] = list()
+
+	def close(self) -> list:
+		#Finish writing, returns the paths of the report files
+		start = time.perf_counter()
+		if self.reportFormat == "xlsx" and self.workbook is None:
+			self._openExcel()
+		if self.workbook is not None:
+			self.workbook.close()
+		elif self.reportFormat == "csv":
+			#Header only files for parts that never had a batch
+			for part in PARTS:
+				self._writeCSV(part, pd.DataFrame(columns=PARTS[part][2]))
+		elif self.reportFormat == "parquet":
+			self._writeParquet()
+		self.writeTime += time.perf_counter() - start
+
+		logging.info("[INFO] {}".format(self.summary()))
+		return self.paths
+
+	def summary(self) -> str:
+		return "Exceptions report: {} x Exception rows, {} x No GURAS rows, {} ({:.2f}s)".format(
+			self.rows["exceptions"], self.rows["noGuras"], self.reportFormat, self.writeTime)
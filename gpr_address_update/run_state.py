@@ -0,0 +1,71 @@
+'''GPR Address Update Run State
+	Local SQLite record used by incremental runs: the watermark of the last successful run and
+	the address_ids that were tried but left unresolved, with when they were last tried.
+	Incremental runs only stage candidates created since the watermark, plus unresolved
+	addresses whose retry interval has passed.
+'''
+
+import logging
+import sqlite3
+import time
+from datetime import datetime
+
+WATERMARK_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+class RunState:
+
+	def __init__(self, path: str = "run_state.db", retryHours: float = 24, windowDays: float = 90):
+		self.path = path
+		self.retryInterval = retryHours * 3600
+		self.window = windowDays * 86400
+
+		self.connection = sqlite3.connect(path)
+		self.connection.execute("create table if not exists run_state (\
+			name text primary key,\
+			value text)")
+		self.connection.execute("create table if not exists unresolved (\
+			address_id integer primary key,\
+			first_tried real not null,\
+			last_tried real not null,\
+			attempts integer not null)")
+		self.connection.commit()
+
+	def watermark(self):
+		#Database time the last successful run started, None if there hasn't been one
+		row = self.connection.execute("select value from run_state where name = 'watermark'").fetchone()
+		if row is None:
+			return None
+		return datetime.strptime(row[0], WATERMARK_FORMAT)
+
+	def dueRetries(self) -> list:
+		#Unresolved addresses whose retry interval has passed
+		rows = self.connection.execute("select address_id from unresolved where last_tried <= ?", (time.time() - self.retryInterval,))
+		return [row[0] for row in rows]
+
+	def notDue(self) -> list:
+		#Unresolved addresses tried too recently to try again
+		rows = self.connection.execute("select address_id from unresolved where last_tried > ?", (time.time() - self.retryInterval,))
+		return [row[0] for row in rows]
+
+	def record(self, runStarted: datetime, processedIDs, resolvedIDs):
+		#Save the result of a successful run and move the watermark to the start of the run
+		now = time.time()
+		resolved = set(int(address_id) for address_id in resolvedIDs)
+		unresolved = [int(address_id) for address_id in processedIDs if int(address_id) not in resolved]
+
+		self.connection.executemany("delete from unresolved where address_id = ?", [(address_id,) for address_id in resolved])
+		self.connection.executemany("insert into unresolved (address_id, first_tried, last_tried, attempts) values (?, ?, ?, 1) \
+			on conflict(address_id) do update set last_tried = excluded.last_tried, attempts = attempts + 1",
+			[(address_id, now, now) for address_id in unresolved])
+
+		#Addresses that have left the candidate window won't be picked up again
+		self.connection.execute("delete from unresolved where first_tried < ?", (now - self.window,))
+
+		self.connection.execute("insert or replace into run_state (name, value) values ('watermark', ?)", (runStarted.strftime(WATERMARK_FORMAT),))
+		self.connection.commit()
+
+		logging.info("[INFO] Run state saved: watermark {}, {} x Unresolved addresses".format(
+			runStarted.strftime(WATERMARK_FORMAT), self.connection.execute("select count(*) from unresolved").fetchone()[0]))
+
+	def close(self):
+		self.connection.close()
@@ -0,0 +1,249 @@
+'''GPR Server-side Matching
+	Alternative to matching and validating in pandas. The candidates, lot -> PropID results and
+	GURAS records of a batch are array-inserted into session-scoped global temporary tables, then
+	Oracle does the rest as set-based SQL:
+		1. Matches are grouped per property into a resolved table, with the 1 to 1 check (or the
+		   'every field agrees or is null' consolidation), the road/unit/level type and suburb
+		   validation against the reference tables, and the Exception_Reason of each property
+		2. Properties sharing an address with another valid property are marked, the addresses left
+		   are locked and those whose VERSION_NO changed since extraction marked as version conflicts
+		3. One MERGE writes every valid address, guarded by VERSION_NO and bumping it
+		4. The exceptions and the candidates with no GURAS record are selected back as keys
+	A batch costs a fixed number of round trips however many addresses it holds, and the database
+	can use its indexes on address and suburb. House number ranges are only merged client-side.
+'''
+
+import logging
+import time
+
+import pandas as pd
+
+from .address_writer import CONFLICT_REASON
+from .report import NO_GURAS_COLUMNS
+from .transform import GURAS_FIELDS, INT_FIELDS, SUBURB_REASON, TYPE_REASON, mapFields, column
+
+#GPR address columns mapped from GURAS, see transform.GURAS_FIELDS
+FIELDS = list(GURAS_FIELDS)
+TEXT_FIELDS = [field for field in FIELDS if field not in INT_FIELDS]
+
+NOT_ONE_TO_ONE_REASON = "Not a 1-to-1 match"
+UNAVAILABLE_REASON = "GURAS service unavailable"
+SHARED_ADDRESS_REASON = "Address shared by more than one matched property"
+
+CANDIDATE_TABLE_DDL = """create global temporary table {} (
+	PROPERTY_ID number, ADDRESS_ID number, VERSION_NO number, PTLOTSECPN varchar2(200)
+) on commit preserve rows"""
+
+LOT_TABLE_DDL = """create global temporary table {} (
+	PTLOTSECPN varchar2(200), UNIQUE_ID number
+) on commit preserve rows"""
+
+GURAS_TABLE_DDL = """create global temporary table {{}} (
+	UNIQUE_ID number, OBJECTID number, {}, SUBURB_NAME varchar2(255), POSTCODE number
+) on commit preserve rows""".format(", ".join("{} {}".format(field, "number" if field in INT_FIELDS else "varchar2(255)") for field in FIELDS))
+
+RESOLVED_TABLE_DDL = """create global temporary table {{}} (
+	PROPERTY_ID number, ADDRESS_ID number, VERSION_NO number, RECORDS number, {}, SUBURB_ID number, ADDRESS_TYPE_ID number,
+	EXCEPTION_REASON varchar2(255)
+) on commit preserve rows""".format(", ".join("{} {}".format(field, "number" if field in INT_FIELDS else "varchar2(255)") for field in FIELDS))
+
+#Reference names by UPPER(name), same keys as ReferenceData
+REFERENCE_NAMES = "(select upper(NAME) NAME_KEY, min(NAME) NAME from {} group by upper(NAME))"
+
+#One row per matched property: agreed field values, validated types, suburb_id and the reason it can't be updated.
+#Suburbs are joined on upper(NAME) and the numeric POSTCODE, so an index on suburb (upper(NAME), POSTCODE) serves the lookup,
+#a name and postcode held by more than one suburb keeps the lowest SUBURB_ID
+RESOLVE_SQL = """insert into {resolved} (PROPERTY_ID, ADDRESS_ID, VERSION_NO, RECORDS, {fields}, SUBURB_ID, ADDRESS_TYPE_ID, EXCEPTION_REASON)
+with matches as (
+	select distinct c.PROPERTY_ID, c.ADDRESS_ID, c.VERSION_NO, g.OBJECTID, {guras_fields}, g.SUBURB_NAME, g.POSTCODE
+	from {candidates} c
+	join {lots} l on l.PTLOTSECPN = c.PTLOTSECPN
+	join {guras} g on g.UNIQUE_ID = l.UNIQUE_ID
+), properties as (
+	select PROPERTY_ID, min(ADDRESS_ID) ADDRESS_ID, min(VERSION_NO) VERSION_NO, count(*) RECORDS,
+		{agreed_fields}, max(SUBURB_NAME) SUBURB_NAME, max(POSTCODE) POSTCODE,
+		case when {agree} then 1 else 0 end AGREE
+	from matches
+	group by PROPERTY_ID
+), validated as (
+	select p.*, rt1.NAME RT1, rt2.NAME RT2, ut.NAME UT, lt.NAME LT, s.SUBURB_ID,
+		row_number() over (partition by p.PROPERTY_ID order by s.SUBURB_ID) SUBURB_RANK
+	from properties p
+	left join {road_types} rt1 on rt1.NAME_KEY = upper(p.ROAD_1_TYPE)
+	left join {road_types} rt2 on rt2.NAME_KEY = upper(p.ROAD_2_TYPE)
+	left join {unit_types} ut on ut.NAME_KEY = upper(p.UNIT_TYPE) and p.UNIT_NO is not null
+	left join {level_types} lt on lt.NAME_KEY = upper(p.LEVEL_TYPE) and p.LEVEL_NO is not null
+	left join suburb s on upper(s.NAME) = upper(p.SUBURB_NAME) and s.POSTCODE = p.POSTCODE
+)
+select PROPERTY_ID, ADDRESS_ID, VERSION_NO, RECORDS, {final_fields}, SUBURB_ID,
+	case when ROAD_1_NAME is not null then 3 else 6 end,
+	case when RECORDS > 1 and (AGREE = 0 or :consolidate = 0) then :not_one_to_one
+		when SUBURB_ID is null then :suburb_reason
+		when (ROAD_1_TYPE is not null and RT1 is null) or (ROAD_2_TYPE is not null and RT2 is null)
+			or (UNIT_NO is not null and UNIT_TYPE is not null and UT is null and UNIT_TYPE <> 'U') or (UNIT_NO is null and UNIT_TYPE is not null)
+			or (LEVEL_NO is not null and LEVEL_TYPE is not null and LT is null) or (LEVEL_NO is null and LEVEL_TYPE is not null) then :type_reason
+	end
+from validated
+where SUBURB_RANK = 1"""
+
+#Final value of each field, types as stored in GPR. Unit type defaults to 'Unit' (GURAS 'U' means 'Unit'), level type to 'Level'
+FINAL_VALUES = {
+	"ROAD_1_TYPE": "nvl(RT1, ROAD_1_TYPE)",
+	"ROAD_2_TYPE": "nvl(RT2, ROAD_2_TYPE)",
+	"UNIT_TYPE": "case when UNIT_NO is not null and (UNIT_TYPE is null or (UT is null and UNIT_TYPE = 'U')) then 'Unit' else nvl(UT, UNIT_TYPE) end",
+	"LEVEL_TYPE": "case when LEVEL_NO is not null and LEVEL_TYPE is null then 'Level' else nvl(LT, LEVEL_TYPE) end"
+}
+
+#Valid properties sharing an address with another valid property, the address can only take one of them
+SHARED_SQL = """update {resolved} set EXCEPTION_REASON = :shared_reason
+where EXCEPTION_REASON is null
+and ADDRESS_ID in (select ADDRESS_ID from {resolved} where EXCEPTION_REASON is null group by ADDRESS_ID having count(*) > 1)"""
+
+#Holds the addresses about to be written until the commit, so the version check below still stands at the MERGE
+LOCK_SQL = """select ad.ADDRESS_ID from address ad
+where ad.ADDRESS_ID in (select ADDRESS_ID from {resolved} where EXCEPTION_REASON is null)
+for update"""
+
+#Valid properties whose address changed since extraction lost a concurrent edit, their ADDRESS_IDs are kept as the conflicts
+CONFLICT_SQL = """update {resolved} r set EXCEPTION_REASON = :conflict_reason
+where EXCEPTION_REASON is null
+and not exists (select 1 from address ad where ad.ADDRESS_ID = r.ADDRESS_ID and ad.VERSION_NO = r.VERSION_NO)"""
+
+#Every property still valid, VERSION_NO is checked again in case the lock was lost
+MERGE_SQL = """merge into address ad
+using (select * from {resolved} where EXCEPTION_REASON is null) r
+on (ad.ADDRESS_ID = r.ADDRESS_ID)
+when matched then update set {assignments}, ad.SUBURB_ID = r.SUBURB_ID, ad.ADDRESS_TYPE_ID = r.ADDRESS_TYPE_ID,
+	ad.VERSION_NO = ad.VERSION_NO + 1, ad.UPDATE_USER = 'PYTHON', ad.UPDATE_DATE = CURRENT_TIMESTAMP
+	where ad.VERSION_NO = r.VERSION_NO"""
+
+EXCEPTIONS_SQL = """select distinct c.PROPERTY_ID, c.ADDRESS_ID, g.OBJECTID, r.RECORDS, r.EXCEPTION_REASON
+from {candidates} c
+join {lots} l on l.PTLOTSECPN = c.PTLOTSECPN
+join {guras} g on g.UNIQUE_ID = l.UNIQUE_ID
+join {resolved} r on r.PROPERTY_ID = c.PROPERTY_ID
+where r.EXCEPTION_REASON is not null"""
+
+NO_GURAS_SQL = """select distinct c.ADDRESS_ID from {candidates} c
+where not exists (select 1 from {resolved} r where r.ADDRESS_ID = c.ADDRESS_ID)"""
+
+class ServerMatcher:
+
+	def __init__(self, c, tablePrefix: str = "au_address_gpr", batchSize: int = 5000, consolidate: bool = True):
+		self.c = c
+		self.batchSize = batchSize #Rows per array insert
+		self.consolidate = consolidate
+		self.tables = {
+			"candidates": tablePrefix + "_cand",
+			"lots": tablePrefix + "_lot",
+			"guras": tablePrefix + "_guras",
+			"resolved": tablePrefix + "_resolved"
+		}
+		self.updated = 0
+		self.updatedIDs = list()
+		self.conflicts = [] #ADDRESS_IDs that lost a concurrent edit, a list like AddressWriter.conflicts
+		self.batches = 0
+		self.writeTime = 0.0
+
+		self.resolveSQL = RESOLVE_SQL.format(
+			fields=", ".join(FIELDS),
+			guras_fields=", ".join("g." + field for field in FIELDS),
+			agreed_fields=", ".join("max({0}) {0}".format(field) for field in FIELDS),
+			agree=" and ".join("count(distinct {}) <= 1".format(field if field in INT_FIELDS else "upper(trim({}))".format(field))
+								for field in FIELDS + ["SUBURB_NAME", "POSTCODE"]),
+			final_fields=", ".join(FINAL_VALUES.get(field, field) for field in FIELDS),
+			road_types=REFERENCE_NAMES.format("road_type"),
+			unit_types=REFERENCE_NAMES.format("unit_type"),
+			level_types=REFERENCE_NAMES.format("level_type"),
+			**self.tables)
+		self.mergeSQL = MERGE_SQL.format(assignments=", ".join("ad.{0} = r.{0}".format(field) for field in FIELDS), **self.tables)
+
+	def createTables(self):
+		#Create the global temporary tables once, they are never dropped
+		for name, ddl in (("candidates", CANDIDATE_TABLE_DDL), ("lots", LOT_TABLE_DDL), ("guras", GURAS_TABLE_DDL), ("resolved", RESOLVED_TABLE_DDL)):
+			table = self.tables[name]
+			self.c.execute("select 1 from all_tables where table_name = upper(:name)", name=table)
+			if self.c.fetchone() is None:
+				self.c.execute(ddl.format(table))
+				logging.info("[INFO] Global temporary table {} created".format(table))
+
+	def run(self, df_candidates: pd.DataFrame, df_propID: pd.DataFrame, df_GURAS: pd.DataFrame, unavailableLots=()) -> tuple:
+		#Match, validate and write one batch in Oracle, returns (exception rows, candidates with no GURAS record) for the report
+		start = time.perf_counter()
+
+		for table in self.tables.values():
+			self.c.execute("delete from {}".format(table))
+
+		#v7 - Addresses with a lot that couldn't be queried from GURAS are reported instead of updated
+		unavailable = df_candidates["PTLOTSECPN"].isin(unavailableLots)
+		unavailableAddr = df_candidates.loc[unavailable, "ADDRESS_ID"].unique()
+		df_unavailable = df_candidates.loc[df_candidates["ADDRESS_ID"].isin(unavailableAddr)].drop_duplicates(subset="ADDRESS_ID")
+		df_unavailable["Exception_Reason"] = UNAVAILABLE_REASON
+		df_matchable = df_candidates.loc[~df_candidates["ADDRESS_ID"].isin(unavailableAddr)]
+
+		self._insert("candidates", ["PROPERTY_ID", "ADDRESS_ID", "VERSION_NO", "PTLOTSECPN"],
+					df_matchable[["PROPERTY_ID", "ADDRESS_ID", "VERSION_NO", "PTLOTSECPN"]].drop_duplicates())
+		self._insert("lots", ["PTLOTSECPN", "UNIQUE_ID"],
+					df_propID[["attributes.ptlotsecpn", "uniqueID"]].drop_duplicates())
+
+		df_GURAS = df_GURAS.drop_duplicates(subset="attributes.objectid") if "attributes.objectid" in df_GURAS else df_GURAS
+		mapped = mapFields(df_GURAS)
+		mapped.insert(0, "OBJECTID", pd.to_numeric(column(df_GURAS, "attributes.objectid"), errors="coerce"))
+		mapped.insert(0, "UNIQUE_ID", df_GURAS["uniqueID"])
+		mapped["SUBURB_NAME"] = column(df_GURAS, "attributes.suburbname")
+		mapped["POSTCODE"] = pd.to_numeric(column(df_GURAS, "attributes.postcode"), errors="coerce")
+		self._insert("guras", ["UNIQUE_ID", "OBJECTID"] + FIELDS + ["SUBURB_NAME", "POSTCODE"], mapped)
+
+		#Set-based match, validation and update
+		self.c.execute(self.resolveSQL, consolidate=int(self.consolidate), not_one_to_one=NOT_ONE_TO_ONE_REASON,
+					suburb_reason=SUBURB_REASON, type_reason=TYPE_REASON)
+		self.c.execute(SHARED_SQL.format(**self.tables), shared_reason=SHARED_ADDRESS_REASON)
+		self.c.execute(LOCK_SQL.format(**self.tables))
+		self.c.fetchall()
+		self.c.execute(CONFLICT_SQL.format(**self.tables), conflict_reason=CONFLICT_REASON)
+		if self.c.rowcount:
+			self.c.execute("select ADDRESS_ID from {resolved} where EXCEPTION_REASON = :conflict_reason".format(**self.tables), conflict_reason=CONFLICT_REASON)
+			self.conflicts.extend(int(row[0]) for row in self.c.fetchall())
+		self.c.execute(self.mergeSQL)
+		merged = self.c.rowcount
+
+		self.c.execute("select ADDRESS_ID from {resolved} where EXCEPTION_REASON is null".format(**self.tables))
+		self.updatedIDs.extend(int(row[0]) for row in self.c.fetchall())
+		self.updated += merged
+
+		df_exceptions = self._exceptions(df_matchable, df_propID, df_GURAS)
+		self.c.execute(NO_GURAS_SQL.format(**self.tables))
+		noGuras = [row[0] for row in self.c.fetchall()]
+		df_no_guras = df_matchable.loc[df_matchable["ADDRESS_ID"].isin(noGuras)]
+		df_no_guras = df_no_guras.rename(columns={name[:-2]: name for name in NO_GURAS_COLUMNS if name.endswith("_x")})
+
+		self.batches += 1
+		self.writeTime += time.perf_counter() - start
+		logging.debug("Server-side batch {}: {} x Updated, {} x Exception rows".format(self.batches, merged, len(df_exceptions)))
+
+		return pd.concat([df_exceptions, df_unavailable]), df_no_guras
+
+	def _insert(self, name: str, columns: list, df: pd.DataFrame):
+		#Array insert in batchSize round trips, NaN and '' are bound as NULL
+		sql = "insert into {} ({}) values ({})".format(self.tables[name], ", ".join(columns), ", ".join(":{}".format(i + 1) for i in range(len(columns))))
+		values = df.astype(object)
+		rows = [tuple(row) for row in values.where(values.notna() & (values != ''), None).itertuples(index=False)]
+		for i in range(0, len(rows), self.batchSize):
+			self.c.executemany(sql, rows[i:i + self.batchSize])
+
+	def _exceptions(self, df_candidates: pd.DataFrame, df_propID: pd.DataFrame, df_GURAS: pd.DataFrame) -> pd.DataFrame:
+		#Exception keys from Oracle joined back to the candidate and GURAS columns of the report
+		self.c.execute(EXCEPTIONS_SQL.format(**self.tables))
+		keys = pd.DataFrame(self.c.fetchall(), columns=["PROPERTY_ID", "ADDRESS_ID", "OBJECTID", "property_id_count", "Exception_Reason"])
+
+		candidates = df_candidates.drop(columns="PTLOTSECPN").drop_duplicates(subset=["PROPERTY_ID", "ADDRESS_ID"])
+		guras = df_GURAS.rename(columns={"attributes.propid": "attributes.propid_y", "attributes.sppropid": "attributes.sppropid_y"})
+		guras["OBJECTID"] = pd.to_numeric(column(guras, "attributes.objectid"), errors="coerce")
+		propIDs = df_propID[["uniqueID", "attributes.propid", "attributes.sppropid"]].drop_duplicates(subset="uniqueID")
+		guras = guras.merge(propIDs.rename(columns={"attributes.propid": "attributes.propid_x", "attributes.sppropid": "attributes.sppropid_x"}), on="uniqueID", how="left")
+
+		return keys.merge(candidates, on=["PROPERTY_ID", "ADDRESS_ID"], how="left").merge(guras, on="OBJECTID", how="left").drop(columns="OBJECTID")
+
+	def summary(self) -> str:
+		return "Server-side writes: {} x Updated, {} x Version conflicts in {} x Batches ({:.2f}s)".format(
+			self.updated, len(self.conflicts), self.batches, self.writeTime)
@@ -0,0 +1,220 @@
+'''GPR Address Update Service
+	Long-running alternative to the scheduled batch run. The Oracle session pool, reference data
+	indexes, GURAS client and cache stay warm between cycles. Every servicePollMinutes the service
+	picks up candidates created since the last cycle (new responsibility change events with a
+	dealing number, ADAPTER created properties) plus unresolved addresses due for a retry, and
+	streams them through lookup, match and write in micro-batches of serviceBatchSize addresses.
+	Reference data is reloaded, the GURAS cache purged and the run metrics written every
+	serviceRefreshHours. GET /health and /metrics on serviceHost:servicePort report on the service.
+
+	gpr-address-update <username> --service
+'''
+
+import json
+import logging
+import os
+import signal
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+
+from . import config
+from .address_writer import AddressWriter
+from .candidates import streamCandidates, withRetries, CANDIDATE_SQL
+from .database import ConnectionPool
+from .guras import gurasClientFromConfig
+from .guras_cache import GurasCache
+from .metrics import RunMetrics, CountingCursor
+from .pipeline import timedBatches, batchStages, runBatches, processBatch
+from .reference import ReferenceData
+from .report import ExceptionReport
+from .run_state import RunState
+
+class AddressService:
+
+	def __init__(self, username: str, pollMinutes: float = None, batchSize: int = None):
+		self.username = username
+		self.pollSeconds = (pollMinutes if pollMinutes is not None else config.servicePollMinutes) * 60
+		self.batchSize = batchSize or config.serviceBatchSize
+		self.stopping = threading.Event()
+		self.metrics = RunMetrics(traceMemory=False) #Stages add up over every cycle until the next refresh
+		self.status = {"started": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "cycles": 0, "failedCycles": 0,
+						"candidates": 0, "updated": 0, "exceptions": 0, "lastCycle": None, "lastError": None}
+		self.statusLock = threading.Lock()
+		self.lastSuccess = None #monotonic time of the last cycle that finished
+		self.refreshed = None
+		self.server = None
+
+		self.metrics.begin("Connect")
+		self.pool = ConnectionPool()
+		self.metrics.end()
+		self.status["connectSeconds"] = self.pool.latency
+
+		self.runState = RunState(config.runStatePath, config.retryIntervalHours, config.windowDays)
+		self.gurasCache = GurasCache(config.gurasCachePath, config.gurasCacheTtl, config.gurasCacheNegativeTtl) if config.gurasCachePath else None
+		#Unattended, a chunk GURAS gives up on is left for the next retry
+		self.gurasClient = gurasClientFromConfig(interactive=False, cache=self.gurasCache, metrics=self.metrics)
+		self.refData = None
+
+	def refresh(self):
+		#Reload reference data, purge the GURAS cache and start a new metrics file
+		if self.refData is not None:
+			self.writeMetrics()
+			self.metrics = RunMetrics(traceMemory=False)
+			self.gurasClient.metrics = self.metrics
+		if self.gurasCache:
+			self.gurasCache.purge()
+
+		connection = self.pool.acquire()
+		try:
+			with self.metrics.stage("Reference data"):
+				self.refData = ReferenceData().load(CountingCursor(connection.cursor(), self.metrics))
+		finally:
+			self.pool.release(connection)
+		self.refreshed = time.monotonic()
+
+	def cycle(self) -> dict:
+		#Process every candidate created since the last cycle, returns the cycle's counts
+		if self.refData is None or time.monotonic() - self.refreshed > config.serviceRefreshHours * 3600:
+			self.refresh()
+
+		metrics = self.metrics
+		readConnection = self.pool.acquire()
+		writeConnection = self.pool.acquire()
+		try:
+			c = CountingCursor(readConnection.cursor(), metrics)
+			addrWriter = AddressWriter(CountingCursor(writeConnection.cursor(), metrics), config.writeBatchSize)
+
+			metrics.begin("Candidate extraction")
+			c.execute("select sysdate from dual")
+			runStarted = c.fetchone()[0]
+			fullWindow = runStarted - timedelta(days=config.windowDays)
+			watermark = self.runState.watermark()
+			since = max(fullWindow, watermark) if watermark else fullWindow
+			candidateBatches = withRetries(streamCandidates(c, since, None, self.batchSize, config.candidateArraySize, CANDIDATE_SQL), self.runState,
+											lambda due: streamCandidates(c, fullWindow, due, self.batchSize, config.candidateArraySize, CANDIDATE_SQL))
+			metrics.end()
+
+			stages = batchStages(self.gurasClient, metrics, config.gurasProjectFields, config.consolidateMultiMatches, config.houseRangeMaxGap)
+
+			#Report files are only created for cycles with exceptions
+			exceptionReport = ExceptionReport(config.reportDirectory, "Service_" + datetime.now().strftime("%Y%m%d_%H%M%S"), config.reportFormat)
+			addr_ids = list()
+			batches = timedBatches(candidateBatches, metrics, "Candidate extraction")
+			for result in runBatches(batches, stages, config.streamQueueSize):
+				df_batch = processBatch(result, addrWriter, self.refData, self.gurasClient, exceptionReport, addrWriter.c, metrics, config.gurasProjectFields)
+				addr_ids.extend(df_batch["ADDRESS_ID"].unique())
+
+			report_paths = exceptionReport.close() if exceptionReport.rows["exceptions"] or exceptionReport.rows["noGuras"] else []
+			self.runState.record(runStarted, addr_ids, addrWriter.updatedIDs)
+		finally:
+			self.pool.release(writeConnection)
+			self.pool.release(readConnection)
+
+		counts = {"candidates": len(addr_ids), "updated": addrWriter.updated, "exceptions": len(exceptionReport.addresses)}
+		if addr_ids:
+			logging.info("[INFO] Service cycle: {} x Candidates, {} x Updated, {} x Exceptions{}".format(
+				counts["candidates"], counts["updated"], counts["exceptions"], ", report: " + ", ".join(report_paths) if report_paths else ""))
+		return counts
+
+	def run(self):
+		#Cycle until stopped, a failed cycle is logged and tried again at the next poll
+		self.serve()
+		logging.info("[START] GPR Address Update service polling every {:g} minutes".format(self.pollSeconds / 60))
+		while not self.stopping.is_set():
+			started = time.monotonic()
+			try:
+				counts = self.cycle()
+			except Exception as error:
+				logging.exception("[ERROR] Service cycle failed")
+				with self.statusLock:
+					self.status["failedCycles"] += 1
+					self.status["lastError"] = "{}: {}".format(type(error).__name__, error)
+			else:
+				self.lastSuccess = time.monotonic()
+				with self.statusLock:
+					self.status["cycles"] += 1
+					for name, value in counts.items():
+						self.status[name] += value
+					self.status["lastCycle"] = dict(counts, finished=datetime.now().strftime("%Y-%m-%d %H:%M:%S"), seconds=round(self.lastSuccess - started, 2))
+					self.status["lastError"] = None
+
+			#Short waits so Ctrl+C is seen promptly on Windows
+			while not self.stopping.wait(1) and time.monotonic() - started < self.pollSeconds:
+				pass
+
+	def stop(self, *args):
+		self.stopping.set()
+
+	def close(self):
+		if self.server:
+			self.server.shutdown()
+			self.server.server_close()
+		self.writeMetrics()
+		self.gurasClient.close()
+		if self.gurasCache:
+			self.gurasCache.close()
+		self.runState.close()
+		self.pool.close()
+		logging.info("[FINISH] GPR Address Update service stopped")
+
+	def writeMetrics(self):
+		if config.metricsDirectory:
+			self.metrics.info.update(self.snapshot())
+			self.metrics.write(os.path.join(config.metricsDirectory, "AddressServiceMetrics_{}.json".format(datetime.now().strftime("%Y%m%d_%H%M%S"))))
+
+	def healthy(self) -> bool:
+		#A cycle has finished within the last three polls
+		return self.lastSuccess is not None and time.monotonic() - self.lastSuccess < 3 * self.pollSeconds + 60
+
+	def snapshot(self) -> dict:
+		with self.statusLock:
+			return json.loads(json.dumps(self.status, default=str))
+
+	def serve(self):
+		#Health and metrics endpoint in a background thread, servicePort 0 to disable
+		if not config.servicePort:
+			return
+		service = self
+
+		class Handler(BaseHTTPRequestHandler):
+
+			def do_GET(self):
+				if self.path == "/health":
+					body = dict(service.snapshot(), status="ok" if service.healthy() else "unhealthy")
+					code = 200 if service.healthy() else 503
+				elif self.path == "/metrics":
+					body = dict(service.metrics.report(), service=service.snapshot())
+					code = 200
+				else:
+					body, code = {"error": "not found"}, 404
+				data = json.dumps(body, indent=2, default=str).encode()
+				self.send_response(code)
+				self.send_header("Content-Type", "application/json")
+				self.send_header("Content-Length", str(len(data)))
+				self.end_headers()
+				self.wfile.write(data)
+
+			def log_message(self, format, *args):
+				logging.debug("Health endpoint: " + format % args)
+
+		self.server = ThreadingHTTPServer((config.serviceHost, config.servicePort), Handler)
+		self.server.daemon_threads = True
+		threading.Thread(target=self.server.serve_forever, name="health", daemon=True).start()
+		logging.info("[INFO] Service health on http://{}:{}/health".format(config.serviceHost, self.server.server_port))
+
+def serve(options):
+	#Entry point of --service, runs until Ctrl+C or SIGTERM
+	pd.options.mode.chained_assignment = None
+	service = AddressService(options.user)
+	signal.signal(signal.SIGTERM, service.stop)
+	print("GPR Address Update service running, Ctrl+C to stop")
+	try:
+		service.run()
+	except KeyboardInterrupt:
+		service.stop()
+	finally:
+		service.close()
@@ -0,0 +1,234 @@
+'''GURAS -> GPR Address Transform
+	Maps matched GURAS records onto GPR address fields and validates them against the
+	reference tables, column-wise over the whole candidate set instead of row by row.
+	The result is a typed update frame: the GPR address fields, ADDRESS_ID, VERSION_NO and
+	an Exception_Reason that is only set for rows that can't be updated.
+	Properties matched to several GURAS records are consolidated into one record per property
+	when the records agree on every field (or leave it null), or only differ by house numbers that
+	form one range on the same road, e.g. 1 George St and 3 George St become 1-3 George St.
+'''
+
+import numpy as np
+import pandas as pd
+
+#Columns used from each layer
+PROPID_COLUMNS = ["attributes.ptlotsecpn", "attributes.propid", "attributes.sppropid"]
+GURAS_COLUMNS = ["attributes.propid", "attributes.sppropid"]
+
+#GPR address column -> GURAS attribute
+GURAS_FIELDS = {
+	"HOUSE_NO_1_PREFIX": "attributes.housenumberfirstprefix",
+	"HOUSE_NO_1": "attributes.housenumberfirst",
+	"HOUSE_NO_1_SUFFIX": "attributes.housenumberfirstsuffix",
+	"HOUSE_NO_2_PREFIX": "attributes.housenumbersecondprefix",
+	"HOUSE_NO_2": "attributes.housenumbersecond",
+	"HOUSE_NO_2_SUFFIX": "attributes.housenumbersecondsuffix",
+	"ROAD_1_NAME": "attributes.roadname",
+	"ROAD_1_SUFFIX": "attributes.roadsuffix",
+	"ROAD_1_TYPE": "attributes.roadtype",
+	"UNIT_TYPE": "attributes.unittype",
+	"UNIT_NO_PREFIX": "attributes.unitnumberprefix",
+	"UNIT_NO": "attributes.unitnumber",
+	"UNIT_NO_SUFFIX": "attributes.unitnumbersuffix",
+	"LEVEL_TYPE": "attributes.leveltype",
+	"LEVEL_NO_PREFIX": "attributes.levelnumberprefix",
+	"LEVEL_NO": "attributes.levelnumber",
+	"LEVEL_NO_SUFFIX": "attributes.levelnumbersuffix",
+	"BUILDING_NAME": "attributes.buildingname",
+	"LOCATION_DESCRIPTOR": "attributes.locationdescription",
+	"ROAD_2_NAME": "attributes.secondroadname",
+	"ROAD_2_TYPE": "attributes.secondroadtype",
+	"ROAD_2_SUFFIX": "attributes.secondroadsuffix"
+}
+
+#Stored as whole numbers, NULL if GURAS has no value
+INT_FIELDS = ["HOUSE_NO_1", "HOUSE_NO_2", "UNIT_NO"]
+
+#Converted to title case
+TITLE_FIELDS = ["ROAD_1_NAME", "ROAD_1_SUFFIX", "BUILDING_NAME", "LOCATION_DESCRIPTOR", "ROAD_2_NAME", "ROAD_2_SUFFIX"]
+
+#GURAS attributes that must agree (or be null) across the records of a property to consolidate them
+CONSOLIDATE_FIELDS = list(GURAS_FIELDS.values()) + ["attributes.suburbname", "attributes.postcode"]
+HOUSE_FIRST = "attributes.housenumberfirst"
+HOUSE_SECOND = "attributes.housenumbersecond"
+
+#GURAS fields the match, consolidation and update use, the exceptions report fetches every field
+PROPID_OUT_FIELDS = ",".join(name[len("attributes."):] for name in PROPID_COLUMNS)
+GURAS_OUT_FIELDS = ",".join(["objectid"] + [name[len("attributes."):] for name in GURAS_COLUMNS + CONSOLIDATE_FIELDS])
+
+SUBURB_REASON = "GURAS Suburb not matched to GPR Suburb"
+TYPE_REASON = "Invalid Unit type, Level type or Road type"
+
+def column(df: pd.DataFrame, name: str) -> pd.Series:
+	#Column or all nulls if GURAS didn't return the field
+	if name in df:
+		return df[name]
+	return pd.Series(None, index=df.index, dtype="object")
+
+def uniqueID(df: pd.DataFrame) -> pd.Series:
+	#sppropid for strata records, otherwise propid, 0 if neither
+	sppropid = pd.to_numeric(column(df, "attributes.sppropid"), errors="coerce")
+	propid = pd.to_numeric(column(df, "attributes.propid"), errors="coerce")
+	return sppropid.fillna(propid).fillna(0).astype("int64")
+
+def featureFrame(features: list, columns: list) -> pd.DataFrame:
+	#Flatten GURAS features and add uniqueID, columns are present even if there are no features
+	df = pd.json_normalize(features)
+	for name in columns:
+		if name not in df:
+			df[name] = None
+	df["uniqueID"] = uniqueID(df)
+	return df
+
+def matchGURAS(gpr_prop: pd.DataFrame, df_propID: pd.DataFrame, df_GURAS: pd.DataFrame) -> pd.DataFrame:
+	#GPR candidates -> lots -> GURAS records, one row per distinct address/GURAS record pair
+	df_prop_merged = df_propID.merge(df_GURAS, how='inner', on='uniqueID') #merge Propid and Address datasets
+	df_prop_merged = df_prop_merged.rename(columns={'attributes.ptlotsecpn': 'PTLOTSECPN'})
+	df_merged = gpr_prop.merge(df_prop_merged, how='inner', on='PTLOTSECPN')
+
+	#v2 - Remove ptlotsecpn column to remove duplicates
+	del df_merged['PTLOTSECPN']
+
+	#Remove Duplicates
+	return df_merged.drop_duplicates()
+
+def splitOneToOne(df_m_dd: pd.DataFrame) -> tuple:
+	#Count occurences, returns (1 to 1 matches, other matches)
+	df_m_dd["property_id_count"] = df_m_dd.groupby("PROPERTY_ID")["PROPERTY_ID"].transform("size")
+	df_m_dd["guras_prop_id_count"] = df_m_dd.groupby("uniqueID")["uniqueID"].transform("size")
+
+	oneToOne = df_m_dd["property_id_count"] == 1
+	return df_m_dd.loc[oneToOne], df_m_dd.loc[~oneToOne]
+
+def consolidateMatches(df_m_dd_o: pd.DataFrame, maxGap: int = 2) -> tuple:
+	#Merge the GURAS records of each multi-match property where they agree, returns (one row per consolidated property, rows left over)
+	if df_m_dd_o.empty:
+		return df_m_dd_o.iloc[:0], df_m_dd_o
+
+	groups = df_m_dd_o["PROPERTY_ID"]
+	fields = [name for name in CONSOLIDATE_FIELDS if name in df_m_dd_o]
+	others = [name for name in fields if name not in (HOUSE_FIRST, HOUSE_SECOND)]
+
+	#Blanks count as null, text is compared ignoring case and spaces
+	values = df_m_dd_o[fields].replace('', np.nan)
+	compare = values.apply(lambda col: col if pd.api.types.is_numeric_dtype(col) else col.astype(str).str.strip().str.upper().where(col.notna()))
+
+	distinct = compare.groupby(groups).nunique()
+	filled = values.groupby(groups).first() #First non-null value of each field
+	agree = (distinct[others] <= 1).all(axis=1)
+	sameHouse = (distinct.reindex(columns=[HOUSE_FIRST, HOUSE_SECOND], fill_value=0) <= 1).all(axis=1)
+
+	#House numbers as ranges, consecutive if each range starts within maxGap of the ones before it
+	low = pd.to_numeric(column(df_m_dd_o, HOUSE_FIRST), errors="coerce")
+	high = pd.to_numeric(column(df_m_dd_o, HOUSE_SECOND), errors="coerce").fillna(low)
+	ranges = pd.DataFrame({"group": groups, "low": low, "high": high}).sort_values(["group", "low"])
+	previousHigh = ranges.groupby("group")["high"].cummax().groupby(ranges["group"]).shift()
+	gap = ranges["low"] - previousHigh
+	contiguous = (gap.isna() | (gap <= maxGap)).groupby(ranges["group"]).all()
+	numbered = low.notna().groupby(groups).all()
+
+	ranged = agree & ~sameHouse & contiguous & numbered
+	merged = (agree & sameHouse) | ranged
+
+	#First row of each consolidated property, with the agreed fields filled in from its siblings
+	consolidated = df_m_dd_o.loc[~groups.duplicated() & groups.isin(merged.index[merged])].copy()
+	for name in fields:
+		consolidated[name] = consolidated["PROPERTY_ID"].map(filled[name])
+
+	isRange = consolidated["PROPERTY_ID"].map(ranged)
+	consolidated.loc[isRange, HOUSE_FIRST] = consolidated.loc[isRange, "PROPERTY_ID"].map(low.groupby(groups).min())
+	consolidated.loc[isRange, HOUSE_SECOND] = consolidated.loc[isRange, "PROPERTY_ID"].map(high.groupby(groups).max())
+
+	return consolidated, df_m_dd_o.loc[~groups.isin(merged.index[merged])]
+
+def matchBatch(df_candidates: pd.DataFrame, df_propID: pd.DataFrame, df_GURAS: pd.DataFrame, unavailableLots=(), consolidate: bool = True, maxGap: int = 2) -> tuple:
+	#Match candidates to GURAS, returns (1 to 1 matches, exceptions, candidates with no GURAS record)
+	df_m_dd = matchGURAS(df_candidates.drop_duplicates(), df_propID, df_GURAS)
+
+	#v7 - Addresses with a lot that couldn't be queried from GURAS are reported instead of updated
+	unavailableAddr = df_candidates.loc[df_candidates["PTLOTSECPN"].isin(unavailableLots), "ADDRESS_ID"].unique()
+	df_unavailable = df_candidates.loc[df_candidates["ADDRESS_ID"].isin(unavailableAddr)].drop_duplicates(subset="ADDRESS_ID")
+	df_unavailable["Exception_Reason"] = "GURAS service unavailable"
+	df_m_dd = df_m_dd.loc[~df_m_dd["ADDRESS_ID"].isin(unavailableAddr)]
+	df_og_addr = df_candidates.loc[~df_candidates["ADDRESS_ID"].isin(unavailableAddr)]
+
+	#v4 - Retrieve no GURAS address records
+	df_og_merge = df_og_addr.merge(df_m_dd, on='ADDRESS_ID', how='outer', indicator=True)
+	df_no_guras = df_og_merge[df_og_merge['_merge']=='left_only']
+
+	#Filter to 1 to 1 matches only
+	df_m_dd_1, df_m_dd_o = splitOneToOne(df_m_dd)
+
+	#v7 - Multiple GURAS records that agree, or only differ by a house number range, are updated as one
+	if consolidate:
+		df_consolidated, df_m_dd_o = consolidateMatches(df_m_dd_o, maxGap)
+		df_m_dd_1 = pd.concat([df_m_dd_1, df_consolidated])
+
+	df_exceptions = pd.DataFrame(df_m_dd_o)
+	df_exceptions["Exception_Reason"] = "Not a 1-to-1 match"
+	df_exceptions = pd.concat([df_exceptions, df_unavailable])
+
+	return df_m_dd_1, df_exceptions, df_no_guras
+
+def mapFields(df: pd.DataFrame) -> pd.DataFrame:
+	#GURAS attributes -> GPR address fields, blanks are ''
+	updates = pd.DataFrame(index=df.index)
+	for name in ("ADDRESS_ID", "VERSION_NO"):
+		if name in df:
+			updates[name] = df[name]
+
+	for field, attribute in GURAS_FIELDS.items():
+		values = column(df, attribute)
+		if field in INT_FIELDS:
+			updates[field] = pd.to_numeric(values, errors="coerce").astype("Int64")
+		else:
+			values = values.fillna('').astype(str)
+			if field in TITLE_FIELDS:
+				values = values.str.title()
+			updates[field] = values
+
+	return updates
+
+def _matchType(updates: pd.DataFrame, field: str, index: dict, refData) -> pd.Series:
+	#Replace type with the reference table value, returns whether each row is valid (empty is valid)
+	matched = refData.matchNames(updates[field], index)
+	updates[field] = matched.fillna(updates[field])
+	return (updates[field] == '') | matched.notna()
+
+def buildUpdates(df: pd.DataFrame, refData) -> pd.DataFrame:
+	#Map and validate every matched GURAS record at once
+	updates = mapFields(df)
+
+	#Road types
+	rt1Valid = _matchType(updates, "ROAD_1_TYPE", refData.roadTypes, refData)
+	rt2Valid = _matchType(updates, "ROAD_2_TYPE", refData.roadTypes, refData)
+
+	#Unit types, unit type defaults to 'Unit' and GURAS 'U' means 'Unit'
+	hasUnitNo = updates["UNIT_NO"].notna()
+	hasUnitType = updates["UNIT_TYPE"] != ''
+	unitRef = refData.matchNames(updates["UNIT_TYPE"].where(hasUnitNo, ''), refData.unitTypes)
+	unitU = hasUnitNo & hasUnitType & unitRef.isna() & (updates["UNIT_TYPE"] == "U")
+	utValid = (hasUnitNo & (unitRef.notna() | unitU | ~hasUnitType)) | (~hasUnitNo & ~hasUnitType)
+	updates["UNIT_TYPE"] = unitRef.fillna(updates["UNIT_TYPE"])
+	updates.loc[unitU | (hasUnitNo & ~hasUnitType), "UNIT_TYPE"] = "Unit"
+
+	#Level types, level type defaults to 'Level'
+	hasLevelNo = updates["LEVEL_NO"] != ''
+	hasLevelType = updates["LEVEL_TYPE"] != ''
+	levelRef = refData.matchNames(updates["LEVEL_TYPE"].where(hasLevelNo, ''), refData.levelTypes)
+	ltValid = (hasLevelNo & (levelRef.notna() | ~hasLevelType)) | (~hasLevelNo & ~hasLevelType)
+	updates["LEVEL_TYPE"] = levelRef.fillna(updates["LEVEL_TYPE"])
+	updates.loc[hasLevelNo & ~hasLevelType, "LEVEL_TYPE"] = "Level"
+
+	#Suburb
+	updates["SUBURB_ID"] = refData.suburbIDs(column(df, "attributes.suburbname"), column(df, "attributes.postcode"))
+	sbValid = updates["SUBURB_ID"] > 0
+
+	#If Road name exists, address type is 'Street' type = 3
+	updates["ADDRESS_TYPE_ID"] = np.where(updates["ROAD_1_NAME"] != '', 3, 6)
+
+	#Only valid rows are updated
+	updates["Exception_Reason"] = np.where(~sbValid, SUBURB_REASON,
+								np.where(rt1Valid & rt2Valid & utValid & ltValid, None, TYPE_REASON))
+
+	return updates
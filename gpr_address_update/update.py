@@ -0,0 +1,352 @@
+'''Update GPR Address
+	1. Find recent (past 90 days) Properties with Missing Road Name or unknown suburb
+	2. Get List of lots from those Properties
+	3. Run Lots through GURAS Extract (Lot -> propid -> GURAS)
+	4. For all 1 to 1 matches for Lots -> GURAS, update GPR address table
+	
+	v1 - First version
+		- one to one match is too strict, some properties have multiple lots that refer to same address
+		- Exception report does not show GPR properties with no GURAS match
+	v2 - Final count distinguishes between unsuccessful updates (either not 1-to-1 match or no GURAS record found)
+		- If single GURAS record matches multiple GPR Addresses, this is still accepted
+		- Removed 'chained assignment' warning
+	v3 - Expand search to pick up more properties
+		- Added Automatically created properties (CLID properties etc.)
+		- Add error handling for unmatched suburbs
+	v4  - No GURAS Address results added to Exceptions report
+	v5 	- Added Delay to prevent REST service timeout error
+	v6	- Filtered GURAS results to include Principal Address type 1 only
+	v7	- Reference tables loaded once per run, address updates written in batches with bind variables
+		- Addresses edited in GPR since extraction (VERSION_NO changed) added to Exceptions report
+		- GURAS chunks queried in parallel under a rate limit, fixed 2s delay replaced by adaptive back off
+		- GURAS lookups cached locally between runs, use --refresh to query every lot again
+		- --non-interactive runs never wait for input, GURAS chunks that give up are reported as service unavailable
+		- GURAS queried with POST, chunk size taken from layer limits and results paged past the transfer limit
+		- --incremental runs only process candidates created since the last run, plus unresolved addresses due for a retry
+		- Staging table replaced by a single candidate query fetched once, several users can run the update at once
+		- GURAS -> GPR field mapping and validation done column-wise over all matches
+		- Per stage timings, round trips, GURAS requests and row counts written to a JSON metrics file, --profile adds a cProfile dump
+		- --stream runs candidate batches through lookup, match and write stages at the same time, --backfill streams every incomplete address
+		- GURAS keys deduplicated before querying, only the fields the update uses are requested, exception rows are fetched in full
+		- backfill.py splits a backfill into shards by address_id and runs them in parallel processes under one GURAS rate limit
+		- Exceptions written as each batch finishes, Excel in constant memory mode, --report-format csv|parquet for large runs
+		- Multi-address matches updated if each field is = OR null (nulls take the value of other rows), consecutive house numbers become a range
+		- GURAS requests share a pooled keep-alive session with gzip responses, optional corporate CA bundle
+		- --server-side loads GURAS results into temporary tables, Oracle matches, validates and updates with one MERGE per batch
+		- --plan saves the validated updates to a change-set file instead of writing them, --apply <file> writes them later without GURAS
+		- --service keeps running with warm connections, reference data and GURAS client, new candidates are picked up every few minutes
+'''
+
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from . import config
+from .database import ConnectionPool
+from .reference import ReferenceData
+from .address_writer import AddressWriter
+from .guras import gurasClientFromConfig
+from .guras_cache import GurasCache
+from .run_state import RunState, WATERMARK_FORMAT
+from .candidates import fetchCandidates, streamCandidates, withRetries, createTemporaryTable, CANDIDATE_SQL, BACKFILL_SQL
+from .pipeline import timedBatches, batchStages, runBatches, processBatch, describeAddresses
+from .server_match import ServerMatcher
+from .change_set import ChangeSet, PLANNED
+from .report import ExceptionReport
+from .metrics import RunMetrics, RunProfiler, CountingCursor
+
+def loadingBar(p: int, msg: str) -> str:
+	
+	progress = ""
+	togo = "          "
+	
+	togo = togo[:-p] #reduce empty space based on progress
+	
+	for i in range(p):
+		progress += "■"
+
+	print("[{}{}] {}                            ".format(progress, togo, msg), end="\r")
+
+def applyChangeSet(c, path: str, metrics, today: datetime, reportFormat: str = None):
+	#v7 - Write a change-set saved by a --plan run, nothing is fetched from GURAS
+	changeSet = ChangeSet(path)
+	planned = changeSet.counts().get(PLANNED, 0)
+	logging.info("[INFO] Applying change-set {} ({} x Planned updates)".format(path, planned))
+	
+	loadingBar(5,"50% - Applying change-set...")
+	metrics.begin("Address writes", planned)
+	addrWriter = changeSet.apply(c, config.writeBatchSize)
+	metrics.end(addrWriter.updated)
+	
+	#Addresses edited in GPR since the plan are reported
+	report_paths = list()
+	if addrWriter.conflicts:
+		metrics.begin("Exception report", len(addrWriter.conflicts))
+		exceptionReport = ExceptionReport(config.reportDirectory, today.strftime("%Y%m%d_%H%M%S") + "_Apply", reportFormat or config.reportFormat)
+		exceptionReport.add(describeAddresses(c, changeSet.conflictFrame(), pd.DataFrame())[0])
+		report_paths = exceptionReport.close()
+		metrics.end()
+	
+	#Incremental plans move the watermark once their updates are in GPR
+	if changeSet.meta().get("incremental") == "True":
+		runState = RunState(config.runStatePath, config.retryIntervalHours, config.windowDays)
+		runState.record(changeSet.runStarted(), changeSet.candidates(), changeSet.appliedIDs())
+		runState.close()
+	
+	metrics.info.update({"changeSet": path, "planned": planned, "updated": addrWriter.updated, "conflicts": len(addrWriter.conflicts)})
+	changeSet.close()
+	
+	print("                                                       ")
+	print("-----------------------------------------")
+	print(" Change-set applied!")
+	print("-----------------------------------------")
+	print("   {} x Addresses updated".format(addrWriter.updated))
+	print("   {} x Addresses changed in GPR since the plan".format(len(addrWriter.conflicts)))
+	if report_paths:
+		print("        - Exception report generated: {}".format(", ".join(report_paths)))
+
+def finishRun(metrics, profiler, today: datetime):
+	#v7 - Run metrics for comparing runs, the profile shows where time went inside each stage
+	run_name = today.strftime("%Y%m%d_%H%M%S")
+	if config.metricsDirectory:
+		metrics.write(os.path.join(config.metricsDirectory, "AddressUpdateMetrics_{}.json".format(run_name)))
+	logging.info("[INFO] {}".format(metrics.summary()))
+	
+	if profiler:
+		profiler.disable()
+		if config.metricsDirectory:
+			os.makedirs(config.metricsDirectory, exist_ok=True)
+		profile_path = os.path.join(config.metricsDirectory, "AddressUpdateProfile_{}.prof".format(run_name))
+		profiler.dump_stats(profile_path)
+		logging.info("[PROCESS] cProfile dump written: {}".format(profile_path))
+	
+	logging.info("[FINISH] GPR Address Update process finished")
+
+def run(options):
+	#One address update run, options as parsed by cli.parseArgs (config already has the overrides)
+	username = options.user
+	refresh = options.refresh #Ignore cached GURAS lookups
+	nonInteractive = options.non_interactive #Never wait for user input, e.g. scheduled runs
+	incremental = options.incremental #Only stage candidates created since the last successful run
+	profile = options.profile #Write a cProfile dump of the run next to the metrics file
+	backfill = options.backfill #Every incomplete address since config.backfillFrom, always streamed
+	streaming = options.stream or backfill #Process candidates in batches through overlapping stages
+	serverSide = options.server_side #Match, validate and update in Oracle instead of pandas
+	planning = options.plan #Save validated updates to a change-set instead of writing them to GPR
+	applyPath = options.apply #Change-set to write to GPR
+	reportFormat = options.report_format #xlsx, csv or parquet
+	
+	#Turn off Chained assignment warning line 344 'A value is trying to be set on a copy of a slice from a DataFrame'
+	pd.options.mode.chained_assignment = None
+	
+	today = datetime.now()
+	
+	
+	#v7 - Per stage metrics, every database call goes through the counting cursor
+	metrics = RunMetrics(config.metricsTraceMemory)
+	profiler = None
+	if profile:
+		profiler = RunProfiler()
+		profiler.enable()
+	
+	loadingBar(1,"10% - Connecting to GPR Database...")
+	metrics.begin("Connect")
+	
+	#connect to DB, v7 - DPE and DCS are tried at the same time, stages running side by side each take a pooled connection
+	pool = ConnectionPool()
+	metrics.info["connectSeconds"] = pool.latency
+	connection = pool.acquire()
+	c = CountingCursor(connection.cursor(), metrics)
+	
+	if applyPath:
+		applyChangeSet(c, applyPath, metrics, today, reportFormat)
+		pool.release(connection)
+		pool.close()
+		finishRun(metrics, profiler, today)
+		return
+	
+	#v7 - Reference tables load on their own connection while the candidates are extracted
+	def loadReference():
+		refConnection = pool.acquire()
+		try:
+			with metrics.stage("Reference data"):
+				return ReferenceData().load(CountingCursor(refConnection.cursor(), metrics))
+		finally:
+			pool.release(refConnection)
+	
+	refLoader = ThreadPoolExecutor(max_workers=1)
+	refFuture = refLoader.submit(loadReference)
+	
+	loadingBar(2,"20% - Extracting address candidates...")
+	metrics.begin("Candidate extraction")
+	
+	#Database time the run started, becomes the watermark of the next incremental run
+	c.execute("select sysdate from dual")
+	runStarted = c.fetchone()[0]
+	
+	#Candidate window, incremental runs only look back to the last successful run
+	fullWindow = runStarted - timedelta(days=config.windowDays)
+	since = fullWindow
+	runState = None
+	if incremental:
+		runState = RunState(config.runStatePath, config.retryIntervalHours, config.windowDays)
+		watermark = runState.watermark()
+		if watermark:
+			since = max(fullWindow, watermark)
+			logging.info("[INFO] Incremental run, candidates created since {}".format(watermark.strftime(WATERMARK_FORMAT)))
+	candidateSQL = CANDIDATE_SQL
+	if backfill:
+		#v7 - One-off backfill, not limited to the candidate window, recent transactions or ADAPTER created properties
+		candidateSQL = BACKFILL_SQL
+		since = datetime.strptime(config.backfillFrom, "%Y-%m-%d")
+		fullWindow = since
+		logging.info("[INFO] Backfill run, candidates created since {}".format(config.backfillFrom))
+	
+	if config.candidateTemporaryTable and not streaming:
+		createTemporaryTable(c, config.candidateTemporaryTable)
+	
+	if streaming:
+		#v7 - Candidates are read in batches of whole addresses while earlier batches are still being processed
+		#Unresolved addresses tried too recently are skipped, those due for another try are read from the full window
+		candidateBatches = withRetries(streamCandidates(c, since, None, config.streamBatchSize, config.candidateArraySize, candidateSQL), runState,
+										lambda due: streamCandidates(c, fullWindow, due, config.streamBatchSize, config.candidateArraySize, candidateSQL))
+		batches = timedBatches(candidateBatches, metrics, "Candidate extraction")
+		metrics.end()
+	else:
+		#Get GPR Addresses missing a street name and/or Unknown Suburb from the past 90 days
+		df_candidates = fetchCandidates(c, since, arraysize=config.candidateArraySize, temporaryTable=config.candidateTemporaryTable)
+		
+		if runState:
+			#Skip unresolved addresses tried too recently, add those due for another try from the full window
+			frames = list(withRetries([df_candidates], runState,
+									lambda due: [fetchCandidates(c, fullWindow, due, config.candidateArraySize, config.candidateTemporaryTable)]))
+			df_candidates = pd.concat(frames, ignore_index=True) if frames else df_candidates.iloc[:0]
+		
+		batches = [df_candidates] if len(df_candidates) > 0 else []
+		metrics.end(len(df_candidates))
+	
+	#Track Addresses updated/exceptions TO-DO Handle records with no PropID/GURAS matches
+	addr_update = 0
+	addr_ids = list()
+	updated_ids = list()
+	
+	#Exceptions are written as each batch finishes
+	exceptionReport = ExceptionReport(config.reportDirectory, today.strftime("%Y%m%d_%H%M%S"), reportFormat or config.reportFormat)
+	
+	#Reference tables loaded once for validation
+	refData = refFuture.result()
+	refLoader.shutdown()
+	
+	gurasCache = None
+	if config.gurasCachePath:
+		gurasCache = GurasCache(config.gurasCachePath, config.gurasCacheTtl, config.gurasCacheNegativeTtl, refresh)
+	
+	gurasClient = gurasClientFromConfig(interactive=not nonInteractive, cache=gurasCache, metrics=metrics)
+	
+	#Validated updates are written in batches, streamed reads keep the first connection busy
+	writeConnection = pool.acquire() if streaming else connection
+	writeCursor = CountingCursor(writeConnection.cursor(), metrics) if streaming else c
+	if planning:
+		#v7 - Validated updates are saved with the VERSION_NO they were read at, --apply writes them
+		os.makedirs(config.changeSetDirectory, exist_ok=True)
+		addrWriter = ChangeSet(os.path.join(config.changeSetDirectory, "AddressUpdateChangeSet_{}.db".format(today.strftime("%Y%m%d_%H%M%S"))), create=True)
+	elif serverSide:
+		#v7 - Matched, validated and written in Oracle, same counters as AddressWriter
+		addrWriter = ServerMatcher(writeCursor, config.serverMatchTablePrefix, config.writeBatchSize, config.consolidateMultiMatches)
+		addrWriter.createTables()
+		logging.info("[INFO] Server-side matching, house number ranges are left in the exceptions report")
+	else:
+		addrWriter = AddressWriter(writeCursor, config.writeBatchSize)
+	
+	#EXTRACT PROPIDs and GURAS Addresses, server-side runs match in Oracle so only the GURAS lookups run ahead
+	stages = batchStages(gurasClient, metrics, config.gurasProjectFields, config.consolidateMultiMatches, config.houseRangeMaxGap, match=not serverSide)
+	if streaming:
+		#Lookups and matching run in their own threads, each stage holds at most streamQueueSize batches
+		results = runBatches(batches, stages, config.streamQueueSize)
+	else:
+		loadingBar(3,"30% - Querying GURAS services...")
+		results = runBatches(batches, stages)
+	
+	for batch_no, result in enumerate(results, 1):
+		if streaming:
+			print("Batch {} - {} x Addresses, {} x Updated so far                  ".format(batch_no, result[0]["ADDRESS_ID"].nunique(), addr_update), end="\r")
+		else:
+			loadingBar(7,"70% - Updating GPR address data...")
+		
+		df_batch = processBatch(result, addrWriter, refData, gurasClient, exceptionReport, writeCursor, metrics, config.gurasProjectFields,
+								serverSide=serverSide, commit=not planning)
+		
+		addr_update = addrWriter.updated
+		addr_ids.extend(df_batch["ADDRESS_ID"].unique())
+	
+	updated_ids = addrWriter.updatedIDs
+	addr_total = len(addr_ids)
+	
+	gurasClient.close()
+	if gurasCache:
+		logging.info("[INFO] {}".format(gurasCache.summary()))
+		gurasCache.purge()
+		gurasCache.close()
+	
+	#Only report if there were lots to query
+	if addr_total > 0:
+		
+		logging.info("[INFO] {}".format(refData.summary()))
+		logging.info("[INFO] {}".format(addrWriter.summary()))
+		
+		loadingBar(9,"90% - Exporting Exceptions report...")
+		metrics.begin("Exception report")
+		
+		#Count of exceptions
+		addr_excp = len(exceptionReport.addresses)
+		
+		#Export Exceptions
+		report_paths = exceptionReport.close()
+		metrics.end()
+		metrics.info.update({"updated": addr_update, "exceptions": addr_excp, "noGuras": addr_total - addr_update - addr_excp})
+			
+		logging.info("[INFO] {} x Updated, {} x Exceptions, {} x No GURAS record found".format(addr_update,addr_excp, addr_total - addr_update - addr_excp))
+		logging.info("[PROCESS] Exception report generated: {}".format(", ".join(report_paths)))
+		
+		print("                                                       ")
+		print("-----------------------------------------")
+		print(" Address update process complete!")
+		print("-----------------------------------------")
+		print("   {} x Addresses {}".format(addr_update, "planned" if planning else "updated"))
+		print("   {} x Addresses unable to be updated".format(addr_excp))
+		print("   {} x No GURAS records matched".format(addr_total - addr_update - addr_excp))
+		print("        - Exception report generated: {}".format(", ".join(report_paths)))
+		if planning:
+			print("        - Change-set saved, write it with --apply \"{}\"".format(addrWriter.path))
+			
+	else:
+		print("-----------------------------------------")
+		print(" No lots to query address data. Exiting.")
+		print("-----------------------------------------")
+		logging.info("[INFO] No Lots to query address data. Property address update will be stopped")
+			
+	if planning:
+		#Run state is recorded when the change-set is applied
+		addrWriter.addCandidates(addr_ids)
+		addrWriter.setMeta(runStarted=runStarted.strftime(WATERMARK_FORMAT), incremental=incremental, username=username)
+		addrWriter.close()
+		logging.info("[PROCESS] Change-set saved: {}".format(addrWriter.path))
+	
+	#v7 - Run finished, next incremental run starts from here
+	if runState and not planning:
+		runState.record(runStarted, addr_ids, updated_ids)
+	if runState:
+		runState.close()
+	
+	#Done Close connections
+	if writeConnection is not connection:
+		pool.release(writeConnection)
+	pool.release(connection)
+	pool.close()
+	
+	metrics.info.update({"candidates": addr_total, "conflicts": len(addrWriter.conflicts), "incremental": incremental, "streaming": streaming, "backfill": backfill, "serverSide": serverSide, "planning": planning,
+						"gurasConcurrency": config.gurasConcurrency, "gurasRateLimit": config.gurasRateLimit, "writeBatchSize": config.writeBatchSize})
+	finishRun(metrics, profiler, today)
@@ -0,0 +1,85 @@
+'''consolidateMatches: which multi-record properties are written automatically'''
+
+import pandas as pd
+
+from gpr_address_update.transform import consolidateMatches
+
+def record(property_id, house=None, second=None, road="GEORGE", roadType="STREET", unit=None, building=None, suburb="SYDNEY"):
+	return {
+		"PROPERTY_ID": property_id,
+		"ADDRESS_ID": property_id * 10,
+		"attributes.housenumberfirst": house,
+		"attributes.housenumbersecond": second,
+		"attributes.roadname": road,
+		"attributes.roadtype": roadType,
+		"attributes.unitnumber": unit,
+		"attributes.buildingname": building,
+		"attributes.suburbname": suburb,
+		"attributes.postcode": 2000,
+	}
+
+def consolidate(*records, maxGap=2):
+	return consolidateMatches(pd.DataFrame(list(records)), maxGap)
+
+def test_agreeing_records_become_one_row():
+	consolidated, left = consolidate(record(1, 5), record(1, 5))
+	assert len(consolidated) == 1
+	assert left.empty
+	assert consolidated.iloc[0]["attributes.housenumberfirst"] == 5
+
+def test_case_and_spaces_are_ignored():
+	consolidated, left = consolidate(record(1, 5, road="George "), record(1, 5, road="GEORGE"))
+	assert len(consolidated) == 1
+	assert left.empty
+
+def test_null_field_is_filled_from_sibling():
+	consolidated, left = consolidate(record(1, 5), record(1, 5, building="Town Hall"))
+	assert left.empty
+	assert consolidated.iloc[0]["attributes.buildingname"] == "Town Hall"
+
+def test_blank_counts_as_null():
+	consolidated, left = consolidate(record(1, 5, building=""), record(1, 5, building="Town Hall"))
+	assert left.empty
+	assert consolidated.iloc[0]["attributes.buildingname"] == "Town Hall"
+
+def test_consecutive_house_numbers_become_a_range():
+	consolidated, left = consolidate(record(1, 1), record(1, 3))
+	assert left.empty
+	row = consolidated.iloc[0]
+	assert (row["attributes.housenumberfirst"], row["attributes.housenumbersecond"]) == (1, 3)
+
+def test_range_extends_existing_ranges():
+	consolidated, left = consolidate(record(1, 1, 3), record(1, 5), record(1, 7, 9))
+	assert left.empty
+	row = consolidated.iloc[0]
+	assert (row["attributes.housenumberfirst"], row["attributes.housenumbersecond"]) == (1, 9)
+
+def test_different_roads_are_left_over():
+	consolidated, left = consolidate(record(1, 1), record(1, 3, road="PITT"))
+	assert consolidated.empty
+	assert len(left) == 2
+
+def test_different_units_are_left_over():
+	consolidated, left = consolidate(record(1, 5, unit=1), record(1, 5, unit=2))
+	assert consolidated.empty
+	assert len(left) == 2
+
+def test_gap_larger_than_max_gap_is_left_over():
+	consolidated, left = consolidate(record(1, 1), record(1, 7))
+	assert consolidated.empty
+	assert len(left) == 2
+
+def test_max_gap_is_configurable():
+	consolidated, left = consolidate(record(1, 1), record(1, 7), maxGap=6)
+	assert left.empty
+	assert consolidated.iloc[0]["attributes.housenumbersecond"] == 7
+
+def test_missing_house_number_is_not_ranged():
+	consolidated, left = consolidate(record(1, 1), record(1, None, building="Town Hall"), record(1, 3))
+	assert consolidated.empty
+	assert len(left) == 3
+
+def test_properties_are_decided_separately():
+	consolidated, left = consolidate(record(1, 1), record(1, 3), record(2, 1), record(2, 3, road="PITT"))
+	assert list(consolidated["PROPERTY_ID"]) == [1]
+	assert set(left["PROPERTY_ID"]) == {2}
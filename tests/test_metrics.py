@@ -0,0 +1,39 @@
+'''RunMetrics: REST latency samples stay bounded however many calls a stage makes'''
+
+from gpr_address_update import metrics as m
+from gpr_address_update.metrics import RunMetrics, StageMetrics, LATENCY_SAMPLES
+
+def stageWith(latencies):
+	record = StageMetrics("GURAS")
+	for seconds in latencies:
+		record.restCalls += 1
+		record.addLatency(seconds)
+	return record
+
+def test_latency_sample_is_capped_and_max_is_exact():
+	metrics = RunMetrics(traceMemory=False)
+	metrics.begin("GURAS")
+	for i in range(LATENCY_SAMPLES * 3):
+		metrics.request(i / 1000, 0, 200)
+	report = metrics.report()["stages"][0]
+
+	assert len(metrics.records["GURAS"].restLatencies) == LATENCY_SAMPLES
+	assert report["restCalls"] == LATENCY_SAMPLES * 3
+	assert report["restLatencyMs"]["max"] == LATENCY_SAMPLES * 3 - 1
+	#Uniform over every call, so the median is near the middle call, not the last ones kept
+	assert abs(report["restLatencyMs"]["p50"] - LATENCY_SAMPLES * 1.5) < LATENCY_SAMPLES * 0.1
+
+def test_merged_samples_are_capped_in_proportion_to_calls(monkeypatch):
+	monkeypatch.setattr(m, "LATENCY_SAMPLES", 100)
+	record = stageWith([1.0] * 300)
+	other = stageWith([2.0] * 100)
+	record.mergeLatencies(other)
+
+	assert len(record.restLatencies) == 100
+	assert record.restLatencies.count(2.0) == 25
+	assert record.restLatencyMax == 2.0
+
+def test_small_samples_are_merged_whole():
+	record = stageWith([1.0, 3.0])
+	record.mergeLatencies(stageWith([2.0]))
+	assert sorted(record.restLatencies) == [1.0, 2.0, 3.0]
@@ -0,0 +1,35 @@
+'''ExceptionReport: files are only opened once a batch has rows'''
+
+import os
+
+import pandas as pd
+
+from gpr_address_update.report import ExceptionReport
+
+def rows(*address_ids):
+	return pd.DataFrame({"ADDRESS_ID": list(address_ids), "Exception_Reason": ["Not a 1-to-1 match"] * len(address_ids)})
+
+def test_empty_batches_open_nothing(tmp_path):
+	for reportFormat in ("xlsx", "csv"):
+		report = ExceptionReport(str(tmp_path), "empty_" + reportFormat, reportFormat)
+		report.add(rows())
+		report.addNoGuras(pd.DataFrame(columns=["ADDRESS_ID"]))
+		assert report.workbook is None
+		assert report.paths == []
+	assert os.listdir(str(tmp_path)) == []
+
+def test_first_batch_with_rows_opens_the_workbook(tmp_path):
+	report = ExceptionReport(str(tmp_path), "rows", "xlsx")
+	report.add(rows())
+	report.add(rows(1, 2))
+	assert report.workbook is not None
+	assert report.rows["exceptions"] == 2
+	assert report.addresses == {1, 2}
+	paths = report.close()
+	assert [os.path.basename(path) for path in paths] == ["AddressUpdateExceptions_rows.xlsx"]
+
+def test_closed_empty_report_still_has_both_csv_files(tmp_path):
+	report = ExceptionReport(str(tmp_path), "headers", "csv")
+	report.add(rows())
+	paths = report.close()
+	assert sorted(os.path.basename(path) for path in paths) == ["AddressUpdateExceptions_headers.csv", "AddressUpdateExceptions_headers_NoGURAS.csv"]
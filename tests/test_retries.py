@@ -0,0 +1,40 @@
+'''withRetries: unresolved addresses of incremental runs and the service'''
+
+import pandas as pd
+
+from gpr_address_update.candidates import withRetries
+
+class State:
+	def __init__(self, notDue, due):
+		self.notDueIDs, self.dueIDs = notDue, due
+	def notDue(self):
+		return self.notDueIDs
+	def dueRetries(self):
+		return self.dueIDs
+
+def batch(*address_ids):
+	return pd.DataFrame({"ADDRESS_ID": list(address_ids)})
+
+def addressIDs(batches):
+	return [list(df["ADDRESS_ID"]) for df in batches]
+
+def test_without_run_state_batches_are_unchanged():
+	batches = [batch(1, 2)]
+	assert withRetries(batches, None, lambda due: [batch(*due)]) is batches
+
+def test_not_due_addresses_are_skipped():
+	assert addressIDs(withRetries([batch(1, 2), batch(3)], State([2, 3], []), lambda due: [batch(*due)])) == [[1]]
+
+def test_due_addresses_not_in_the_batches_are_fetched():
+	fetched = list()
+	def fetchDue(due):
+		fetched.append(due)
+		return [batch(*due)]
+	assert addressIDs(withRetries([batch(1, 2)], State([], [2, 5, 6]), fetchDue)) == [[1, 2], [5, 6]]
+	assert fetched == [[5, 6]]
+
+def test_run_state_is_read_before_the_batches():
+	state = State([1], [])
+	batches = withRetries([batch(1, 2)], state, lambda due: [])
+	state.notDueIDs = []
+	assert addressIDs(batches) == [[2]]